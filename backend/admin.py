@@ -0,0 +1,72 @@
+import os
+import hmac
+from flask import Blueprint, request, jsonify
+from routes import route
+from model import MODEL_PATHS, backend_for, loaded_models, reload_models
+from cache import result_cache
+from artifacts import artifact_store
+from startup import IMPORT_SECONDS
+from fingerprint import near_duplicates
+from text_engine import sentence_memo
+
+admin_bp = Blueprint('admin_bp', __name__)
+
+# Admin routes are disabled unless ADMIN_TOKEN is set in the environment
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+def authorized():
+    # Constant-time comparison, so response timing doesn't reveal how much of a guess matched;
+    # compared as bytes, as compare_digest rejects non-ASCII str
+    supplied = request.headers.get("X-Admin-Token", "").encode()
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(supplied, ADMIN_TOKEN.encode())
+
+@route(admin_bp)
+def list_models():
+    if not authorized():
+        return jsonify({"error": "Unauthorized."}), 403
+    return jsonify({
+        "available": sorted(MODEL_PATHS),
+        "loaded": loaded_models(),
+        "backends": {name: backend_for(name) for name in sorted(MODEL_PATHS)}
+    })
+
+@route(admin_bp)
+def reload_weights():
+    if not authorized():
+        return jsonify({"error": "Unauthorized."}), 403
+    data = request.get_json(silent=True) or {}
+    try:
+        reloaded = reload_models(data.get("models"))
+    except KeyError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    return jsonify({"reloaded": reloaded})
+
+@route(admin_bp)
+def cache_stats():
+    if not authorized():
+        return jsonify({"error": "Unauthorized."}), 403
+    return jsonify(dict(result_cache.stats(), near_duplicate_entries=near_duplicates.stats(),
+                        sentence_memo=sentence_memo.stats()))
+
+@route(admin_bp)
+def artifact_stats():
+    if not authorized():
+        return jsonify({"error": "Unauthorized."}), 403
+    return jsonify(artifact_store.stats())
+
+@route(admin_bp)
+def sweep_artifacts():
+    if not authorized():
+        return jsonify({"error": "Unauthorized."}), 403
+    return jsonify({"removed": artifact_store.sweep()})
+
+@route(admin_bp)
+def startup_info():
+    if not authorized():
+        return jsonify({"error": "Unauthorized."}), 403
+    return jsonify({
+        "lazy_imports": os.environ.get("LAZY_IMPORTS", "0") == "1",
+        "import_seconds": {name: round(seconds, 3) for name, seconds in IMPORT_SECONDS.items()}
+    })
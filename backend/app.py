@@ -1,26 +1,66 @@
-from flask import Flask, jsonify
+from flask import Flask, jsonify, request
 from flask_cors import CORS
+from werkzeug.exceptions import ServiceUnavailable
 import os
 
-# Import your detection blueprints
-from detect_image import detect_image_bp
-from detect_video import detect_video_bp
-from detect_audio import detect_audio_bp
-from detect_text import detect_text_bp
+from metrics import metrics_bp
+from fetch import FETCH_LIMITS, MB, max_request_bytes, request_limit
+from startup import timed_import
+from routes import BLUEPRINTS, missing_routes, register_lazy_routes, upload_modality
+
+# With LAZY_IMPORTS=1 the detection modules (and torch, transformers, cv2 behind them) are imported
+# by the first request that needs them, so the process is up and answering in well under a second.
+# Leave it off when preloading (PRELOAD_APP=1) or warming models: the import then happens once up front.
+LAZY_IMPORTS = os.environ.get("LAZY_IMPORTS", "0") == "1"
 
 app = Flask(__name__)
 CORS(app)  # Enables cross-origin requests for all routes
+# Reject request bodies larger than the biggest per-modality upload limit before reading them;
+# limit_upload_size narrows this to the route's own modality
+app.config["MAX_CONTENT_LENGTH"] = max_request_bytes()
+
+@app.before_request
+def limit_upload_size():
+    # Runs before any view touches request.files/form, so an oversized body is refused unread
+    # instead of being spooled to a temporary file first
+    modality = upload_modality(request.endpoint, request.view_args)
+    if modality not in FETCH_LIMITS:
+        return None
+    limit = request_limit(modality)
+    if request.content_length is not None and request.content_length > limit:
+        return jsonify({"error": f"Upload exceeds the {limit // MB} MB limit for {modality}."}), 413
+    # Bodies without a Content-Length (chunked) stop being read at the limit (Flask >= 3.1)
+    try:
+        request.max_content_length = limit
+    except AttributeError:
+        pass
 
-# Register all detection blueprints with consistent /api prefix
-app.register_blueprint(detect_image_bp, url_prefix='/api')
-app.register_blueprint(detect_video_bp, url_prefix='/api')
-app.register_blueprint(detect_audio_bp, url_prefix='/api')
-app.register_blueprint(detect_text_bp, url_prefix='/api')
+@app.errorhandler(ServiceUnavailable)
+def service_unavailable(e):
+    # e.g. inference_server.InferenceTimeout; JSON like every other error this API returns
+    return jsonify({"error": e.description}), 503
+
+# Register all detection routes with consistent /api prefix
+# (both modes come from routes.ROUTES)
+if LAZY_IMPORTS:
+    register_lazy_routes(app)
+else:
+    for module, blueprint in BLUEPRINTS.items():
+        app.register_blueprint(getattr(timed_import(module), blueprint), url_prefix='/api')
+    if missing_routes(app):
+        raise RuntimeError(f"Listed in routes.ROUTES but not served: {', '.join(missing_routes(app))}")
+# Prometheus scrape target at /metrics (no /api prefix, as scrapers expect)
+app.register_blueprint(metrics_bp)
 
 # Ensure essential static folders exist
 for folder in ["static/uploads", "static/heatmaps", "static/results", "models"]:
     os.makedirs(folder, exist_ok=True)
 
+# Optionally load and warm every model at boot (once per gunicorn worker)
+# instead of on the first request to each endpoint
+if os.environ.get("WARMUP_MODELS", "0") == "1":
+    timed_import("model").warmup_models()
+
 @app.route('/')
 def index():
     return jsonify({
@@ -30,9 +70,20 @@ def index():
             "image_detection": "/api/detect-image [POST with file or url]",
             "video_detection": "/api/detect-video [POST with file or url]",
             "audio_detection": "/api/detect-audio [POST with file or url]",
-            "text_detection": "/api/detect-text [POST with file or url or raw text]"
+            "text_detection": "/api/detect-text [POST with file or url or raw text]",
+            "video_stream": "/api/detect-video/stream [POST, Server-Sent Events or ?format=ndjson]",
+            "audio_stream": "/api/detect-audio/stream [POST, Server-Sent Events or ?format=ndjson]",
+            "submit_job": "/api/jobs/<video|audio> [POST with file or url, returns job id]",
+            "job_status": "/api/jobs/<job_id> [GET status, progress and result]",
+            "batch": "/api/batch [POST files and/or a manifest of URLs, streams one result per item]",
+            "reload_models": "/api/admin/reload-models [POST, requires X-Admin-Token]",
+            "startup": "/api/admin/startup [GET import timings, requires X-Admin-Token]",
+            "metrics": "/metrics [GET, Prometheus text format; add ?timings=1 to a detect request for a JSON breakdown]"
         }
     })
 
 if __name__ == "__main__":
+    # Under gunicorn this happens per worker in gunicorn.conf.py
+    from model import configure_threads
+    configure_threads()
     app.run(debug=True, host='0.0.0.0', port=5000)
@@ -0,0 +1,159 @@
+import os
+import time
+import uuid
+import sqlite3
+import hashlib
+import threading
+
+# ---------- Settings (override via environment) ----------
+ARTIFACT_ROOT = "static"
+ARTIFACT_INDEX = os.environ.get("ARTIFACT_INDEX", "cache/artifacts.sqlite3")
+# Seconds each kind of artifact is kept
+ARTIFACT_TTL_SECONDS = {
+    "uploads": int(os.environ.get("UPLOAD_TTL_SECONDS", str(24 * 3600))),
+    "heatmaps": int(os.environ.get("HEATMAP_TTL_SECONDS", str(7 * 24 * 3600))),
+    "results": int(os.environ.get("RESULT_TTL_SECONDS", str(7 * 24 * 3600))),
+    # Async job records (jobs/<id>.json), counted from when the job finished
+    "jobs": int(os.environ.get("JOB_TTL_SECONDS", str(7 * 24 * 3600))),
+}
+# Total bytes across all kinds; oldest artifacts go first once exceeded
+ARTIFACT_MAX_BYTES = int(os.environ.get("ARTIFACT_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+ARTIFACT_SWEEP_SECONDS = int(os.environ.get("ARTIFACT_SWEEP_SECONDS", "300"))
+# Delete source uploads as soon as their analysis finishes
+EPHEMERAL_UPLOADS = os.environ.get("EPHEMERAL_UPLOADS", "0") == "1"
+# --------------------------------------------------
+
+def to_url(path):
+    return "/" + path.replace(os.sep, "/")
+
+def to_path(url):
+    return url.lstrip("/").replace("/", os.sep)
+
+class ArtifactStore:
+    # Files under static/<kind>/<2-char shard>/<name>, indexed with size and creation time
+    # so a background sweeper can enforce per-kind TTLs and a total size quota.
+    def __init__(self, root, index_path, ttls, max_bytes, sweep_seconds):
+        self.root = root
+        self.index_path = index_path
+        self.ttls = ttls
+        self.max_bytes = max_bytes
+        self.sweep_seconds = sweep_seconds
+        self.lock = threading.Lock()
+        self.pid = None
+        self._conn = None
+        self.sweeper_pid = None
+
+    @property
+    def conn(self):
+        # Connect lazily and per process, sqlite handles must not cross a fork
+        if self.pid != os.getpid():
+            os.makedirs(os.path.dirname(self.index_path) or ".", exist_ok=True)
+            self._conn = sqlite3.connect(self.index_path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS artifacts ("
+                "path TEXT PRIMARY KEY, kind TEXT, created REAL, size INTEGER)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS artifacts_created ON artifacts (created)")
+            self._conn.commit()
+            self.pid = os.getpid()
+        return self._conn
+
+    def path_for(self, kind, filename):
+        shard = hashlib.sha1(filename.encode()).hexdigest()[:2]
+        folder = os.path.join(self.root, kind, shard)
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, filename)
+
+    def new_path(self, kind, ext, prefix=""):
+        return self.path_for(kind, f"{prefix}{uuid.uuid4()}.{ext}")
+
+    def add(self, path, kind):
+        # Records a file that has just been written; returns its public URL
+        self.start_sweeper()
+        try:
+            size = os.path.getsize(path)
+        except OSError:
+            size = 0
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO artifacts VALUES (?, ?, ?, ?)", (path, kind, time.time(), size)
+            )
+            self.conn.commit()
+        return to_url(path)
+
+    def discard(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        with self.lock:
+            self.conn.execute("DELETE FROM artifacts WHERE path = ?", (path,))
+            self.conn.commit()
+
+    def finish_upload(self, path):
+        # Called once an upload has been analysed
+        if not path:
+            return
+        if EPHEMERAL_UPLOADS:
+            self.discard(path)
+        else:
+            self.add(path, "uploads")
+
+    def exists(self, url):
+        return os.path.exists(to_path(url))
+
+    def sweep(self):
+        now = time.time()
+        with self.lock:
+            expired = []
+            for kind, ttl in self.ttls.items():
+                expired += self.conn.execute(
+                    "SELECT path FROM artifacts WHERE kind = ? AND created < ?", (kind, now - ttl)
+                ).fetchall()
+            total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM artifacts").fetchone()[0]
+            over_quota = []
+            if total > self.max_bytes:
+                for path, size in self.conn.execute("SELECT path, size FROM artifacts ORDER BY created"):
+                    over_quota.append((path,))
+                    total -= size
+                    if total <= self.max_bytes:
+                        break
+        removed = 0
+        for (path,) in set(expired + over_quota):
+            self.discard(path)
+            removed += 1
+        return removed
+
+    def start_sweeper(self):
+        # One sweeper thread per process, started on first use (threads don't survive a fork)
+        if self.sweeper_pid == os.getpid():
+            return
+        self.sweeper_pid = os.getpid()
+
+        def loop():
+            while True:
+                time.sleep(self.sweep_seconds)
+                try:
+                    self.sweep()
+                except Exception as e:
+                    print(f"Artifact sweep failed: {e}")
+
+        threading.Thread(target=loop, daemon=True, name="artifact-sweeper").start()
+
+    def stats(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT kind, COUNT(*), COALESCE(SUM(size), 0) FROM artifacts GROUP BY kind"
+            ).fetchall()
+        return {kind: {"files": count, "bytes": size} for kind, count, size in rows}
+
+artifact_store = ArtifactStore(
+    ARTIFACT_ROOT, ARTIFACT_INDEX, ARTIFACT_TTL_SECONDS, ARTIFACT_MAX_BYTES, ARTIFACT_SWEEP_SECONDS
+)
+
+def artifacts_exist(result):
+    # False if a cached response points at a chart or heatmap the sweeper already removed
+    urls = [result.get("piechart_url"), result.get("heatmap_url")]
+    urls += [h.get("heatmap_url") for h in result.get("frame_heatmaps", [])]
+    return all(artifact_store.exists(url) for url in urls if url)
@@ -0,0 +1,614 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import deque
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from flask import Blueprint, request, jsonify
+from routes import route
+from model import CATEGORIES, predict_modality
+from fetch import FETCH_LIMITS, FetchError, fetch_to_file, save_upload
+from artifacts import artifact_store
+from charts import probabilities
+from cache import result_cache, cache_key, file_digest, text_digest
+from streaming import stream_response
+from metrics import bulk_items
+from fingerprint import NEAR_DUPLICATES, find_near_duplicate
+import detect_image
+import detect_video
+import detect_audio
+import detect_text
+
+# Bulk analysis of many items at once, over HTTP (POST /api/batch) or offline:
+#
+#     python batch.py /data/archive manifest.jsonl -o results.jsonl
+#     python batch.py /data/archive -o results.parquet      # directory of Parquet parts
+#
+# Items are grouped by modality. Files are fetched and decoded on a prefetching thread pool while
+# the model runs, images are scored BATCH_IMAGE_SIZE per forward and text documents are pooled into
+# shared sentence batches, so a run is bound by the forward pass rather than per-item overhead.
+# Re-running the same command resumes: ids already in the output are skipped.
+
+batch_bp = Blueprint('batch_bp', __name__)
+
+# ---------- Settings (override via environment) ----------
+# Threads fetching and decoding items ahead of the model
+BATCH_PREFETCH_WORKERS = int(os.environ.get("BATCH_PREFETCH_WORKERS", "4"))
+# Images per forward pass
+BATCH_IMAGE_SIZE = int(os.environ.get("BATCH_IMAGE_SIZE", "32"))
+# Sentences pooled from several text documents per predict_text call
+BATCH_TEXT_SENTENCES = int(os.environ.get("BATCH_TEXT_SENTENCES", "512"))
+# Items accepted by one POST /api/batch
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", "1000"))
+# Batch requests run concurrently by this worker before answering 429
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", "1"))
+# Directories (os.pathsep-separated) whose files an API manifest may name by path; URLs only when empty
+BATCH_LOCAL_ROOTS = [r for r in os.environ.get("BATCH_LOCAL_ROOTS", "").split(os.pathsep) if r]
+# Rows per Parquet part file
+BATCH_PARQUET_ROWS = int(os.environ.get("BATCH_PARQUET_ROWS", "1000"))
+# --------------------------------------------------
+
+# Fastest first, so a partial run has covered as many items as possible
+MODALITIES = ["image", "text", "audio", "video"]
+ALLOWED = {
+    "image": detect_image.allowed_file,
+    "video": detect_video.allowed_file,
+    "audio": detect_audio.allowed_file,
+    "text": detect_text.allowed_file,
+}
+DEFAULT_EXT = {"image": "jpg", "video": "mp4", "audio": "wav", "text": "txt"}
+
+batch_slots = threading.BoundedSemaphore(BATCH_CONCURRENCY)
+
+def is_url(source):
+    return source.startswith(("http://", "https://"))
+
+def modality_for(source):
+    name = urlparse(source).path if is_url(source) else source
+    for modality, allowed in ALLOWED.items():
+        if allowed(name):
+            return modality
+    return None
+
+def make_item(source, item_id=None, modality=None, base_dir=None):
+    if not is_url(source) and base_dir and not os.path.isabs(source):
+        source = os.path.join(base_dir, source)
+    return {"id": item_id or source, "source": source, "modality": modality or modality_for(source)}
+
+def parse_manifest(lines, base_dir=None):
+    # One item per line: a path or URL, or a JSON object {"source", "id"?, "modality"?}
+    items = []
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        if line.startswith("{"):
+            entry = json.loads(line)
+            items.append(make_item(entry["source"], entry.get("id"), entry.get("modality"), base_dir))
+        else:
+            items.append(make_item(line, base_dir=base_dir))
+    return items
+
+def walk_directory(root):
+    items = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            path = os.path.join(dirpath, name)
+            if modality_for(path):
+                items.append(make_item(path))
+    return items
+
+def collect_items(inputs, modalities=None):
+    # Directories are walked, anything else is read as a manifest
+    items = []
+    for entry in inputs:
+        if os.path.isdir(entry):
+            items.extend(walk_directory(entry))
+        else:
+            with open(entry, encoding="utf-8") as f:
+                items.extend(parse_manifest(f, os.path.dirname(os.path.abspath(entry))))
+    if modalities:
+        items = [item for item in items if item["modality"] in modalities]
+    return items
+
+def under_local_roots(path):
+    real = os.path.realpath(path)
+    return any(real.startswith(os.path.realpath(root) + os.sep) for root in BATCH_LOCAL_ROOTS)
+
+# ---------- Fetching and prefetch ----------
+def fetch_item(item):
+    # -> (local path, whether it is a temporary download to discard afterwards)
+    source, modality = item["source"], item["modality"]
+    if not is_url(source):
+        if not os.path.isfile(source):
+            raise FileNotFoundError(f"No such file: {source}")
+        return source, False
+    ext = os.path.splitext(urlparse(source).path)[1].lstrip(".").lower() or DEFAULT_EXT[modality]
+    path = artifact_store.new_path("uploads", ext)
+    try:
+        fetch_to_file(source, path, modality)
+    except Exception:
+        artifact_store.discard(path)
+        raise
+    return path, True
+
+def prefetch(load, items, depth):
+    # Runs load(item) on a thread pool at most depth items ahead of the consumer;
+    # yields (item, value, error) in input order
+    pool = ThreadPoolExecutor(max_workers=BATCH_PREFETCH_WORKERS, thread_name_prefix="prefetch")
+    pending = deque()
+    items = iter(items)
+    try:
+        for item in items:
+            pending.append((item, pool.submit(load, item)))
+            if len(pending) >= depth:
+                break
+        while pending:
+            item, future = pending.popleft()
+            following = next(items, None)
+            if following is not None:
+                pending.append((following, pool.submit(load, following)))
+            try:
+                yield item, future.result(), None
+            except Exception as e:
+                yield item, None, e
+    finally:
+        for _, future in pending:
+            future.cancel()
+        pool.shutdown(wait=True)
+
+# ---------- Records ----------
+def make_record(item, probs, details=None, cached=False):
+    probs = probs if isinstance(probs, dict) else probabilities(probs)
+    return {
+        "id": item["id"],
+        "modality": item["modality"],
+        "status": "ok",
+        "prediction": max(probs, key=probs.get),
+        "probabilities": probs,
+        "details": details or {},
+        "cached": cached,
+        "error": None,
+    }
+
+def error_record(item, error):
+    return {
+        "id": item["id"],
+        "modality": item["modality"],
+        "status": "error",
+        "prediction": None,
+        "probabilities": None,
+        "details": {},
+        "cached": False,
+        "error": str(error) or type(error).__name__,
+    }
+
+def result_probabilities(modality, result):
+    if result is None:
+        return None
+    return result.get("prediction" if modality == "image" else "probabilities")
+
+def cached_probabilities(modality, digest):
+    # Probabilities of a result the single-item routes already cached for this content, or None
+    return result_probabilities(modality, result_cache.get(cache_key(modality, digest)))
+
+def near_duplicate_probabilities(modality, hashes, digest, duration=None):
+    # Probabilities of an earlier verdict for perceptually similar content, or None
+    return result_probabilities(modality, find_near_duplicate(modality, hashes, digest, duration=duration))
+
+# ---------- Per-modality runners ----------
+def load_image(item):
+    path, temporary = fetch_item(item)
+    try:
+        digest = file_digest(path)
+        cached = cached_probabilities("image", digest)
+        if cached is not None:
+            return cached, None
+        tensor, hashes = detect_image.preprocess_image(path, fingerprint=NEAR_DUPLICATES)
+        return near_duplicate_probabilities("image", hashes, digest), tensor
+    finally:
+        if temporary:
+            artifact_store.discard(path)
+
+def run_images(items, progress):
+    pending = []
+
+    def flush():
+        batch = torch.cat([tensor for _, tensor in pending])
+        start = time.perf_counter()
+        try:
+            stages = []
+            probs = predict_modality("image", batch, BATCH_IMAGE_SIZE, stages)
+            records = [make_record(item, p, {"decided_by": stage})
+                       for (item, _), p, stage in zip(pending, probs, stages)]
+        except Exception as e:
+            records = [error_record(item, e) for item, _ in pending]
+        progress.inference_seconds += time.perf_counter() - start
+        pending.clear()
+        return records
+
+    for item, loaded, error in prefetch(load_image, items, BATCH_IMAGE_SIZE + 2 * BATCH_PREFETCH_WORKERS):
+        if error is not None:
+            yield error_record(item, error)
+            continue
+        cached, tensor = loaded
+        if cached is not None:
+            yield make_record(item, cached, cached=True)
+            continue
+        pending.append((item, tensor))
+        if len(pending) >= BATCH_IMAGE_SIZE:
+            yield from flush()
+    if pending:
+        yield from flush()
+
+def load_text(item):
+    path, temporary = fetch_item(item)
+    try:
+        max_bytes, _ = FETCH_LIMITS["text"]
+        if os.path.getsize(path) > max_bytes:
+            raise FetchError("Text file is too large.")
+        with open(path, encoding="utf-8", errors="replace") as f:
+            text = f.read()
+    finally:
+        if temporary:
+            artifact_store.discard(path)
+    sentences = detect_text.get_sentences(text)
+    if not sentences:
+        raise ValueError("No valid text found.")
+    cached = cached_probabilities("text", text_digest(text))
+    return cached, sentences
+
+def text_details(sentences, predictions):
+    suspicious = []
+    for idx, probs in enumerate(predictions):
+        if 1 - probs[CATEGORIES.index("original")] > 0.5:
+            suspicious.append({"sentence_idx": idx, "text": sentences[idx], "probabilities": probabilities(probs)})
+    return {"sentences": len(sentences), "suspicious_sentences": suspicious[:3]}
+
+def run_text(items, progress):
+    # Sentences of several documents share each predict_text call, then are split back per document
+    pending = []
+    pooled = 0
+
+    def flush():
+        sentences = [s for _, doc in pending for s in doc]
+        start = time.perf_counter()
+        try:
+            predictions = detect_text.predict_text(sentences)
+            records, offset = [], 0
+            for item, doc in pending:
+                doc_probs = predictions[offset:offset + len(doc)]
+                offset += len(doc)
+                records.append(make_record(item, np.mean(doc_probs, axis=0), text_details(doc, doc_probs)))
+        except Exception as e:
+            records = [error_record(item, e) for item, _ in pending]
+        progress.inference_seconds += time.perf_counter() - start
+        pending.clear()
+        return records
+
+    for item, loaded, error in prefetch(load_text, items, 4 * BATCH_PREFETCH_WORKERS):
+        if error is not None:
+            yield error_record(item, error)
+            continue
+        cached, sentences = loaded
+        if cached is not None:
+            yield make_record(item, cached, cached=True)
+            continue
+        pending.append((item, sentences))
+        pooled += len(sentences)
+        if pooled >= BATCH_TEXT_SENTENCES:
+            yield from flush()
+            pooled = 0
+    if pending:
+        yield from flush()
+
+def load_media(item):
+    # Video and audio are downloaded ahead; decoding streams inside their own pipelines
+    path, temporary = fetch_item(item)
+    try:
+        digest = file_digest(path)
+        cached = cached_probabilities(item["modality"], digest)
+        if cached is None:
+            fingerprint = detect_video.video_fingerprint if item["modality"] == "video" else detect_audio.audio_fingerprint
+            hashes, duration = fingerprint(path)
+            cached = near_duplicate_probabilities(item["modality"], hashes, digest, duration)
+            if cached is not None and item["modality"] == "audio":
+                detect_audio.discard_mel_spool(path)
+        return path, temporary, cached
+    except Exception:
+        if temporary:
+            artifact_store.discard(path)
+        raise
+
+def run_media(items, progress):
+    analyze = {"video": detect_video.analyze_video, "audio": detect_audio.analyze_audio}
+    for item, loaded, error in prefetch(load_media, items, BATCH_PREFETCH_WORKERS):
+        if error is not None:
+            yield error_record(item, error)
+            continue
+        path, temporary, cached = loaded
+        try:
+            if cached is not None:
+                yield make_record(item, cached, cached=True)
+                continue
+            # Decode and forward are interleaved in these pipelines, so their whole time counts as inference
+            start = time.perf_counter()
+            try:
+                response = analyze[item["modality"]](path)
+                details = {k: v for k, v in response.items() if k not in ("probabilities", "piechart_url")}
+                record = make_record(item, response["probabilities"], details)
+            except Exception as e:
+                record = error_record(item, e)
+            progress.inference_seconds += time.perf_counter() - start
+            yield record
+        finally:
+            if temporary:
+                artifact_store.discard(path)
+
+RUNNERS = {"image": run_images, "text": run_text, "audio": run_media, "video": run_media}
+
+def run_batch(items, progress):
+    # Yields one record per item, modality by modality
+    for item in items:
+        if item["modality"] not in RUNNERS:
+            yield error_record(item, ValueError("Unsupported or unknown file type."))
+    for modality in MODALITIES:
+        group = [item for item in items if item["modality"] == modality]
+        if group:
+            yield from RUNNERS[modality](group, progress)
+
+class BatchProgress:
+    def __init__(self, total, report_every=None, out=None):
+        self.total = total
+        self.report_every = report_every
+        self.out = out
+        self.done = 0
+        self.errors = 0
+        self.cached = 0
+        self.by_modality = {}
+        # Wall time spent in batched model calls; close to the elapsed time when the forward is the bottleneck
+        self.inference_seconds = 0.0
+        self.start = time.perf_counter()
+        self.last_report = self.start
+
+    def update(self, record):
+        modality = record["modality"] or "unknown"
+        counts = self.by_modality.setdefault(modality, {"done": 0, "errors": 0, "cached": 0})
+        self.done += 1
+        counts["done"] += 1
+        if record["status"] != "ok":
+            self.errors += 1
+            counts["errors"] += 1
+        elif record["cached"]:
+            self.cached += 1
+            counts["cached"] += 1
+        bulk_items.inc(modality=modality, status=record["status"])
+        if self.out and time.perf_counter() - self.last_report >= self.report_every:
+            self.last_report = time.perf_counter()
+            self.report()
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        return {
+            "items": self.total,
+            "done": self.done,
+            "errors": self.errors,
+            "cached": self.cached,
+            "seconds": round(elapsed, 2),
+            "items_per_second": round(self.done / elapsed, 2),
+            "inference_seconds": round(self.inference_seconds, 2),
+            "inference_share": round(min(self.inference_seconds / elapsed, 1.0), 3),
+            "by_modality": self.by_modality,
+        }
+
+    def report(self):
+        s = self.summary()
+        rate = s["items_per_second"]
+        eta = (self.total - self.done) / rate if rate else float("inf")
+        print(f"{self.done}/{self.total} items ({100.0 * self.done / max(self.total, 1):.1f}%), "
+              f"{rate:.1f} items/s, inference {s['inference_share']:.0%} of wall time, "
+              f"{self.errors} errors, eta {eta / 60:.1f} min", file=self.out, flush=True)
+
+# ---------- Outputs ----------
+class JsonlOutput:
+    # One record per line, flushed as written; the file itself is the checkpoint
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def completed(self):
+        # Ids already written; a line cut off by an interrupted run is truncated away
+        done = set()
+        if not os.path.exists(self.path):
+            return done
+        with open(self.path, "rb+") as f:
+            good = 0
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    done.add(json.loads(line)["id"])
+                except (ValueError, KeyError):
+                    break
+                good += len(line)
+            f.truncate(good)
+        return done
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.file = open(self.path, "a", encoding="utf-8")
+
+    def write(self, record):
+        self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+class ParquetOutput:
+    # A directory of part-NNNNN.parquet files, one per BATCH_PARQUET_ROWS records; an interrupted run
+    # loses at most the unwritten part. Probabilities become one float column per category.
+    def __init__(self, path, rows_per_part=BATCH_PARQUET_ROWS):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise RuntimeError("Parquet output needs pyarrow (pip install pyarrow)")
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.rows_per_part = rows_per_part
+        self.rows = []
+
+    def parts(self):
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(os.path.join(self.path, f) for f in os.listdir(self.path) if f.endswith(".parquet"))
+
+    def completed(self):
+        done = set()
+        for part in self.parts():
+            done.update(self.pq.read_table(part, columns=["id"]).column("id").to_pylist())
+        return done
+
+    def reset(self):
+        for part in self.parts():
+            os.remove(part)
+
+    def open(self):
+        os.makedirs(self.path, exist_ok=True)
+
+    def write(self, record):
+        probs = record["probabilities"] or {}
+        row = {k: record[k] for k in ("id", "modality", "status", "prediction", "cached", "error")}
+        for category in CATEGORIES:
+            row[f"prob_{category}"] = probs.get(category)
+        row["details"] = json.dumps(record["details"])
+        self.rows.append(row)
+        if len(self.rows) >= self.rows_per_part:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        part = os.path.join(self.path, f"part-{len(self.parts()):05d}.parquet")
+        tmp = part + ".tmp"
+        self.pq.write_table(self.pa.Table.from_pylist(self.rows), tmp)
+        os.replace(tmp, part)
+        self.rows = []
+
+    def close(self):
+        self.flush()
+
+def open_output(path, fmt="auto"):
+    if fmt == "parquet" or (fmt == "auto" and path.endswith(".parquet")):
+        return ParquetOutput(path)
+    return JsonlOutput(path)
+
+# ---------- HTTP ----------
+def receive_batch():
+    # Uploaded files ("files", repeated) and/or a manifest of URLs (and paths under BATCH_LOCAL_ROOTS),
+    # as a "manifest" form field or a JSON body {"items": [...]} -> (items, temporary upload paths)
+    items, uploads = [], []
+    body = request.get_json(silent=True) or {}
+    if body.get("items"):
+        lines = [json.dumps(i) if isinstance(i, dict) else i for i in body["items"]]
+    else:
+        lines = request.form.get("manifest", "").splitlines()
+    for item in parse_manifest(lines):
+        if not is_url(item["source"]) and not under_local_roots(item["source"]):
+            raise ValueError(f"Local paths are not allowed here: {item['source']}")
+        items.append(item)
+    files = request.files.getlist("files")
+    if len(items) + len(files) > BATCH_MAX_ITEMS:
+        raise ValueError(f"At most {BATCH_MAX_ITEMS} items per batch.")
+    for file in files:
+        modality = modality_for(file.filename or "")
+        item = {"id": file.filename, "source": None, "modality": modality}
+        if modality:
+            path = artifact_store.new_path("uploads", DEFAULT_EXT[modality])
+            uploads.append(path)
+            save_upload(file, path, modality)
+            item["source"] = path
+        items.append(item)
+    return items, uploads
+
+@route(batch_bp)
+def batch():
+    # Results stream back as "item" events (SSE, or NDJSON with ?format=ndjson), then a "done" summary
+    if not batch_slots.acquire(blocking=False):
+        response = jsonify({"error": "A batch is already running, retry later."})
+        response.headers["Retry-After"] = "30"
+        return response, 429
+    uploads = []
+    try:
+        items, uploads = receive_batch()
+        if not items:
+            raise ValueError("No files or manifest provided.")
+    except (ValueError, FetchError) as e:
+        for path in uploads:
+            artifact_store.discard(path)
+        batch_slots.release()
+        return jsonify({"error": str(e)}), 400
+
+    progress = BatchProgress(len(items))
+
+    def events():
+        for record in run_batch(items, progress):
+            progress.update(record)
+            yield "item", record
+            if progress.done % 100 == 0:
+                yield "progress", progress.summary()
+        yield "done", progress.summary()
+
+    def cleanup():
+        for path in uploads:
+            artifact_store.discard(path)
+        batch_slots.release()
+
+    return stream_response(events(), on_close=cleanup)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyse a directory tree or manifest of media in bulk")
+    parser.add_argument("inputs", nargs="+", help="Directories to walk and/or manifests (one path, URL or JSON object per line)")
+    parser.add_argument("-o", "--output", required=True, help="JSONL file, or a directory of Parquet parts if it ends in .parquet")
+    parser.add_argument("--format", choices=["auto", "jsonl", "parquet"], default="auto")
+    parser.add_argument("--modality", action="append", choices=MODALITIES, help="Only these modalities (repeatable)")
+    parser.add_argument("--restart", action="store_true", help="Discard existing output instead of resuming from it")
+    parser.add_argument("--report-every", type=float, default=10.0, help="Seconds between progress lines")
+    args = parser.parse_args()
+
+    import charts
+    from model import configure_threads
+    # Bulk records carry probabilities only, so skip rendering chart images
+    charts.CHART_MODE = "client"
+    configure_threads()
+
+    output = open_output(args.output, args.format)
+    if args.restart:
+        output.reset()
+    done = output.completed()
+    items = [item for item in collect_items(args.inputs, args.modality) if item["id"] not in done]
+    print(f"{len(items)} items to analyse ({len(done)} already in {args.output})", file=sys.stderr)
+
+    progress = BatchProgress(len(items), args.report_every, sys.stderr)
+    output.open()
+    try:
+        for record in run_batch(items, progress):
+            output.write(record)
+            progress.update(record)
+    finally:
+        output.close()
+        progress.report()
+        print(json.dumps(progress.summary(), indent=2))
@@ -0,0 +1,410 @@
+import os
+import sys
+import json
+import time
+import wave
+import random
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Benchmarks the four /api/detect-* endpoints through the Flask test client against synthetic,
+# offline fixtures (random-weight models, generated media) and prints machine-readable JSON:
+#
+#     python benchmark.py --requests 20 --concurrency 1,4 --output bench.json
+#
+# --thread-sweep instead runs every split of the cores into gunicorn-like worker processes, concurrent
+# ensemble members and torch threads, and reports which one gives the most throughput per endpoint.
+#
+# Everything is created in a scratch working directory, so real weights in models/ are never touched.
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+WORDS = (
+    "the a minister report video image said official claims photo new city police according "
+    "government people year after online viral footage shared reportedly million court week "
+    "statement experts altered original source published shows during before told evidence"
+).split()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the detection endpoints offline")
+    parser.add_argument("--workdir", help="Scratch directory for fixtures (default: a new temp dir)")
+    parser.add_argument("--endpoints", default="image,video,audio,text")
+    parser.add_argument("--requests", type=int, default=10, help="Timed requests per endpoint and concurrency level")
+    parser.add_argument("--concurrency", default="1", help="Comma-separated client thread counts, e.g. 1,4")
+    parser.add_argument("--image-size", default="1280x720")
+    parser.add_argument("--video-seconds", type=float, default=10)
+    parser.add_argument("--video-fps", type=int, default=30)
+    parser.add_argument("--video-size", default="640x360")
+    parser.add_argument("--audio-seconds", type=float, default=30)
+    parser.add_argument("--sentences", type=int, default=200)
+    parser.add_argument("--with-cache", action="store_true", help="Leave the result cache and text memo on (repeat requests hit them)")
+    parser.add_argument("--cascade", action="store_true",
+                        help="Also write screening checkpoints, so requests go through the early-exit cascade")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    parser.add_argument("--thread-sweep", action="store_true",
+                        help="Compare worker/member/thread splits; --concurrency's largest value is the total client count")
+    parser.add_argument("--cores", type=int, default=0, help="Cores to split in --thread-sweep (default: all visible)")
+    # Used by --thread-sweep for its worker processes
+    parser.add_argument("--worker-index", type=int, default=0, help=argparse.SUPPRESS)
+    parser.add_argument("--workers", type=int, default=1, help=argparse.SUPPRESS)
+    parser.add_argument("--reuse-fixtures", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def size_arg(value):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+# ---------- Synthetic fixtures ----------
+
+def make_resnet_checkpoints(seed, cascade=False):
+    # Screening checkpoints only with --cascade: their presence switches the cascade on (CASCADE=auto)
+    import torch
+    from model import MODEL_ARCHS, MODEL_PATHS, SCREENS, build_resnet_model
+    os.makedirs("models", exist_ok=True)
+    screens = set(SCREENS.values())
+    for i, (name, path) in enumerate(sorted(MODEL_PATHS.items())):
+        if name.startswith("text_model"):
+            continue
+        if name in screens and not cascade:
+            if os.path.exists(path):
+                os.remove(path)  # left by an earlier --cascade run in the same workdir
+            continue
+        torch.manual_seed(seed + i)
+        torch.save(build_resnet_model(arch=MODEL_ARCHS.get(name, "resnet50")).state_dict(), path)
+
+def make_text_models(seed):
+    # Random-weight DistilBERT/RoBERTa classifiers with a word-level tokenizer saved next to them
+    import torch
+    from tokenizers import Tokenizer, models as tok_models, pre_tokenizers
+    from transformers import (DistilBertConfig, DistilBertForSequenceClassification, PreTrainedTokenizerFast,
+                              RobertaConfig, RobertaForSequenceClassification)
+    from model import CATEGORIES, MODEL_PATHS
+    specials = ["[PAD]", "[UNK]", "[CLS]", "[SEP]"]
+    vocab = {token: i for i, token in enumerate(specials + sorted(set(WORDS)))}
+    tokenizer_model = Tokenizer(tok_models.WordLevel(vocab, unk_token="[UNK]"))
+    tokenizer_model.pre_tokenizer = pre_tokenizers.Whitespace()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer_model, pad_token="[PAD]", unk_token="[UNK]",
+        cls_token="[CLS]", sep_token="[SEP]", model_max_length=512,
+        model_input_names=["input_ids", "attention_mask"],
+    )
+    configs = {
+        "text_model_1": (DistilBertForSequenceClassification, DistilBertConfig(
+            vocab_size=len(vocab), num_labels=len(CATEGORIES), pad_token_id=0)),
+        "text_model_2": (RobertaForSequenceClassification, RobertaConfig(
+            vocab_size=len(vocab), num_labels=len(CATEGORIES), pad_token_id=0,
+            bos_token_id=2, eos_token_id=3, max_position_embeddings=514)),
+    }
+    for i, (name, (model_cls, config)) in enumerate(configs.items()):
+        torch.manual_seed(seed + 100 + i)
+        model_cls(config).save_pretrained(MODEL_PATHS[name])
+        tokenizer.save_pretrained(MODEL_PATHS[name])
+
+def make_image(path, size, rng):
+    import numpy as np
+    from PIL import Image
+    width, height = size
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([x * 255 / width, y * 255 / height, (x + y) * 127 / (width + height)], axis=-1)
+    noise = rng.integers(0, 40, size=(height, width, 3))
+    Image.fromarray(np.uint8(np.clip(base + noise, 0, 255))).save(path, quality=90)
+
+def make_video(path, seconds, fps, size, rng):
+    import cv2
+    import numpy as np
+    width, height = size
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, (width, height))
+    for i in range(int(seconds * fps)):
+        frame = np.full((height, width, 3), 40, dtype=np.uint8)
+        # A moving "face" plus a scene cut every 3 seconds, so the clip isn't trivially static
+        shade = 60 + 50 * ((i // (3 * fps)) % 3)
+        frame[:, :] = shade
+        cx = int((i * 5) % width)
+        cv2.circle(frame, (cx, height // 2), height // 5, (200, 180, 160), -1)
+        frame += rng.integers(0, 10, size=frame.shape, dtype=np.uint8)
+        writer.write(frame)
+    writer.release()
+
+def make_wav(path, seconds, rng, sr=16000):
+    import numpy as np
+    t = np.arange(int(seconds * sr)) / sr
+    signal = 0.3 * np.sin(2 * np.pi * 220 * t) * (1 + np.sin(2 * np.pi * 0.5 * t)) / 2
+    signal += 0.05 * rng.standard_normal(len(t))
+    with wave.open(path, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sr)
+        f.writeframes(np.int16(np.clip(signal, -1, 1) * 32767).tobytes())
+
+def make_text(n_sentences, rnd):
+    sentences = []
+    for _ in range(n_sentences):
+        words = [rnd.choice(WORDS) for _ in range(rnd.randint(5, 40))]
+        sentences.append(" ".join(words).capitalize() + ".")
+    return " ".join(sentences)
+
+def make_fixtures(args):
+    # With --reuse-fixtures only the paths (and the deterministic text) are returned
+    import numpy as np
+    rng = np.random.default_rng(args.seed)
+    rnd = random.Random(args.seed)
+    endpoints = set(args.endpoints.split(","))
+    write = not args.reuse_fixtures
+    os.makedirs("fixtures", exist_ok=True)
+    fixtures = {}
+    if write and endpoints & {"image", "video", "audio"}:
+        make_resnet_checkpoints(args.seed, args.cascade)
+    if "text" in endpoints:
+        if write:
+            make_text_models(args.seed)
+        fixtures["text"] = make_text(args.sentences, rnd)
+    if "image" in endpoints:
+        fixtures["image"] = "fixtures/image.jpg"
+        if write:
+            make_image(fixtures["image"], size_arg(args.image_size), rng)
+    if "video" in endpoints:
+        fixtures["video"] = "fixtures/video.mp4"
+        if write:
+            make_video(fixtures["video"], args.video_seconds, args.video_fps, size_arg(args.video_size), rng)
+    if "audio" in endpoints:
+        fixtures["audio"] = "fixtures/audio.wav"
+        if write:
+            make_wav(fixtures["audio"], args.audio_seconds, rng)
+    return fixtures
+
+# ---------- Measurement ----------
+
+class RssSampler:
+    # Peak resident set size while running, sampled from /proc (falls back to ru_maxrss)
+    def __init__(self, interval=0.02):
+        self.interval = interval
+        self.peak = 0
+        self.running = False
+
+    @staticmethod
+    def current_rss():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError, IndexError):
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def loop(self):
+        while self.running:
+            self.peak = max(self.peak, self.current_rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.running = True
+        self.peak = self.current_rss()
+        self.thread = threading.Thread(target=self.loop, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+        self.peak = max(self.peak, self.current_rss())
+
+def send(client, endpoint, fixture):
+    if endpoint == "text":
+        return client.post("/api/detect-text", data={"text": fixture})
+    ext = os.path.splitext(fixture)[1]
+    with open(fixture, "rb") as f:
+        return client.post(f"/api/detect-{endpoint}", data={"file": (f, f"upload{ext}")},
+                           content_type="multipart/form-data")
+
+def summarize(latencies, errors, wall, rss_peak):
+    import numpy as np
+    lat = np.array(latencies) * 1000.0
+    return {
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "p50_ms": float(np.percentile(lat, 50)) if len(lat) else None,
+        "p95_ms": float(np.percentile(lat, 95)) if len(lat) else None,
+        "p99_ms": float(np.percentile(lat, 99)) if len(lat) else None,
+        "mean_ms": float(lat.mean()) if len(lat) else None,
+        "throughput_rps": len(latencies) / wall if wall > 0 else None,
+        "peak_rss_mb": rss_peak / (1024 * 1024),
+    }
+
+def run_endpoint(app, endpoint, fixture, n_requests, concurrency):
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker(count):
+        client = app.test_client()
+        for _ in range(count):
+            start = time.perf_counter()
+            response = send(client, endpoint, fixture)
+            elapsed = time.perf_counter() - start
+            with lock:
+                if response.status_code == 200:
+                    latencies.append(elapsed)
+                else:
+                    errors.append(response.get_json(silent=True))
+
+    per_thread = [n_requests // concurrency + (1 if i < n_requests % concurrency else 0) for i in range(concurrency)]
+    with RssSampler() as rss:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(worker, per_thread))
+        wall = time.perf_counter() - start
+    result = summarize(latencies, len(errors), wall, rss.peak)
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=BACKEND_DIR, text=True).strip()
+    except Exception:
+        return None
+
+# ---------- Thread sweep ----------
+
+def thread_splits(cores):
+    # (workers, concurrent ensemble members) pairs that divide the cores evenly
+    for workers in range(1, cores + 1):
+        if cores % workers:
+            continue
+        for parallel in (1, 2):
+            if cores // workers >= parallel:
+                yield workers, parallel
+
+def run_split(args, workdir, cpus, workers, parallel):
+    # Runs one benchmark process per simulated worker at the same time, pinned like gunicorn.conf.py would
+    total_clients = max(int(c) for c in args.concurrency.split(","))
+    env = dict(os.environ, ENSEMBLE_PARALLEL=str(parallel), PIN_WORKER_CPUS="1", TORCH_INTRA_THREADS="0")
+    command = [
+        sys.executable, os.path.join(BACKEND_DIR, "benchmark.py"), "--workdir", workdir, "--reuse-fixtures",
+        "--endpoints", args.endpoints, "--sentences", str(args.sentences), "--seed", str(args.seed),
+        "--requests", str(max(1, args.requests // workers)),
+        "--concurrency", str(max(1, total_clients // workers)), "--workers", str(workers),
+    ] + (["--with-cache"] if args.with_cache else [])
+    outputs = [os.path.join(workdir, f"split-{workers}x{parallel}-{i}.json") for i in range(workers)]
+    procs = [
+        subprocess.Popen(command + ["--worker-index", str(i), "--output", out], env=env,
+                         stdout=subprocess.DEVNULL, preexec_fn=lambda: os.sched_setaffinity(0, cpus))
+        for i, out in enumerate(outputs)
+    ]
+    for proc in procs:
+        proc.wait()
+    reports = []
+    for out in outputs:
+        with open(out) as f:
+            reports.append(json.load(f))
+    results = {}
+    for endpoint in args.endpoints.split(","):
+        runs = [next(v for k, v in r["results"][endpoint].items() if k.startswith("concurrency_")) for r in reports]
+        results[endpoint] = {
+            "throughput_rps": sum(run["throughput_rps"] or 0 for run in runs),
+            "p50_ms": max(run["p50_ms"] or 0 for run in runs),
+            "p95_ms": max(run["p95_ms"] or 0 for run in runs),
+            "errors": sum(run["errors"] for run in runs),
+        }
+    return {
+        "workers": workers,
+        "ensemble_parallel": parallel,
+        "intra_op_threads": max(1, len(cpus) // workers // parallel),
+        "threads": reports[0]["meta"]["threads"],
+        "results": results,
+    }
+
+def thread_sweep(args, workdir):
+    cpus = sorted(os.sched_getaffinity(0))
+    if args.cores:
+        cpus = cpus[:args.cores]
+    splits = [run_split(args, workdir, cpus, workers, parallel) for workers, parallel in thread_splits(len(cpus))]
+    best = {
+        endpoint: max(splits, key=lambda s: s["results"][endpoint]["throughput_rps"])
+        for endpoint in args.endpoints.split(",")
+    }
+    return {
+        "cores": len(cpus),
+        "splits": splits,
+        "best": {
+            endpoint: {"workers": s["workers"], "ensemble_parallel": s["ensemble_parallel"],
+                       "intra_op_threads": s["intra_op_threads"], **s["results"][endpoint]}
+            for endpoint, s in best.items()
+        },
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output) if args.output else None
+    workdir = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="deepfake-bench-"))
+    os.makedirs(workdir, exist_ok=True)
+    # The app resolves models/, static/ and cache/ relative to the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, BACKEND_DIR)
+    if not args.with_cache:
+        os.environ["RESULT_CACHE_BACKEND"] = "none"
+        os.environ["RESULT_CACHE_MEMORY_ITEMS"] = "0"
+        # Repeat requests would otherwise be served sentence by sentence from the text memo
+        os.environ["TEXT_MEMO_ITEMS"] = "0"
+
+    started = time.perf_counter()
+    fixtures = make_fixtures(args)
+    fixture_seconds = time.perf_counter() - started
+
+    if args.thread_sweep:
+        report = {"meta": {"commit": git_commit(), "args": vars(args)}, "sweep": thread_sweep(args, workdir)}
+        text = json.dumps(report, indent=2)
+        print(text)
+        if output:
+            with open(output, "w") as f:
+                f.write(text)
+        return report
+
+    started = time.perf_counter()
+    from app import app
+    from model import configure_threads
+    threads = configure_threads(args.worker_index, args.workers)
+    import_seconds = time.perf_counter() - started
+
+    import torch
+    results = {}
+    for endpoint in args.endpoints.split(","):
+        fixture = fixtures[endpoint]
+        started = time.perf_counter()
+        warmup = send(app.test_client(), endpoint, fixture)
+        results[endpoint] = {
+            "first_request_ms": (time.perf_counter() - started) * 1000.0,
+            "first_request_status": warmup.status_code,
+        }
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            results[endpoint][f"concurrency_{concurrency}"] = run_endpoint(
+                app, endpoint, fixture, args.requests, concurrency
+            )
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "torch": torch.__version__,
+            "torch_threads": torch.get_num_threads(),
+            "threads": threads,
+            "cpu_count": os.cpu_count(),
+            "workdir": workdir,
+            "fixture_seconds": fixture_seconds,
+            "app_import_seconds": import_seconds,
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if output:
+        with open(output, "w") as f:
+            f.write(text)
+    return report
+
+if __name__ == "__main__":
+    main()
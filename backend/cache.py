@@ -0,0 +1,283 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from artifacts import artifacts_exist
+from metrics import cache_lookups, timed
+
+# ---------- Settings (override via environment) ----------
+# Entries kept in the per-worker in-memory tier
+CACHE_MEMORY_ITEMS = int(os.environ.get("RESULT_CACHE_MEMORY_ITEMS", "512"))
+# On-disk tier shared by all workers: "sqlite", "directory" or "none"
+CACHE_BACKEND = os.environ.get("RESULT_CACHE_BACKEND", "sqlite")
+CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "cache/results")
+CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# --------------------------------------------------
+
+# Digests computed while a file was being written (see fetch.py), keyed on path and checked against size/mtime
+_stream_digests = OrderedDict()
+_stream_digests_lock = threading.Lock()
+
+def remember_digest(path, digest):
+    st = os.stat(path)
+    with _stream_digests_lock:
+        _stream_digests[path] = (st.st_size, st.st_mtime, digest)
+        while len(_stream_digests) > 1024:
+            _stream_digests.popitem(last=False)
+
+def file_digest(path):
+    st = os.stat(path)
+    with _stream_digests_lock:
+        known = _stream_digests.get(path)
+    if known and known[:2] == (st.st_size, st.st_mtime):
+        return known[2]
+    digest = hashlib.sha256()
+    with timed("hash"), open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def text_digest(text):
+    # Whitespace-insensitive, so the same article pasted twice hits the cache
+    normalized = re.sub(r"\s+", " ", text).strip()
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def cache_key(modality, digest):
+    from model import model_version  # keeps this module (and fetch.py) free of torch at import time
+    return f"{modality}:{model_version(modality)}:{digest}"
+
+class MemoryTier:
+    def __init__(self, max_items, ttl):
+        self.max_items = max_items
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                return None
+            created, value = entry
+            if time.time() - created > self.ttl:
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (time.time(), value)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+class SQLiteTier:
+    def __init__(self, path, ttl, max_bytes):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.path = path
+        self.lock = threading.Lock()
+        self.pid = None
+        self._conn = None
+
+    @property
+    def conn(self):
+        # Connect lazily and per process, sqlite handles must not cross a fork
+        if self.pid != os.getpid():
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value TEXT, created REAL, accessed REAL, size INTEGER)"
+            )
+            self._conn.commit()
+            self.pid = os.getpid()
+        return self._conn
+
+    def get(self, key):
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute("SELECT value, created FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl:
+                self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self.conn.commit()
+                return None
+            self.conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+        return json.loads(row[0])
+
+    def set(self, key, value):
+        data = json.dumps(value)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)", (key, data, now, now, len(data))
+            )
+            self.evict(now)
+            self.conn.commit()
+
+    def evict(self, now):
+        self.conn.execute("DELETE FROM results WHERE created < ?", (now - self.ttl,))
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until we are back under quota
+        for key, size in self.conn.execute("SELECT key, size FROM results ORDER BY accessed").fetchall():
+            self.conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+class DirectoryTier:
+    # One JSON file per key, sharded by hash prefix; file mtime doubles as last access
+    EVICT_EVERY = 64
+
+    def __init__(self, path, ttl, max_bytes):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.writes = 0
+        self.lock = threading.Lock()
+
+    def file_for(self, key):
+        name = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.path, name[:2], name + ".json")
+
+    def get(self, key):
+        path = self.file_for(key)
+        try:
+            with open(path, encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry["created"] > self.ttl:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+        os.utime(path)
+        return entry["value"]
+
+    def set(self, key, value):
+        path = self.file_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Unique per call: the job pool and a request thread may store the same digest at once
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"created": time.time(), "value": value}, f)
+            os.replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+        with self.lock:
+            self.writes += 1
+            if self.writes % self.EVICT_EVERY == 0:
+                self.evict()
+
+    def evict(self):
+        now = time.time()
+        entries = []
+        for root, _, files in os.walk(self.path):
+            for f in files:
+                p = os.path.join(root, f)
+                try:
+                    st = os.stat(p)
+                except OSError:
+                    continue
+                if now - st.st_mtime > self.ttl:
+                    os.remove(p)
+                else:
+                    entries.append((st.st_mtime, st.st_size, p))
+        total = sum(e[1] for e in entries)
+        for _, size, p in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(p)
+            except OSError:
+                pass
+            total -= size
+
+class ResultCache:
+    def __init__(self, memory, disk=None):
+        self.memory = memory
+        self.disk = disk
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        # -> (value or None, whether it came from the disk tier)
+        with timed("cache_lookup"):
+            value = self.memory.get(key)
+            from_disk = False
+            if value is None and self.disk is not None:
+                value = self.disk.get(key)
+                if value is not None:
+                    from_disk = True
+                    self.memory.set(key, value)
+            # Charts/heatmaps may have been swept since; recompute rather than return dead URLs
+            if value is not None and not artifacts_exist(value):
+                value = None
+        return value, from_disk
+
+    def peek(self, key):
+        # Like get, without counting towards the hit/miss statistics
+        return self.lookup(key)[0]
+
+    def get(self, key):
+        value, from_disk = self.lookup(key)
+        if from_disk and value is not None:
+            self.disk_hits += 1
+        if value is None:
+            self.misses += 1
+            cache_lookups.inc(result="miss")
+        else:
+            self.hits += 1
+            cache_lookups.inc(result="hit")
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_items": len(self.memory.items),
+            "backend": CACHE_BACKEND,
+        }
+
+def build_cache():
+    memory = MemoryTier(CACHE_MEMORY_ITEMS, CACHE_TTL_SECONDS)
+    if CACHE_BACKEND == "sqlite":
+        disk = SQLiteTier(CACHE_PATH + ".sqlite3", CACHE_TTL_SECONDS, CACHE_MAX_BYTES)
+    elif CACHE_BACKEND == "directory":
+        disk = DirectoryTier(CACHE_PATH, CACHE_TTL_SECONDS, CACHE_MAX_BYTES)
+    else:
+        disk = None
+    return ResultCache(memory, disk)
+
+result_cache = build_cache()
+
+def cached_response(response, hit):
+    response.headers["X-Cache"] = "HIT" if hit else "MISS"
+    return response
@@ -0,0 +1,182 @@
+import os
+import sys
+import json
+import time
+import argparse
+from itertools import islice
+import numpy as np
+import torch
+from model import (CASCADE_BANDS, CATEGORIES, SCREENS, ensemble_predict_batch, ensemble_weights, frames_to_tensor,
+                   get_ensemble, get_model, preprocess_image, uncertain_rows)
+
+# Picks the early-exit cascade's uncertainty band for one modality from a labeled folder laid out as
+# <folder>/<category>/<files>, category being one of model.CATEGORIES:
+#
+#     python calibrate_cascade.py image data/labeled_images --max-drop 0.005
+#
+# Every sample (an image, sampled video frames, audio windows) goes through both the screening model and
+# the full ensemble, each timed per batch. Every band of the grid is then replayed offline: samples whose
+# screening tampered score is inside the band take the ensemble's answer, the rest the screen's. The report
+# gives accuracy and compute per band, and the cheapest band within --max-drop of the ensemble's accuracy.
+
+LOWS = [0.0, 0.01, 0.02, 0.05, 0.1, 0.2, 0.3, 0.4]
+HIGHS = [0.6, 0.7, 0.8, 0.9, 0.95, 0.98, 0.99, 1.0]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure accuracy vs compute of the screening cascade")
+    parser.add_argument("modality", choices=sorted(SCREENS))
+    parser.add_argument("folder", help="Labeled inputs in <folder>/<category>/")
+    parser.add_argument("--limit", type=int, default=0, help="Files per category (default: all)")
+    parser.add_argument("--samples-per-file", type=int, default=8, help="Frames per video / windows per audio file")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--max-drop", type=float, default=0.01,
+                        help="Accuracy the cascade may lose against the ensemble alone")
+    parser.add_argument("--output", help="Write the JSON report here as well as to stdout")
+    return parser.parse_args(argv)
+
+def labeled_files(folder, limit):
+    # -> [(path, category index)]
+    files = []
+    for category in sorted(os.listdir(folder)):
+        path = os.path.join(folder, category)
+        if not os.path.isdir(path):
+            continue
+        if category not in CATEGORIES:
+            raise ValueError(f"{path}: not one of {CATEGORIES}")
+        names = sorted(os.listdir(path))
+        files.extend((os.path.join(path, name), CATEGORIES.index(category)) for name in names[:limit or None])
+    if not files:
+        raise ValueError(f"{folder}: no labeled files")
+    return files
+
+def load_samples(modality, path, samples_per_file):
+    # -> [n, 3, 224, 224] tensor of the samples the endpoint would score for this file
+    if modality == "image":
+        return preprocess_image(path)
+    if modality == "video":
+        from video_decode import VideoDecoder
+        decoder = VideoDecoder(path, size=(224, 224), threaded=False)
+        try:
+            frames = [frame.copy() for _, _, frame, _ in islice(decoder, samples_per_file)]
+        finally:
+            decoder.close()
+        return frames_to_tensor(frames) if frames else None
+    from detect_audio import iter_audio_blocks, iter_mel_frames, iter_windows, power_to_db, preprocess_spec
+    windows = [w for _, w in islice(iter_windows(iter_mel_frames(iter_audio_blocks(path))), samples_per_file)]
+    return preprocess_spec(power_to_db(np.stack(windows))) if windows else None
+
+def timed_predict(models, batch, weights=None):
+    start = time.perf_counter()
+    probs = ensemble_predict_batch(models, batch, len(batch), weights)
+    return probs, time.perf_counter() - start
+
+def collect(args):
+    # -> (labels [N], screen probs [N, C], ensemble probs [N, C], screen seconds, ensemble seconds)
+    screen = [get_model(SCREENS[args.modality])]
+    ensemble = get_ensemble(args.modality)
+    weights = ensemble_weights(args.modality)
+    labels, screen_probs, ensemble_probs = [], [], []
+    screen_seconds = ensemble_seconds = 0.0
+    pending, pending_labels = [], []
+
+    def flush():
+        nonlocal screen_seconds, ensemble_seconds
+        batch = torch.cat(pending)
+        probs, seconds = timed_predict(screen, batch)
+        screen_probs.append(probs)
+        screen_seconds += seconds
+        probs, seconds = timed_predict(ensemble, batch, weights)
+        ensemble_probs.append(probs)
+        ensemble_seconds += seconds
+        labels.extend(pending_labels)
+        pending.clear()
+        pending_labels.clear()
+
+    for path, label in labeled_files(args.folder, args.limit):
+        try:
+            x = load_samples(args.modality, path, args.samples_per_file)
+        except Exception as e:
+            print(f"{path}: skipped ({e})", file=sys.stderr)
+            continue
+        if x is None:
+            continue
+        pending.append(x)
+        pending_labels.extend([label] * len(x))
+        if len(pending_labels) >= args.batch_size:
+            flush()
+    if pending:
+        flush()
+    if not labels:
+        raise ValueError(f"{args.folder}: nothing could be loaded")
+    return np.array(labels), np.concatenate(screen_probs), np.concatenate(ensemble_probs), screen_seconds, ensemble_seconds
+
+def scores(probs, labels, reference):
+    original = CATEGORIES.index("original")
+    predicted = probs.argmax(axis=1)
+    return {
+        "accuracy": float((predicted == labels).mean()),
+        # Tampered vs original only, as a 0.5 threshold on the tampered score
+        "binary_accuracy": float(((1 - probs[:, original] > 0.5) == (labels != original)).mean()),
+        "agreement_with_ensemble": float((predicted == reference.argmax(axis=1)).mean()),
+    }
+
+def sweep(modality, labels, screen_probs, ensemble_probs, screen_seconds, ensemble_seconds):
+    # The grid plus the modality's configured band
+    grid = [(low, high) for low in LOWS for high in HIGHS if low < high]
+    if CASCADE_BANDS[modality] not in grid:
+        grid.append(CASCADE_BANDS[modality])
+    screen_cost = screen_seconds / len(labels)
+    ensemble_cost = ensemble_seconds / len(labels)
+    bands = []
+    for low, high in grid:
+        escalated = uncertain_rows(modality, screen_probs, (low, high))
+        probs = np.where(escalated[:, None], ensemble_probs, screen_probs)
+        # Per sample: the screen always runs, the ensemble only for escalated samples
+        cost = float(screen_cost + escalated.mean() * ensemble_cost)
+        bands.append({
+            "low": low, "high": high,
+            "escalated": float(escalated.mean()),
+            **scores(probs, labels, ensemble_probs),
+            "seconds_per_sample": cost,
+            "relative_cost": cost / ensemble_cost,
+            "speedup": ensemble_cost / cost,
+        })
+    return bands
+
+def report(args):
+    labels, screen_probs, ensemble_probs, screen_seconds, ensemble_seconds = collect(args)
+    bands = sweep(args.modality, labels, screen_probs, ensemble_probs, screen_seconds, ensemble_seconds)
+    ensemble = scores(ensemble_probs, labels, ensemble_probs)
+    allowed = [b for b in bands if b["accuracy"] >= ensemble["accuracy"] - args.max_drop]
+    # Cheapest band within budget, the more accurate one on ties
+    best = min(allowed, key=lambda b: (b["relative_cost"], -b["accuracy"])) if allowed else None
+    current = CASCADE_BANDS[args.modality]
+    return {
+        "modality": args.modality,
+        "samples": int(len(labels)),
+        "ensemble": dict(ensemble, seconds_per_sample=ensemble_seconds / len(labels)),
+        "screen": dict(scores(screen_probs, labels, ensemble_probs), seconds_per_sample=screen_seconds / len(labels)),
+        "current_band": next(b for b in bands if (b["low"], b["high"]) == current),
+        "recommended_band": best,
+        "bands": bands,
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    result = report(args)
+    text = json.dumps(result, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    best = result["recommended_band"]
+    if best is None:
+        print(f"No band keeps accuracy within {args.max_drop} of the ensemble; leave CASCADE=off for "
+              f"{args.modality}", file=sys.stderr)
+    else:
+        print(f"CASCADE_BANDS={args.modality}={best['low']}:{best['high']}  "
+              f"({best['escalated']:.1%} escalated, {best['speedup']:.2f}x faster, "
+              f"accuracy {best['accuracy']:.4f} vs {result['ensemble']['accuracy']:.4f})", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+import os
+import math
+import hashlib
+import tempfile
+from PIL import Image, ImageDraw, ImageFont
+from model import CATEGORIES
+from artifacts import artifact_store
+from metrics import timed
+
+# ---------- Settings (override via environment) ----------
+# "server" renders a cached PNG per distinct probability vector,
+# "client" returns only the probabilities and leaves drawing to the frontend
+CHART_MODE = os.environ.get("CHART_MODE", "server")
+# Probability vectors equal after rounding share one chart image
+CHART_DECIMALS = int(os.environ.get("CHART_DECIMALS", "3"))
+# --------------------------------------------------
+
+COLORS = ["#1f77b4", "#ff7f0e", "#2ca02c", "#d62728", "#9467bd", "#8c564b", "#e377c2"]
+WIDTH, HEIGHT = 500, 400
+
+def probabilities(probs):
+    return {CATEGORIES[i]: float(probs[i]) for i in range(len(CATEGORIES))}
+
+def draw_text(draw, xy, text, font, fill, center=True):
+    # Manual anchoring, bitmap fonts don't support the anchor argument on older Pillow
+    left, top, right, bottom = draw.textbbox((0, 0), text, font=font)
+    x, y = xy
+    if center:
+        x -= (right - left) / 2
+    draw.text((x, y - (bottom - top) / 2), text, fill=fill, font=font)
+
+def draw_piechart(probs, categories):
+    img = Image.new("RGB", (WIDTH, HEIGHT), "white")
+    draw = ImageDraw.Draw(img)
+    font = ImageFont.load_default()
+    cx, cy, r = 170, HEIGHT // 2, 150
+    total = float(sum(probs)) or 1.0
+    # Same layout as the old matplotlib chart: first wedge starts at 12 o'clock, counter-clockwise
+    start = -90.0
+    for i, p in enumerate(probs):
+        extent = 360.0 * float(p) / total
+        if extent <= 0:
+            continue
+        color = COLORS[i % len(COLORS)]
+        if extent >= 359.99:
+            draw.ellipse((cx - r, cy - r, cx + r, cy + r), fill=color)
+        else:
+            draw.pieslice((cx - r, cy - r, cx + r, cy + r), start - extent, start, fill=color)
+        if extent >= 15:
+            mid = math.radians(start - extent / 2)
+            label = f"{100.0 * float(p) / total:.1f}%"
+            tx, ty = cx + 0.6 * r * math.cos(mid), cy + 0.6 * r * math.sin(mid)
+            draw_text(draw, (tx, ty), label, font, "white")
+        start -= extent
+    # Legend instead of outside labels, which needs no text layout
+    for i, name in enumerate(categories):
+        y = 120 + i * 28
+        draw.rectangle((350, y, 366, y + 16), fill=COLORS[i % len(COLORS)])
+        draw_text(draw, (374, y + 8), name, font, "black", center=False)
+    return img
+
+def render_piechart(probs, categories=CATEGORIES):
+    rounded = tuple(round(float(p), CHART_DECIMALS) for p in probs)
+    key = hashlib.sha1(repr((rounded, tuple(categories))).encode()).hexdigest()[:20]
+    out_path = artifact_store.path_for("results", f"pie_{key}.png")
+    if not os.path.exists(out_path):
+        with timed("chart"):
+            # Unique per call, as threads of one worker may render the same chart at once
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(out_path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    draw_piechart(rounded, categories).save(f, format="PNG")
+                # mkstemp creates 0600; charts are served as static files
+                os.chmod(tmp, 0o644)
+                os.replace(tmp, out_path)
+            except Exception:
+                os.remove(tmp)
+                raise
+    # Re-registering a reused chart restarts its TTL
+    return artifact_store.add(out_path, "results")
+
+def piechart_url(probs):
+    if CHART_MODE == "client":
+        return None
+    return render_piechart(probs)
@@ -1,126 +1,404 @@
 import os
-import uuid
-import requests
-import torch
+import hashlib
+from collections import Counter
+import cv2
 import librosa
-import librosa.display
-import matplotlib.pyplot as plt
 import numpy as np
+import soundfile as sf
+import torch.nn.functional as F
 from flask import Blueprint, request, jsonify
-from torchvision import models, transforms
-from PIL import Image
+from routes import route
+from model import CATEGORIES, SpanTracker, images_to_tensor, predict_modality
+from streaming import stream_response
+from fetch import FetchError, fetch_to_file, save_upload
+from artifacts import artifact_store
+from charts import piechart_url, probabilities
+from cache import result_cache, cache_key, file_digest, cached_response
+from metrics import timed
+from fingerprint import NEAR_DUPLICATES, NEAR_DUPLICATE_AUDIO_SECONDS, find_near_duplicate, remember_fingerprint, spectral_hash
 
 detect_audio_bp = Blueprint('detect_audio_bp', __name__)
-CATEGORIES = ["deepfake", "manual_edit", "compression", "morphing", "original"]
+
+# ---------- Settings (override via environment) ----------
+SAMPLE_RATE = int(os.environ.get("AUDIO_SAMPLE_RATE", "16000"))
+N_MELS = 128
+N_FFT = 2048
+HOP_LENGTH = 512
+# Scoring windows: length and step; overlapping scores are merged onto hop-sized slots
+AUDIO_WINDOW_SECONDS = float(os.environ.get("AUDIO_WINDOW_SECONDS", "1.0"))
+AUDIO_HOP_SECONDS = float(os.environ.get("AUDIO_HOP_SECONDS", "0.5"))
+# Audio decoded per read, so long files never sit in memory whole
+AUDIO_BLOCK_SECONDS = float(os.environ.get("AUDIO_BLOCK_SECONDS", "30"))
+# Windows scored per forward pass of each ensemble member
+AUDIO_BATCH_SIZE = int(os.environ.get("AUDIO_BATCH_SIZE", "64"))
+# --------------------------------------------------
+
+# Windows are whole STFT frames; the hop is rounded to frames too, so slot times are exact
+WINDOW_FRAMES = max(1, round(AUDIO_WINDOW_SECONDS * SAMPLE_RATE / HOP_LENGTH))
+HOP_FRAMES = max(1, min(WINDOW_FRAMES, round(AUDIO_HOP_SECONDS * SAMPLE_RATE / HOP_LENGTH)))
+SLOT_SECONDS = HOP_FRAMES * HOP_LENGTH / SAMPLE_RATE
+SLOTS_PER_WINDOW = -(-WINDOW_FRAMES // HOP_FRAMES)
+
+# RGB lookup table for the magma colormap librosa's specshow uses for dB spectrograms
+SPEC_COLORMAP = cv2.applyColorMap(np.arange(256, dtype=np.uint8).reshape(256, 1), cv2.COLORMAP_MAGMA)[:, 0, ::-1].copy()
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'wav', 'mp3', 'flac'}
 
-def download_audio(url, folder):
-    filename = f"{uuid.uuid4()}.wav"
-    filepath = os.path.join(folder, filename)
+def download_audio(url):
+    filepath = artifact_store.new_path("uploads", "wav")
     try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            with open(filepath, 'wb') as f: f.write(r.content)
-            return filepath
-    except: return None
+        fetch_to_file(url, filepath, "audio")
+        return filepath
+    except FetchError as e:
+        print(f"Error downloading audio from url: {e}")
     return None
 
-def audio_to_spec(audio_path, sr=16000):
-    y, _ = librosa.load(audio_path, sr=sr)
-    S = librosa.feature.melspectrogram(y, sr=sr, n_mels=128, fmax=8000)
-    S_dB = librosa.power_to_db(S, ref=np.max)
-    fig, ax = plt.subplots()
-    librosa.display.specshow(S_dB, sr=sr, fmax=8000, ax=ax)
-    plt.axis('off')
-    out_path = f"static/uploads/spec_{uuid.uuid4()}.png"
-    fig.savefig(out_path, bbox_inches='tight', pad_inches=0)
-    plt.close(fig)
-    return out_path
-
-def preprocess_spec(path):
-    img = Image.open(path).convert("RGB")
-    tf = transforms.Compose([
-        transforms.Resize((224,224)),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485,0.456,0.406],[0.229,0.224,0.225])
-    ])
-    return tf(img).unsqueeze(0)
-
-def load_model(path):
-    model = models.resnet50(pretrained=False)
-    model.fc = torch.nn.Linear(model.fc.in_features, len(CATEGORIES))
-    model.load_state_dict(torch.load(path, map_location='cpu'), strict=False)
-    model.eval()
-    return model
-
-def generate_piechart(probs, categories, save_path):
-    plt.figure(figsize=(5,4))
-    plt.pie(probs, labels=categories, autopct='%1.1f%%', startangle=90)
-    plt.axis('equal')
-    plt.savefig(save_path)
-    plt.close()
-
-@detect_audio_bp.route('/detect-audio', methods=['POST'])
-def detect_audio():
-    upload_folder = "static/uploads"
-    result_folder = "static/results"
-    os.makedirs(upload_folder, exist_ok=True)
-    os.makedirs(result_folder, exist_ok=True)
+def iter_audio_blocks(audio_path, sr=SAMPLE_RATE):
+    # Mono float32 blocks at sr, AUDIO_BLOCK_SECONDS at a time. Formats soundfile can't open
+    # (e.g. mp3 on older libsndfile) fall back to decoding the whole file with librosa.
+    try:
+        f = sf.SoundFile(audio_path)
+    except RuntimeError:
+        with timed("decode"):
+            y, _ = librosa.load(audio_path, sr=sr)
+        yield y
+        return
+    with f:
+        blocks = f.blocks(blocksize=int(AUDIO_BLOCK_SECONDS * f.samplerate), dtype="float32", always_2d=True)
+        while True:
+            with timed("decode"):
+                data = next(blocks, None)
+                if data is None:
+                    return
+                y = data.mean(axis=1)
+                if f.samplerate != sr:
+                    y = librosa.resample(y, orig_sr=f.samplerate, target_sr=sr)
+            yield y
+
+def audio_duration(audio_path):
+    # Seconds from the file header, or None if soundfile can't read it
+    try:
+        info = sf.info(audio_path)
+        return info.frames / info.samplerate
+    except RuntimeError:
+        return None
+
+def iter_mel_frames(blocks, sr=SAMPLE_RATE):
+    # Power mel frames [N_MELS, n] for consecutive sample blocks, continuous across block edges
+    carry = np.zeros(0, dtype=np.float32)
+    for y in blocks:
+        buf = np.concatenate([carry, y])
+        n = 1 + (len(buf) - N_FFT) // HOP_LENGTH if len(buf) >= N_FFT else 0
+        if n:
+            with timed("spectrogram"):
+                yield librosa.feature.melspectrogram(
+                    y=buf[:(n - 1) * HOP_LENGTH + N_FFT], sr=sr, n_fft=N_FFT, hop_length=HOP_LENGTH,
+                    n_mels=N_MELS, fmax=8000, center=False
+                )
+        carry = buf[n * HOP_LENGTH:]
+    # Zero-pad the tail so every remaining hop of samples starts a frame
+    if len(carry) >= HOP_LENGTH:
+        tail = np.pad(carry, (0, N_FFT))[:(len(carry) // HOP_LENGTH - 1) * HOP_LENGTH + N_FFT]
+        with timed("spectrogram"):
+            yield librosa.feature.melspectrogram(
+                y=tail, sr=sr, n_fft=N_FFT, hop_length=HOP_LENGTH, n_mels=N_MELS, fmax=8000, center=False
+            )
+
+def iter_windows(mel_blocks):
+    # -> (window index k, power mel [N_MELS, WINDOW_FRAMES]) for windows starting every HOP_FRAMES frames;
+    # only the frames of windows not yet emitted are kept
+    frames = np.zeros((N_MELS, 0), dtype=np.float32)
+    offset = 0  # absolute index of frames[:, 0]
+    k = 0
+    for S in mel_blocks:
+        frames = np.concatenate([frames, S], axis=1)
+        while k * HOP_FRAMES + WINDOW_FRAMES <= offset + frames.shape[1]:
+            start = k * HOP_FRAMES - offset
+            yield k, frames[:, start:start + WINDOW_FRAMES]
+            k += 1
+        drop = k * HOP_FRAMES - offset
+        frames = frames[:, drop:]
+        offset += drop
+    # A last, zero-padded window if some frames are not covered yet (or the audio is shorter than one window)
+    covered = (k - 1) * HOP_FRAMES + WINDOW_FRAMES if k else 0
+    if offset + frames.shape[1] > covered:
+        start = k * HOP_FRAMES - offset
+        yield k, np.pad(frames[:, start:], ((0, 0), (0, WINDOW_FRAMES - frames.shape[1] + start)))
+
+def power_to_db(specs):
+    # power_to_db(ref=np.max, top_db=80) per window of [N, N_MELS, T]
+    ref = np.maximum(specs.max(axis=(1, 2), keepdims=True), 1e-10)
+    S_dB = 10.0 * np.log10(np.maximum(specs, 1e-10) / ref)
+    return np.maximum(S_dB, -80.0)
+
+def counted(blocks, decoded):
+    # Passes sample blocks through, adding their length to decoded[0]
+    for y in blocks:
+        decoded[0] += len(y)
+        yield y
+
+def mel_hash(S):
+    # Power mel frames [N_MELS, n] -> spectral hash of their dB values, None if too short
+    return spectral_hash(10.0 * np.log10(np.maximum(S, 1e-10)))
+
+# audio_fingerprint spools the mel frames it computes to a file, so the analysis that follows a near-duplicate
+# miss replays them instead of decoding the clip again. Header: decoded samples, then the clip's size and
+# mtime (ns) to recognise it; then float32 frames, N_MELS values each.
+SPOOL_HEADER = np.dtype(("<i8", 3))
+
+def mel_spool_path(audio_path):
+    name = hashlib.sha1(os.path.abspath(audio_path).encode()).hexdigest()
+    return artifact_store.path_for("uploads", f"{name}.mel")
+
+def source_stamp(audio_path):
+    st = os.stat(audio_path)
+    return st.st_size, st.st_mtime_ns
+
+def discard_mel_spool(audio_path):
+    # For callers that fingerprinted a clip but won't analyse it, e.g. after a near-duplicate hit;
+    # spools left behind anyway expire as uploads
+    artifact_store.discard(mel_spool_path(audio_path))
+
+def audio_fingerprint(audio_path):
+    # -> ([hash per NEAR_DUPLICATE_AUDIO_SECONDS segment of the whole clip], decoded duration in seconds),
+    # from the same decode and mel frames as scoring, which are spooled for analyze_audio to reuse
+    if not NEAR_DUPLICATES:
+        return [], None
+    segment = max(1, round(NEAR_DUPLICATE_AUDIO_SECONDS * SAMPLE_RATE / HOP_LENGTH))
+    spool = mel_spool_path(audio_path)
+    decoded = [0]
+    hashes = []
+    pending = np.zeros((N_MELS, 0), dtype=np.float32)
+    try:
+        with open(spool, "wb") as f:
+            f.write(bytes(SPOOL_HEADER.itemsize))
+            for S in iter_mel_frames(counted(iter_audio_blocks(audio_path), decoded)):
+                f.write(np.ascontiguousarray(S.T, dtype=np.float32).tobytes())
+                pending = np.concatenate([pending, S], axis=1)
+                while pending.shape[1] >= segment:
+                    hashes.append(mel_hash(pending[:, :segment]))
+                    pending = pending[:, segment:]
+            f.seek(0)
+            f.write(np.array([decoded[0], *source_stamp(audio_path)], dtype="<i8").tobytes())
+    except Exception:
+        os.remove(spool)
+        raise
+    artifact_store.add(spool, "uploads")
+    if pending.shape[1]:
+        hashes.append(mel_hash(pending))  # None if too short to hash
+    return [h for h in hashes if h is not None], decoded[0] / SAMPLE_RATE
+
+def spooled_mel_frames(audio_path):
+    # -> (decoded samples, mel blocks) from audio_fingerprint's spool of this clip, or None
+    path = mel_spool_path(audio_path)
+    try:
+        header = np.fromfile(path, dtype="<i8", count=3)
+        if len(header) < 3 or tuple(header[1:]) != source_stamp(audio_path):
+            return None
+        empty = os.path.getsize(path) == SPOOL_HEADER.itemsize
+    except OSError:
+        return None
+    frames = np.zeros((0, N_MELS), dtype=np.float32) if empty else \
+        np.memmap(path, dtype=np.float32, mode="r", offset=SPOOL_HEADER.itemsize).reshape(-1, N_MELS)
+    block = max(1, int(AUDIO_BLOCK_SECONDS * SAMPLE_RATE / HOP_LENGTH))
+    return int(header[0]), (np.ascontiguousarray(frames[i:i + block].T) for i in range(0, len(frames), block))
+
+def audio_to_spec(y, sr=SAMPLE_RATE):
+    # In-memory signal -> dB spectrograms [N, N_MELS, WINDOW_FRAMES], one per window
+    return power_to_db(np.stack([w for _, w in iter_windows(iter_mel_frames([y], sr))]))
+
+def preprocess_spec(specs):
+    # dB spectrograms [N, 128, T] -> colour-mapped [N, 3, 224, 224] batch, as the old specshow PNGs looked
+    lo = specs.min(axis=(1, 2), keepdims=True)
+    hi = specs.max(axis=(1, 2), keepdims=True)
+    levels = np.uint8(255 * (specs - lo) / np.maximum(hi - lo, 1e-8))
+    rgb = SPEC_COLORMAP[levels[:, ::-1]]  # low frequencies at the bottom, like specshow
+    return F.interpolate(images_to_tensor(rgb), size=(224, 224), mode="bilinear", align_corners=False)
+
+class WindowMerger:
+    # Averages overlapping window scores onto SLOT_SECONDS slots. Windows arrive in order, so once
+    # window k is in, no later window covers slots before k and they can be released.
+    def __init__(self):
+        self.slots = {}
+
+    def add(self, k, probs):
+        for j in range(k, k + SLOTS_PER_WINDOW):
+            total, count = self.slots.get(j, (0.0, 0))
+            self.slots[j] = (total + probs, count + 1)
+        return self.release(k)
+
+    def release(self, before=None):
+        # -> [(start_sec, end_sec, probs)] for slots < before (all slots if None), in order
+        ready = sorted(j for j in self.slots if before is None or j < before)
+        out = []
+        for j in ready:
+            total, count = self.slots.pop(j)
+            out.append((j * SLOT_SECONDS, (j + 1) * SLOT_SECONDS, total / count))
+        return out
+
+def iter_audio_batches(audio_path, progress=None, decided_by=None):
+    # Yields the slots finished by each scored batch of windows as [(start_sec, end_sec, probs)];
+    # progress(done, total) counts windows. Memory is bounded by one decoded block plus one batch.
+    # decided_by, a Counter, counts the windows each cascade stage decided
+    duration = audio_duration(audio_path)
+    total = 1 + max(0, round(duration * SAMPLE_RATE / HOP_LENGTH) - WINDOW_FRAMES) // HOP_FRAMES if duration else 0
+    decoded = [0]
+    spooled = spooled_mel_frames(audio_path)
+    if spooled is None:
+        mel_blocks = iter_mel_frames(counted(iter_audio_blocks(audio_path), decoded))
+    else:
+        decoded[0], mel_blocks = spooled
+    merger = WindowMerger()
+    batch_k, batch_specs = [], []
+
+    def score_batch():
+        with timed("preprocess"):
+            x = preprocess_spec(power_to_db(np.stack(batch_specs)))
+        stages = []
+        probs = predict_modality("audio", x, AUDIO_BATCH_SIZE, stages)
+        if decided_by is not None:
+            decided_by.update(stages)
+        if progress:
+            progress(batch_k[-1] + 1, max(total, batch_k[-1] + 1))
+        slots = []
+        for k, p in zip(batch_k, probs):
+            slots.extend(merger.add(k, p))
+        return slots
+
+    try:
+        for k, spec in iter_windows(mel_blocks):
+            batch_k.append(k)
+            batch_specs.append(spec)
+            if len(batch_k) == AUDIO_BATCH_SIZE:
+                yield score_batch()
+                batch_k, batch_specs = [], []
+    finally:
+        if spooled is not None:
+            discard_mel_spool(audio_path)
+    slots = score_batch() if batch_k else []
+    # Drop slots that only cover the zero padding after the end of the audio
+    end = decoded[0] / SAMPLE_RATE
+    slots += merger.release()
+    yield [(start, min(stop, end), p) for start, stop, p in slots if start < end or start == 0]
+
+def time_prediction(start, end, probs):
+    return {
+        "start_sec": round(start, 3),
+        "end_sec": round(end, 3),
+        "probabilities": {CATEGORIES[i]: float(probs[i]) for i in range(len(CATEGORIES))}
+    }
+
+def analyze_audio(audio_path, progress=None):
+    # Full audio pipeline returning the /api/detect-audio response
+    predlist = []
+    probs_sum = np.zeros(len(CATEGORIES))
+    seconds = 0.0
+    spans = SpanTracker()
+    decided_by = Counter()
+    for batch in iter_audio_batches(audio_path, progress, decided_by):
+        for start, end, probs in batch:
+            predlist.append(time_prediction(start, end, probs))
+            probs_sum += probs * (end - start)
+            seconds += end - start
+            spans.update(round(start, 3), probs, end=round(end, 3))
+    if not predlist:
+        raise ValueError("No audio could be decoded.")
+    overall_probs = probs_sum / seconds
+    return {
+        "piechart_url": piechart_url(overall_probs),
+        "probabilities": probabilities(overall_probs),
+        "suspicious_spans_seconds": spans.spans[:3],
+        "duration_sec": round(seconds, 3),
+        "time_predictions": predlist,
+        # Scored windows per cascade stage ("screen" = settled by the screening model alone)
+        "decided_by": dict(decided_by)
+    }
+
+def stream_audio_events(audio_path):
+    # Every scored batch is sent as soon as it is ready; only running totals are kept in memory
+    spans = SpanTracker()
+    probs_sum = np.zeros(len(CATEGORIES))
+    seconds = 0.0
+    decided_by = Counter()
+    for batch in iter_audio_batches(audio_path, decided_by=decided_by):
+        if not batch:
+            continue
+        yield "seconds", {"time_predictions": [time_prediction(*t) for t in batch]}
+        updated = []
+        for start, end, probs in batch:
+            idx = spans.update(round(start, 3), probs, end=round(end, 3))
+            if idx is not None and idx not in updated:
+                updated.append(idx)
+            probs_sum += probs * (end - start)
+            seconds += end - start
+        for idx in updated:
+            yield "span", {"index": idx, **spans.spans[idx]}
+
+    if not seconds:
+        raise ValueError("No audio could be decoded.")
+    overall_probs = probs_sum / seconds
+    yield "summary", {
+        "piechart_url": piechart_url(overall_probs),
+        "probabilities": probabilities(overall_probs),
+        "suspicious_spans_seconds": spans.spans[:3],
+        "seconds_scored": round(seconds, 3),
+        "decided_by": dict(decided_by)
+    }
+
+def receive_audio():
+    # Saves the uploaded file or downloads the URL; returns (audio_path, error message)
     file = request.files.get('file')
     url = request.form.get('url')
     if file and allowed_file(file.filename):
-        audio_path = os.path.join(upload_folder, f"{uuid.uuid4()}.wav")
-        file.save(audio_path)
+        audio_path = artifact_store.new_path("uploads", "wav")
+        try:
+            save_upload(file, audio_path, "audio")
+        except FetchError as e:
+            return None, str(e)
+        return audio_path, None
     elif url:
-        audio_path = download_audio(url, upload_folder)
+        audio_path = download_audio(url)
         if not audio_path:
-            return jsonify({"error": "Failed to download audio."}), 400
-    else:
-        return jsonify({"error": "No audio file or URL provided."}), 400
+            return None, "Failed to download audio."
+        return audio_path, None
+    return None, "No audio file or URL provided."
+
+@route(detect_audio_bp)
+def detect_audio():
+    audio_path, error = receive_audio()
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
-        sr = 16000
-        y, _ = librosa.load(audio_path, sr=sr)
-        hop = sr # one second per segment
-        segments = []
-        predlist = []
-        for idx, start in enumerate(range(0, len(y), hop)):
-            end = min(len(y), start+hop)
-            seg = y[start:end]
-            tempwav = f"{upload_folder}/seg_{uuid.uuid4()}.wav"
-            librosa.output.write_wav(tempwav, seg, sr)
-            spec_img = audio_to_spec(tempwav, sr)
-            x = preprocess_spec(spec_img)
-            m1 = load_model("models/audio_model_1.pth")
-            m2 = load_model("models/audio_model_2.pth")
-            with torch.no_grad():
-                p1 = torch.softmax(m1(x), 1)[0].cpu().numpy()
-                p2 = torch.softmax(m2(x), 1)[0].cpu().numpy()
-            pred = (p1 + p2) / 2
-            predlist.append({"second": idx, "probabilities": {CATEGORIES[i]: float(pred[i]) for i in range(len(CATEGORIES))}})
-            segments.append(pred)
-            os.remove(tempwav)
-            os.remove(spec_img)
-        overall_probs = np.mean(segments, axis=0)
-        piechart_path = os.path.join(result_folder, f"pie_{uuid.uuid4()}.png")
-        generate_piechart(overall_probs, CATEGORIES, piechart_path)
-        piechart_url = piechart_path.replace("static/", "/static/")
-        suspicious_spans = []
-        cs = None
-        for i, p in enumerate(segments):
-            if 1-p[CATEGORIES.index("original")] > 0.5:
-                if cs is None: cs = {"start": i, "end": i}
-                else: cs["end"] = i
-            else:
-                if cs: suspicious_spans.append(cs); cs = None
-        if cs: suspicious_spans.append(cs)
-        suspicious_spans = suspicious_spans[:3]
-        return jsonify({
-            "piechart_url": piechart_url,
-            "suspicious_spans_seconds": suspicious_spans,
-            "time_predictions": predlist
-        })
+        digest = file_digest(audio_path)
+        key = cache_key("audio", digest)
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached_response(jsonify(cached), True)
+
+        with timed("fingerprint"):
+            hashes, duration = audio_fingerprint(audio_path)
+        near = find_near_duplicate("audio", hashes, digest, duration=duration)
+        if near is not None:
+            discard_mel_spool(audio_path)
+            result_cache.set(key, near)
+            return cached_response(jsonify(near), True)
+
+        response = analyze_audio(audio_path)
+        result_cache.set(key, response)
+        remember_fingerprint("audio", hashes, digest)
+        return cached_response(jsonify(response), False)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    finally:
+        artifact_store.finish_upload(audio_path)
+
+@route(detect_audio_bp)
+def detect_audio_stream():
+    audio_path, error = receive_audio()
+    if error:
+        return jsonify({"error": error}), 400
+    return stream_response(stream_audio_events(audio_path), on_close=lambda: artifact_store.finish_upload(audio_path))
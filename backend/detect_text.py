@@ -1,67 +1,88 @@
 import os
-import uuid
 import numpy as np
 import torch
-import matplotlib.pyplot as plt
 from flask import Blueprint, request, jsonify
-from transformers import AutoTokenizer, AutoModelForSequenceClassification
+from routes import route
+from model import CATEGORIES, INFERENCE_SERVER_ADDRESS, combine_probs, ensemble_map, ensemble_weights, get_ensemble, model_version, remote_call
+from fetch import FETCH_LIMITS, FetchError, fetch_to_file
+from artifacts import artifact_store
+from charts import piechart_url, probabilities
+from cache import result_cache, cache_key, text_digest, cached_response
+from metrics import batch_items, timed
+from text_engine import get_sentences, sentence_memo, thread_tokenizer
 
 detect_text_bp = Blueprint('detect_text_bp', __name__)
-CATEGORIES = ["deepfake", "manual_edit", "compression", "morphing", "original"]
+
+# Max padded tokens (sentences x longest sentence) per forward pass
+TEXT_TOKEN_BUDGET = int(os.environ.get("TEXT_TOKEN_BUDGET", "4096"))
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'txt'}
 
-def download_text_from_url(url, folder):
-    filename = f"{uuid.uuid4()}.txt"
-    filepath = os.path.join(folder, filename)
+def download_text_from_url(url):
+    filepath = artifact_store.new_path("uploads", "txt")
     try:
-        import requests
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            with open(filepath, 'w', encoding='utf-8') as f:
-                f.write(r.text)
-            return filepath
-    except Exception:
+        fetch_to_file(url, filepath, "text")
+        return filepath
+    except FetchError:
         return None
-    return None
-
-def generate_piechart(probs, categories, save_path):
-    plt.figure(figsize=(5,4))
-    plt.pie(probs, labels=categories, autopct='%1.1f%%', startangle=90)
-    plt.axis('equal')
-    plt.savefig(save_path)
-    plt.close()
-
-def load_model_tokenizer(model_name, model_path):
-    tokenizer = AutoTokenizer.from_pretrained(model_name)
-    model = AutoModelForSequenceClassification.from_pretrained(model_path)
-    return tokenizer, model.eval()
-
-def get_sentences(text):
-    import re
-    text = text.replace('\r\n', '\n')
-    # Use period/newline as splitter
-    return [s.strip() for s in re.split(r'[.!?\n]+', text) if s.strip()]
-
-@detect_text_bp.route('/detect-text', methods=['POST'])
+
+def predict_sentences(tokenizer, model, sentences, token_budget=TEXT_TOKEN_BUDGET):
+    # Encode all sentences in one fast-tokenizer call, then score length-sorted
+    # batches padded only to their own longest sentence -> probs [N, C] in input order
+    tokenizer = thread_tokenizer(tokenizer)
+    encoded = tokenizer(sentences, truncation=True)["input_ids"]
+    order = sorted(range(len(sentences)), key=lambda i: len(encoded[i]))
+    probs = np.zeros((len(sentences), len(CATEGORIES)), dtype=np.float32)
+    start = 0
+    while start < len(order):
+        end = start + 1
+        # Lengths are ascending, so the newest sentence sets the padded width
+        while end < len(order) and (end - start + 1) * len(encoded[order[end]]) <= token_budget:
+            end += 1
+        batch = order[start:end]
+        inputs = tokenizer.pad({"input_ids": [encoded[i] for i in batch]}, return_tensors="pt")
+        with torch.no_grad():
+            logits = model(**inputs).logits
+        probs[batch] = torch.softmax(logits, dim=1).cpu().numpy()
+        start = end
+    return probs
+
+def predict_text(sentences):
+    # Ensemble probabilities [N, C] per sentence; sentences seen before (by this worker, for the current
+    # weights) come from the memo and only the rest are scored
+    return sentence_memo.predict(sentences, score_sentences, model_version("text"))
+
+def score_sentences(sentences):
+    # From the shared inference server when one is configured
+    batch_items.observe(len(sentences), modality="text")
+    if INFERENCE_SERVER_ADDRESS:
+        with timed("forward"):
+            return remote_call("predict", "text", sentences)
+    # Fine-tuned HuggingFace classifiers from models/text_model_*, loaded once per worker
+    members = get_ensemble("text")
+    with timed("forward"):
+        member_probs = ensemble_map(lambda member: predict_sentences(*member, sentences), members)
+    return combine_probs(member_probs, ensemble_weights("text"))
+
+@route(detect_text_bp)
 def detect_text():
-    upload_folder = "static/uploads"
-    result_folder = "static/results"
-    os.makedirs(upload_folder, exist_ok=True)
-    os.makedirs(result_folder, exist_ok=True)
     text_input = None
     file = request.files.get('file')
     url = request.form.get('url')
     if file and allowed_file(file.filename):
-        content = file.read().decode('utf-8')
-        text_input = content
+        max_bytes, _ = FETCH_LIMITS["text"]
+        content = file.stream.read(max_bytes + 1)
+        if len(content) > max_bytes:
+            return jsonify({"error": "Text file is too large."}), 400
+        text_input = content.decode('utf-8')
     elif url:
-        text_path = download_text_from_url(url, upload_folder)
+        text_path = download_text_from_url(url)
         if not text_path:
             return jsonify({"error": "Failed to download text."}), 400
-        with open(text_path, encoding='utf-8') as f:
+        with open(text_path, encoding='utf-8', errors='replace') as f:
             text_input = f.read()
+        artifact_store.finish_upload(text_path)
     else:
         form_text = request.form.get('text')
         if form_text and form_text.strip():
@@ -70,39 +91,20 @@ def detect_text():
             return jsonify({"error": "No text/file/URL provided."}), 400
 
     try:
-        sentences = get_sentences(text_input)
+        with timed("preprocess"):
+            sentences = get_sentences(text_input)
         if not sentences:
             return jsonify({"error": "No valid text found."}), 400
 
-        # You can use any HuggingFace model you have fine-tuned for fake/manipulated text
-        model1_name = 'distilbert-base-uncased'
-        model1_path = 'models/text_model_1'
-        tokenizer1, model1 = load_model_tokenizer(model1_name, model1_path)
-        
-        model2_name = 'distilroberta-base'
-        model2_path = 'models/text_model_2'
-        tokenizer2, model2 = load_model_tokenizer(model2_name, model2_path)
-
-        predictions = []
-        for sent in sentences:
-            # Model 1
-            inputs1 = tokenizer1(sent, return_tensors="pt", truncation=True)
-            with torch.no_grad():
-                logits1 = model1(**inputs1).logits
-                prob1 = torch.softmax(logits1, dim=1).cpu().numpy()[0]
-            # Model 2
-            inputs2 = tokenizer2(sent, return_tensors="pt", truncation=True)
-            with torch.no_grad():
-                logits2 = model2(**inputs2).logits
-                prob2 = torch.softmax(logits2, dim=1).cpu().numpy()[0]
-            avg_prob = (prob1 + prob2) / 2
-            predictions.append(avg_prob)
+        key = cache_key("text", text_digest(text_input))
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached_response(jsonify(cached), True)
+
+        predictions = predict_text(sentences)
 
         # Overall
         overall_probs = np.mean(predictions, axis=0)
-        piechart_path = os.path.join(result_folder, f"pie_{uuid.uuid4()}.png")
-        generate_piechart(overall_probs, CATEGORIES, piechart_path)
-        piechart_url = piechart_path.replace("static/", "/static/")
 
         # Per-sentence suspicious spans: any non-original prob > 0.5
         suspicious = []
@@ -113,14 +115,17 @@ def detect_text():
 
         suspicious = suspicious[:3]
 
-        return jsonify({
-            "piechart_url": piechart_url,
+        response = {
+            "piechart_url": piechart_url(overall_probs),
+            "probabilities": probabilities(overall_probs),
             "suspicious_sentences": suspicious,
             "sentence_predictions": [
                 {"sentence_idx": i, "text": sentences[i], "probabilities": {CATEGORIES[j]: float(predictions[i][j]) for j in range(len(CATEGORIES))}}
                 for i in range(len(sentences))
             ]
-        })
+        }
+        result_cache.set(key, response)
+        return cached_response(jsonify(response), False)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -1,151 +1,364 @@
 import os
-import uuid
+from collections import Counter
 import cv2
-import torch
-import requests
 import numpy as np
-import matplotlib.pyplot as plt
-from PIL import Image
 from flask import Blueprint, request, jsonify
-from torchvision import models, transforms
+from routes import route
+from model import CATEGORIES, SpanTracker, frames_to_tensor, predict_modality
+from streaming import stream_response
+from fetch import FetchError, fetch_to_file, save_upload
+from artifacts import artifact_store
+from charts import piechart_url, probabilities
+from gradcam import predict_with_heatmaps, save_heatmap_overlay
+from faces import FaceTracker, crop_faces
+from sampling import VIDEO_SAMPLING_GROUP, AdaptiveSampler, Candidate, TimeWeightedMean, sampling_plan
+from video_decode import VideoDecoder
+from cache import result_cache, cache_key, file_digest, cached_response
+from fingerprint import NEAR_DUPLICATES, NEAR_DUPLICATE_KEYFRAMES, find_near_duplicate, image_hash, remember_fingerprint
+from metrics import observe_stage, timed
 
 detect_video_bp = Blueprint('detect_video_bp', __name__)
 
-# Define categories for detection
-CATEGORIES = ["deepfake", "manual_edit", "compression", "morphing", "original"]
+# Sampled frames scored per forward pass of each ensemble member
+VIDEO_BATCH_SIZE = int(os.environ.get("VIDEO_BATCH_SIZE", "32"))
+# Per-frame Grad-CAM overlays saved per request when heatmaps are requested (most suspicious frames first)
+VIDEO_MAX_HEATMAPS = int(os.environ.get("VIDEO_MAX_HEATMAPS", "10"))
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'mp4', 'avi', 'mov', 'mkv'}
 
-def download_video_from_url(url, folder):
-    filename = f"{uuid.uuid4()}.mp4"
-    filepath = os.path.join(folder, filename)
+def download_video_from_url(url):
+    filepath = artifact_store.new_path("uploads", "mp4")
     try:
-        r = requests.get(url, timeout=10)
-        if r.status_code == 200:
-            with open(filepath, 'wb') as f:
-                f.write(r.content)
-            return filepath
-    except Exception:
-        return None
+        fetch_to_file(url, filepath, "video")
+        return filepath
+    except FetchError as e:
+        print(f"Error downloading video from url: {e}")
     return None
 
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485,0.456,0.406],[0.229,0.224,0.225])
-])
-
-def preprocess_frame(frame):
-    pil_img = Image.fromarray(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
-    tensor = transform(pil_img).unsqueeze(0)
-    return tensor
-
-def load_model(model_path):
-    model = models.resnet50(pretrained=False)
-    model.fc = torch.nn.Linear(model.fc.in_features, len(CATEGORIES))
-    model.load_state_dict(torch.load(model_path, map_location="cpu"), strict=False)
-    model.eval()
-    return model
-
-def generate_piechart(probs, categories, save_path):
-    plt.figure(figsize=(5,4))
-    plt.pie(probs, labels=categories, autopct='%1.1f%%', startangle=90)
-    plt.axis('equal')
-    plt.savefig(save_path)
-    plt.close()
-
-@detect_video_bp.route('/detect-video', methods=['POST'])
-def detect_video():
-    upload_folder = "static/uploads"
-    result_folder = "static/results"
-    os.makedirs(upload_folder, exist_ok=True)
-    os.makedirs(result_folder, exist_ok=True)
+def keyframe_hashes(video_path, count=NEAR_DUPLICATE_KEYFRAMES):
+    # Perceptual hashes of count candidates spread evenly through the video. The candidates come from
+    # VideoDecoder, so they are the frames scoring sees (same presentation-time grid, same 224x224 resize),
+    # read in order without seeking. Positions are fractions of the candidates, so a re-encode at another
+    # frame rate lands on the same moments.
+    if not NEAR_DUPLICATES:
+        return []
+    decoder = VideoDecoder(video_path, size=(224, 224))
+    hashes = []
+    try:
+        for _, _, frame, _ in decoder:
+            hashes.append(image_hash(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)))
+    finally:
+        decoder.close()
+    picks = min(count, len(hashes))
+    return [hashes[int((i + 0.5) * len(hashes) / picks)] for i in range(picks)]
+
+def video_fingerprint(video_path):
+    # (hashes, duration) in the shape of detect_audio.audio_fingerprint; keyframes sit at fractions of the
+    # length, so there is no duration to check
+    return keyframe_hashes(video_path), None
+
+def make_candidate(frame_idx, timestamp, frame, delta, tracker):
+    # Everything later stages need from a decoded frame, at scoring resolution. The frame is a decoder
+    # ring slot that is reused once the next frame is read, so the candidate keeps its own copies.
+    if frame.shape[:2] == (224, 224):
+        small = frame.copy()
+    else:
+        small = cv2.resize(frame, (224, 224), interpolation=cv2.INTER_AREA)
+    if tracker is None:
+        return Candidate(frame_idx, timestamp, small, delta)
+    # Faces are tracked on every candidate in order (tracking needs consecutive frames), cropped at full resolution
+    with timed("face_detect"):
+        faces = tracker.update(frame)
+        crops = [cv2.resize(c, (224, 224), interpolation=cv2.INTER_AREA) for c in crop_faces(frame, faces)]
+    return Candidate(frame_idx, timestamp, small, delta, faces, crops)
+
+def iter_video_batches(video_path, progress=None, on_heatmaps=None, on_faces=None, max_forwards=None, decided_by=None):
+    # Yields the scored samples of each group of candidate frames as [(frame_idx, timestamp_sec, probs)],
+    # in time order; progress(done, total) counts candidates. Which candidates get scored is decided by
+    # AdaptiveSampler (see sampling.py), within max_forwards scored frames per video.
+    # With on_heatmaps, scored frames also get Grad-CAM from the same forward: on_heatmaps(frame_idxs, frames, probs, heatmaps)
+    # With on_faces, faces are tracked across the candidates and the crops of scored ones are scored too:
+    # on_faces([(frame_idx, timestamp_sec, face_id, box)], probs)
+    # Face tracking and crops need full-resolution frames; otherwise the decoder resizes to 224 itself
+    # decided_by, a Counter, counts the scored frames each cascade stage decided
+    decoder = VideoDecoder(video_path, size=None if on_faces else (224, 224))
+    tracker = FaceTracker() if on_faces else None
+    try:
+        # 0 when the container doesn't report a usable length: default stride, budget still applies
+        total_candidates = decoder.total_candidates
+        stride, budget = sampling_plan(total_candidates, max_forwards)
+        group_size = VIDEO_BATCH_SIZE if stride == 1 else VIDEO_SAMPLING_GROUP
+        done = 0
+
+        def score(candidates):
+            frames = [c.frame for c in candidates]
+            with timed("preprocess"):
+                x = frames_to_tensor(frames)
+            stages = []
+            if on_heatmaps:
+                probs, heatmaps = predict_with_heatmaps("video", x, stages)
+                on_heatmaps([c.frame_idx for c in candidates], frames, probs, heatmaps)
+            else:
+                probs = predict_modality("video", x, VIDEO_BATCH_SIZE, stages)
+            if decided_by is not None:
+                decided_by.update(stages)
+            return probs
+
+        sampler = AdaptiveSampler(score, stride, budget, total=total_candidates)
+
+        def score_group(group):
+            scored = sampler.run(group)
+            if tracker:
+                rows = [(c.frame_idx, c.timestamp, face_id, box) for c, _ in scored for face_id, box in c.faces]
+                crops = [crop for c, _ in scored for crop in c.crops]
+                if crops:
+                    with timed("preprocess"):
+                        x = frames_to_tensor(crops)
+                    on_faces(rows, predict_modality("video", x, VIDEO_BATCH_SIZE))
+            if progress:
+                progress(done, max(total_candidates, done))
+            return [(c.frame_idx, c.timestamp, p) for c, p in scored]
+
+        group = []
+        for frame_idx, timestamp, frame, delta in decoder:
+            group.append(make_candidate(frame_idx, timestamp, frame, delta, tracker))
+            if len(group) == group_size:
+                done += len(group)
+                yield score_group(group)
+                group = []
+                if sampler.exhausted:
+                    break  # nothing more would be scored
+        if group and not sampler.exhausted:
+            done += len(group)
+            total_candidates = done
+            yield score_group(group)
+    finally:
+        decoder.close()
+        # decode runs on the decoder thread; decode_wait is how long scoring sat idle waiting for frames
+        observe_stage("decode", decoder.decode_seconds)
+        observe_stage("decode_wait", decoder.wait_seconds)
+
+def frame_prediction(frame_idx, timestamp, probs):
+    return {
+        "frame": frame_idx,
+        "timestamp_sec": timestamp,
+        "probabilities": {CATEGORIES[i]: float(probs[i]) for i in range(len(CATEGORIES))}
+    }
+
+def face_prediction(frame_idx, timestamp, face_id, box, probs):
+    return {
+        "face_id": face_id,
+        "frame": frame_idx,
+        "timestamp_sec": timestamp,
+        "box": [int(v) for v in box],  # x, y, width, height in frame pixels
+        "probabilities": {CATEGORIES[i]: float(probs[i]) for i in range(len(CATEGORIES))}
+    }
+
+class FaceTracks:
+    # Per-face running mean, suspicious spans and (optionally) every scored crop
+    def __init__(self, keep_predictions=True):
+        self.keep_predictions = keep_predictions
+        self.faces = {}
+
+    def add(self, rows, probs):
+        for (frame_idx, timestamp, face_id, box), p in zip(rows, probs):
+            face = self.faces.get(face_id)
+            if face is None:
+                face = self.faces[face_id] = {
+                    "first": timestamp, "probs_sum": np.zeros(len(CATEGORIES)), "count": 0,
+                    "spans": SpanTracker(), "predictions": []
+                }
+            face["last"] = timestamp
+            face["probs_sum"] += p
+            face["count"] += 1
+            face["spans"].update(timestamp, p)
+            if self.keep_predictions:
+                face["predictions"].append((frame_idx, timestamp, face_id, box, p))
+
+    def summary(self):
+        faces = []
+        for face_id, face in sorted(self.faces.items()):
+            entry = {
+                "face_id": face_id,
+                "first_seen_sec": face["first"],
+                "last_seen_sec": face["last"],
+                "samples": face["count"],
+                "probabilities": probabilities(face["probs_sum"] / face["count"]),
+                "suspicious_spans_seconds": face["spans"].spans[:3]
+            }
+            if self.keep_predictions:
+                preds = face["predictions"]
+                entry["face_predictions"] = [face_prediction(*f) for f in preds[::max(1, len(preds) // 20)]]
+            faces.append(entry)
+        return faces
+
+def analyze_video(video_path, progress=None, heatmaps=False, faces=False, max_forwards=None):
+    # Full video pipeline returning the /api/detect-video response
+    predictions_per_frame = []
+    mean = TimeWeightedMean()
+    face_tracks = FaceTracks() if faces else None
+    # Calculate suspicious spans (when any class except original > 0.5)
+    spans = SpanTracker()
+    # Keep only the VIDEO_MAX_HEATMAPS most suspicious frames' overlays in memory
+    candidates = []
+    decided_by = Counter()
+
+    def keep_heatmaps(frame_idxs, frames, probs, maps):
+        for frame_idx, frame, p, heatmap in zip(frame_idxs, frames, probs, maps):
+            candidates.append((1 - p[CATEGORIES.index("original")], frame_idx, frame, heatmap))
+        candidates.sort(key=lambda c: c[0], reverse=True)
+        del candidates[VIDEO_MAX_HEATMAPS:]
 
+    on_faces = face_tracks.add if faces else None
+    batches = iter_video_batches(video_path, progress, keep_heatmaps if heatmaps else None, on_faces, max_forwards, decided_by)
+    for batch in batches:
+        for frame_idx, timestamp, probs in batch:
+            predictions_per_frame.append((frame_idx, timestamp, probs))
+            spans.update(timestamp, probs)
+            mean.update(timestamp, probs)
+
+    if not predictions_per_frame:
+        raise ValueError("No frames could be decoded from video.")
+
+    # Aggregate predictions for pie chart
+    agg_probs = mean.value()
+
+    response = {
+        "piechart_url": piechart_url(agg_probs),
+        "probabilities": probabilities(agg_probs),
+        # Return top 3 suspicious spans if many
+        "suspicious_spans_seconds": spans.spans[:3],
+        "frame_predictions": [
+            frame_prediction(*f)
+            for f in predictions_per_frame[::max(1, len(predictions_per_frame)//20)]  # sampled for brevity
+        ],
+        "frames_scored": len(predictions_per_frame),
+        # Scored frames per cascade stage ("screen" = settled by the screening model alone)
+        "decided_by": dict(decided_by)
+    }
+    if heatmaps:
+        timestamps = {f[0]: f[1] for f in predictions_per_frame}
+        response["frame_heatmaps"] = [
+            {
+                "frame": frame_idx,
+                "timestamp_sec": timestamps[frame_idx],
+                "heatmap_url": save_heatmap_overlay(frame, heatmap, prefix="heatmap")
+            }
+            for _, frame_idx, frame, heatmap in sorted(candidates, key=lambda c: c[1])
+        ]
+    if faces:
+        response["faces"] = face_tracks.summary()
+    return response
+
+def stream_video_events(video_path, faces=False, max_forwards=None):
+    # Every scored batch is sent as soon as it is ready; only running totals are kept in memory
+    spans = SpanTracker()
+    mean = TimeWeightedMean()
+    scored = 0
+    face_tracks = FaceTracks(keep_predictions=False) if faces else None
+    face_batch = []
+    decided_by = Counter()
+
+    def on_faces(rows, probs):
+        face_tracks.add(rows, probs)
+        face_batch.extend(face_prediction(*row, p) for row, p in zip(rows, probs))
+
+    for batch in iter_video_batches(video_path, on_faces=on_faces if faces else None, max_forwards=max_forwards,
+                                    decided_by=decided_by):
+        yield "frames", {"frame_predictions": [frame_prediction(*f) for f in batch]}
+        if face_batch:
+            yield "faces", {"face_predictions": face_batch[:]}
+            face_batch.clear()
+        updated = []
+        for _, timestamp, probs in batch:
+            idx = spans.update(timestamp, probs)
+            if idx is not None and idx not in updated:
+                updated.append(idx)
+            mean.update(timestamp, probs)
+        scored += len(batch)
+        for idx in updated:
+            yield "span", {"index": idx, **spans.spans[idx]}
+
+    if not scored:
+        raise ValueError("No frames could be decoded from video.")
+
+    agg_probs = mean.value()
+    summary = {
+        "piechart_url": piechart_url(agg_probs),
+        "probabilities": probabilities(agg_probs),
+        "suspicious_spans_seconds": spans.spans[:3],
+        "frames_scored": scored,
+        "decided_by": dict(decided_by)
+    }
+    if faces:
+        summary["faces"] = face_tracks.summary()
+    yield "summary", summary
+
+def receive_video():
+    # Saves the uploaded file or downloads the URL; returns (video_path, error message)
     file = request.files.get('file')
     url = request.form.get('url')
 
     if file and allowed_file(file.filename):
-        video_path = os.path.join(upload_folder, f"{uuid.uuid4()}.mp4")
-        file.save(video_path)
+        video_path = artifact_store.new_path("uploads", "mp4")
+        try:
+            save_upload(file, video_path, "video")
+        except FetchError as e:
+            return None, str(e)
+        return video_path, None
     elif url:
-        video_path = download_video_from_url(url, upload_folder)
+        video_path = download_video_from_url(url)
         if not video_path:
-            return jsonify({"error": "Failed to download video."}), 400
-    else:
-        return jsonify({"error": "No video file or URL provided."}), 400
+            return None, "Failed to download video."
+        return video_path, None
+    return None, "No video file or URL provided."
+
+@route(detect_video_bp)
+def detect_video():
+    video_path, error = receive_video()
+    if error:
+        return jsonify({"error": error}), 400
+
+    # Optional per-frame Grad-CAM overlays for the most suspicious frames
+    heatmaps = request.form.get('heatmaps', '').lower() in ('1', 'true', 'yes')
+    # Optional face tracking with per-face, per-timestamp scores for the crops
+    faces = request.form.get('faces', '').lower() in ('1', 'true', 'yes')
+    # Optional cap on frames scored for this video (defaults to VIDEO_MAX_FORWARDS)
+    max_forwards = request.form.get('max_forwards', type=int)
 
     try:
-        # Load models (multi-model ensemble)
-        model1_path = "models/model_1.pth"
-        model2_path = "models/model_2.pth"
-        model1 = load_model(model1_path)
-        model2 = load_model(model2_path)
-
-        cap = cv2.VideoCapture(video_path)
-        fps = cap.get(cv2.CAP_PROP_FPS)
-        total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
-
-        frame_interval = max(1, int(fps // 2))  # Analyze 2 frames per second
-        frame_idx = 0
-
-        predictions_per_frame = []
-
-        while cap.isOpened():
-            ret, frame = cap.read()
-            if not ret:
-                break
-            if frame_idx % frame_interval == 0:
-                img_tensor = preprocess_frame(frame)
-                with torch.no_grad():
-                    probs1 = torch.softmax(model1(img_tensor), dim=1).cpu().numpy()
-                    probs2 = torch.softmax(model2(img_tensor), dim=1).cpu().numpy()
-                mean_probs = (probs1 + probs2) / 2
-                predictions_per_frame.append((frame_idx, mean_probs))
-            frame_idx += 1
-
-        cap.release()
-
-        # Aggregate predictions for pie chart
-        agg_probs = np.mean([p[1] for p in predictions_per_frame], axis=0)
-        piechart_path = os.path.join(result_folder, f"pie_{uuid.uuid4()}.png")
-        generate_piechart(agg_probs, CATEGORIES, piechart_path)
-        piechart_url = piechart_path.replace("static/", "/static/")
-
-        # Calculate suspicious spans (when any class except original > 0.5)
-        suspicious_spans = []
-        current_span = None
-
-        for idx, probs in predictions_per_frame:
-            timestamp = idx / fps
-            suspicious_score = 1 - probs[CATEGORIES.index("original")]
-            if suspicious_score > 0.5:
-                if current_span is None:
-                    current_span = {'start': timestamp, 'end': timestamp}
-                else:
-                    current_span['end'] = timestamp
-            else:
-                if current_span is not None:
-                    suspicious_spans.append(current_span)
-                    current_span = None
-        if current_span is not None:
-            suspicious_spans.append(current_span)
+        digest = file_digest(video_path)
+        suffix = (":heatmaps" if heatmaps else "") + (":faces" if faces else "") + (f":max{max_forwards}" if max_forwards else "")
+        key = cache_key("video", digest + suffix)
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached_response(jsonify(cached), True)
 
-        # Return top 3 suspicious spans if many
-        suspicious_spans = suspicious_spans[:3]
-
-        return jsonify({
-            "piechart_url": piechart_url,
-            "suspicious_spans_seconds": suspicious_spans,
-            "frame_predictions": [
-                {
-                    "frame": f[0],
-                    "timestamp_sec": f[0] / fps,
-                    "probabilities": {CATEGORIES[i]: float(f[1][0][i]) for i in range(len(CATEGORIES))}
-                }
-                for f in predictions_per_frame[::max(1, len(predictions_per_frame)//20)]  # sampled for brevity
-            ]
-        })
+        with timed("fingerprint"):
+            hashes = keyframe_hashes(video_path)
+        near = find_near_duplicate("video", hashes, digest, suffix)
+        if near is not None:
+            result_cache.set(key, near)
+            return cached_response(jsonify(near), True)
 
+        response = analyze_video(video_path, heatmaps=heatmaps, faces=faces, max_forwards=max_forwards)
+        result_cache.set(key, response)
+        remember_fingerprint("video", hashes, digest)
+        return cached_response(jsonify(response), False)
+
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+    finally:
+        artifact_store.finish_upload(video_path)
+
+@route(detect_video_bp)
+def detect_video_stream():
+    video_path, error = receive_video()
+    if error:
+        return jsonify({"error": error}), 400
+    faces = request.form.get('faces', '').lower() in ('1', 'true', 'yes')
+    max_forwards = request.form.get('max_forwards', type=int)
+    return stream_response(stream_video_events(video_path, faces, max_forwards), on_close=lambda: artifact_store.finish_upload(video_path))
@@ -0,0 +1,157 @@
+import os
+import threading
+import cv2
+import numpy as np
+
+# Face-first scoring: find faces on a downscaled copy of each sampled frame, follow them between
+# detections with template matching, and score square crops around them with the same ensemble.
+
+# ---------- Settings (override via environment) ----------
+# "haar" uses the cascade bundled with OpenCV; "dnn" uses OpenCV's res10 SSD if its files are present
+FACE_DETECTOR = os.environ.get("FACE_DETECTOR", "haar")
+FACE_DNN_CONFIG = os.environ.get("FACE_DNN_CONFIG", "models/face_detector/deploy.prototxt")
+FACE_DNN_MODEL = os.environ.get("FACE_DNN_MODEL", "models/face_detector/res10_300x300_ssd_iter_140000.caffemodel")
+FACE_DNN_CONFIDENCE = float(os.environ.get("FACE_DNN_CONFIDENCE", "0.6"))
+# Detection and tracking run on frames downscaled to this width
+FACE_DETECT_WIDTH = int(os.environ.get("FACE_DETECT_WIDTH", "640"))
+# Sampled frames between full detections; faces are tracked in between
+FACE_REDETECT_EVERY = int(os.environ.get("FACE_REDETECT_EVERY", "5"))
+FACE_MIN_SIZE = int(os.environ.get("FACE_MIN_SIZE", "32"))
+FACE_MAX_FACES = int(os.environ.get("FACE_MAX_FACES", "4"))
+# Context kept around the face box on each side, as a fraction of the box size
+FACE_MARGIN = float(os.environ.get("FACE_MARGIN", "0.25"))
+# Template-match score below which a tracked face counts as lost (forces a re-detection)
+FACE_TRACK_MIN_SCORE = float(os.environ.get("FACE_TRACK_MIN_SCORE", "0.5"))
+# --------------------------------------------------
+
+class HaarFaceDetector:
+    def __init__(self):
+        path = os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml")
+        self.cascade = cv2.CascadeClassifier(path)
+
+    def detect(self, image, gray):
+        boxes = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5,
+                                              minSize=(FACE_MIN_SIZE, FACE_MIN_SIZE))
+        return [tuple(int(v) for v in box) for box in boxes]
+
+class DnnFaceDetector:
+    def __init__(self):
+        self.net = cv2.dnn.readNetFromCaffe(FACE_DNN_CONFIG, FACE_DNN_MODEL)
+
+    def detect(self, image, gray):
+        h, w = image.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0))
+        self.net.setInput(blob)
+        boxes = []
+        for det in self.net.forward()[0, 0]:
+            if det[2] < FACE_DNN_CONFIDENCE:
+                continue
+            x1, y1, x2, y2 = (det[3:7] * [w, h, w, h]).astype(int)
+            x1, y1 = max(0, x1), max(0, y1)
+            x2, y2 = min(w, x2), min(h, y2)
+            if min(x2 - x1, y2 - y1) >= FACE_MIN_SIZE:
+                boxes.append((int(x1), int(y1), int(x2 - x1), int(y2 - y1)))
+        return boxes
+
+# Cascade/DNN objects are not safe to share between request threads, so each thread keeps its own
+_detectors = threading.local()
+
+def get_face_detector():
+    detector = getattr(_detectors, "detector", None)
+    if detector is None:
+        if FACE_DETECTOR == "dnn" and os.path.exists(FACE_DNN_MODEL) and os.path.exists(FACE_DNN_CONFIG):
+            detector = DnnFaceDetector()
+        else:
+            if FACE_DETECTOR == "dnn":
+                print("Face DNN files not found, using the Haar cascade")
+            detector = HaarFaceDetector()
+        _detectors.detector = detector
+    return detector
+
+def iou(a, b):
+    ax, ay, aw, ah = a
+    bx, by, bw, bh = b
+    w = min(ax + aw, bx + bw) - max(ax, bx)
+    h = min(ay + ah, by + bh) - max(ay, by)
+    if w <= 0 or h <= 0:
+        return 0.0
+    inter = w * h
+    return inter / float(aw * ah + bw * bh - inter)
+
+class FaceTracker:
+    # Follows faces through consecutive sampled frames of one video (or a single image).
+    # update(frame) returns [(face_id, (x, y, w, h))] in the frame's own pixel coordinates.
+    def __init__(self, detector=None, redetect_every=FACE_REDETECT_EVERY):
+        self.detector = detector or get_face_detector()
+        self.redetect_every = max(1, redetect_every)
+        self.tracks = []  # {"id", "box", "template"} in downscaled coordinates
+        self.next_id = 0
+        self.frames_seen = 0
+
+    def update(self, frame):
+        scale = min(1.0, FACE_DETECT_WIDTH / frame.shape[1])
+        small = frame if scale == 1.0 else cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        due = self.frames_seen % self.redetect_every == 0
+        if not due and self.follow(gray):
+            due = True  # a face was lost, look again rather than wait for the next scheduled detection
+        if due:
+            self.associate(self.detector.detect(small, gray), gray)
+        self.frames_seen += 1
+        return [(t["id"], tuple(int(round(v / scale)) for v in t["box"])) for t in self.tracks]
+
+    def associate(self, boxes, gray):
+        # Keep the largest faces and carry over ids from the best-overlapping previous tracks
+        boxes = sorted(boxes, key=lambda b: b[2] * b[3], reverse=True)[:FACE_MAX_FACES]
+        previous = list(self.tracks)
+        self.tracks = []
+        for box in boxes:
+            best = max(previous, key=lambda t: iou(t["box"], box), default=None)
+            if best is not None and iou(best["box"], box) > 0.3:
+                previous.remove(best)
+                face_id = best["id"]
+            else:
+                face_id = self.next_id
+                self.next_id += 1
+            self.tracks.append({"id": face_id, "box": box, "template": self.template(gray, box)})
+
+    def follow(self, gray):
+        # Moves each track to its best template match within a window around its last position;
+        # returns True if any track was lost
+        lost = False
+        kept = []
+        for track in self.tracks:
+            x, y, w, h = track["box"]
+            x0, y0 = max(0, x - w // 2), max(0, y - h // 2)
+            x1, y1 = min(gray.shape[1], x + w + w // 2), min(gray.shape[0], y + h + h // 2)
+            window = gray[y0:y1, x0:x1]
+            template = track["template"]
+            if window.shape[0] < template.shape[0] or window.shape[1] < template.shape[1]:
+                lost = True
+                continue
+            _, score, _, loc = cv2.minMaxLoc(cv2.matchTemplate(window, template, cv2.TM_CCOEFF_NORMED))
+            if score < FACE_TRACK_MIN_SCORE:
+                lost = True
+                continue
+            track["box"] = (x0 + loc[0], y0 + loc[1], w, h)
+            track["template"] = self.template(gray, track["box"])
+            kept.append(track)
+        self.tracks = kept
+        return lost
+
+    @staticmethod
+    def template(gray, box):
+        x, y, w, h = box
+        return gray[y:y + h, x:x + w].copy()
+
+def crop_faces(frame, faces, margin=FACE_MARGIN):
+    # Square BGR crops around each (face_id, box), with some context, clipped to the frame
+    crops = []
+    height, width = frame.shape[:2]
+    for _, (x, y, w, h) in faces:
+        side = int(max(w, h) * (1 + 2 * margin))
+        cx, cy = x + w // 2, y + h // 2
+        x0, y0 = max(0, cx - side // 2), max(0, cy - side // 2)
+        x1, y1 = min(width, x0 + side), min(height, y0 + side)
+        crops.append(np.ascontiguousarray(frame[y0:y1, x0:x1]))
+    return crops
@@ -0,0 +1,96 @@
+import os
+import hashlib
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from cache import remember_digest
+from metrics import timed
+
+# ---------- Settings (override via environment) ----------
+MB = 1024 * 1024
+# modality -> (max bytes, accepted Content-Type prefixes; an empty/missing header is accepted)
+FETCH_LIMITS = {
+    "image": (int(os.environ.get("MAX_IMAGE_BYTES", str(20 * MB))), ("image/", "application/octet-stream")),
+    "video": (int(os.environ.get("MAX_VIDEO_BYTES", str(500 * MB))), ("video/", "application/octet-stream")),
+    "audio": (int(os.environ.get("MAX_AUDIO_BYTES", str(100 * MB))), ("audio/", "video/", "application/octet-stream")),
+    "text": (int(os.environ.get("MAX_TEXT_BYTES", str(5 * MB))), ("text/", "application/json", "application/xml")),
+}
+FETCH_TIMEOUT = (5, 30)  # connect, per-read seconds
+CHUNK_SIZE = 64 * 1024
+# --------------------------------------------------
+
+class FetchError(Exception):
+    pass
+
+_session = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def get_session():
+    # One keep-alive connection pool per process (rebuilt after a fork)
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=8, pool_maxsize=16)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+def write_chunks(chunks, path, max_bytes):
+    # Streams chunks to path via a temp file, hashing on the way; returns the SHA-256 hex digest
+    digest = hashlib.sha256()
+    written = 0
+    tmp = f"{path}.part"
+    try:
+        with open(tmp, "wb") as f:
+            for chunk in chunks:
+                if not chunk:
+                    continue
+                written += len(chunk)
+                if written > max_bytes:
+                    raise FetchError(f"File exceeds the {max_bytes // MB} MB limit.")
+                f.write(chunk)
+                digest.update(chunk)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    remember_digest(path, digest.hexdigest())
+    return digest.hexdigest()
+
+def fetch_to_file(url, path, modality, session=None):
+    # Downloads url into path without holding the body in memory; returns the SHA-256 of the content
+    max_bytes, content_types = FETCH_LIMITS[modality]
+    session = session or get_session()
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        with timed("download"), session.get(url, stream=True, timeout=FETCH_TIMEOUT) as r:
+            if r.status_code != 200:
+                raise FetchError(f"Download failed with HTTP {r.status_code}.")
+            content_type = r.headers.get("Content-Type", "").split(";")[0].strip().lower()
+            if content_type and not content_type.startswith(content_types):
+                raise FetchError(f"Unexpected content type for {modality}: {content_type}")
+            length = r.headers.get("Content-Length")
+            if length and length.isdigit() and int(length) > max_bytes:
+                raise FetchError(f"File exceeds the {max_bytes // MB} MB limit.")
+            return write_chunks(r.iter_content(CHUNK_SIZE), path, max_bytes)
+    except requests.RequestException as e:
+        raise FetchError(f"Download failed: {e}")
+
+def save_upload(file_storage, path, modality):
+    # Copies a werkzeug upload to path in chunks, enforcing the modality's size limit
+    max_bytes, _ = FETCH_LIMITS[modality]
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    stream = file_storage.stream
+    with timed("upload"):
+        return write_chunks(iter(lambda: stream.read(CHUNK_SIZE), b""), path, max_bytes)
+
+def request_limit(modality):
+    # Request body limit for one modality's upload, with some room for multipart overhead
+    return FETCH_LIMITS[modality][0] + MB
+
+def max_request_bytes():
+    # Upper bound for Flask's MAX_CONTENT_LENGTH (routes without a modality, e.g. /api/batch)
+    return max(request_limit(modality) for modality in FETCH_LIMITS)
@@ -0,0 +1,259 @@
+import os
+import threading
+from contextlib import contextmanager
+from itertools import combinations
+import cv2
+import numpy as np
+from cache import result_cache, cache_key
+from metrics import near_duplicate_lookups, timed
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process locking, fine for the single-process dev server
+    fcntl = None
+
+# Perceptual fingerprints, so re-encoded, resized or re-muxed copies of media we already analysed reuse
+# the earlier verdict. Every fingerprint is 128 bits:
+#   image / video keyframe: 64-bit pHash (DCT of a 32x32 grey copy) followed by a 64-bit dHash (9x8 gradients)
+#   audio segment: 16 bands x 8 time bins of mel energy-difference signs; a clip has one hash per segment
+# Each modality has an append-only, memory-mapped record file searched by multi-index hashing: the 128 bits
+# are cut into 8 16-bit chunks and any hash within distance r shares at least one chunk with the query
+# within r // 8 bits, so a lookup only probes a few sorted chunk tables instead of scanning every entry.
+
+# ---------- Settings (override via environment) ----------
+NEAR_DUPLICATES = os.environ.get("NEAR_DUPLICATES", "1") == "1"
+NEAR_DUPLICATE_PATH = os.environ.get("NEAR_DUPLICATE_PATH", "cache/fingerprints")
+# Fraction of the 128 bits that must agree for a near match (0.9 allows 12 differing bits)
+NEAR_DUPLICATE_SIMILARITY = float(os.environ.get("NEAR_DUPLICATE_SIMILARITY", "0.9"))
+# Keyframes hashed per video, evenly spaced, and the fraction that must match the same earlier video
+NEAR_DUPLICATE_KEYFRAMES = int(os.environ.get("NEAR_DUPLICATE_KEYFRAMES", "8"))
+NEAR_DUPLICATE_VIDEO_MATCH = float(os.environ.get("NEAR_DUPLICATE_VIDEO_MATCH", "0.75"))
+# Audio is hashed in consecutive segments this long over the whole clip; every segment must match the same
+# earlier clip, whose duration must agree within the tolerance, so edits anywhere in the clip are not masked
+NEAR_DUPLICATE_AUDIO_SECONDS = float(os.environ.get("NEAR_DUPLICATE_AUDIO_SECONDS", "10"))
+NEAR_DUPLICATE_AUDIO_MATCH = float(os.environ.get("NEAR_DUPLICATE_AUDIO_MATCH", "1.0"))
+NEAR_DUPLICATE_DURATION_TOLERANCE = float(os.environ.get("NEAR_DUPLICATE_DURATION_TOLERANCE", "0.5"))
+# Entries appended since the last chunk-table build that are scanned linearly before a rebuild
+NEAR_DUPLICATE_TAIL_ROWS = int(os.environ.get("NEAR_DUPLICATE_TAIL_ROWS", "50000"))
+# --------------------------------------------------
+
+BITS = 128
+CHUNKS = 8
+CHUNK_BITS = BITS // CHUNKS
+RECORD = np.dtype([("hi", "<u8"), ("lo", "<u8"), ("digest", "u1", 32)])
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def pack_bits(bits):
+    # 64 booleans -> int, most significant first
+    return int.from_bytes(np.packbits(np.asarray(bits, dtype=bool).ravel()).tobytes(), "big")
+
+def image_hash(gray):
+    # Grey uint8 image of any size -> (pHash, dHash)
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:8, :8].ravel()
+    phash = pack_bits(low > np.median(low[1:]))
+    grad = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA).astype(np.int16)
+    dhash = pack_bits(grad[:, 1:] > grad[:, :-1])
+    return phash, dhash
+
+def spectral_hash(mel_db):
+    # dB mel spectrogram [n_mels, T] -> 128-bit hash, or None if it is too short. Each bit is the sign of
+    # how the energy difference between adjacent bands changes between adjacent time bins, which survives
+    # re-encoding, resampling and volume changes.
+    n_mels, frames = mel_db.shape
+    if frames < 9:
+        return None
+    bands = np.linspace(0, n_mels, 18).astype(int)
+    times = np.linspace(0, frames, 10).astype(int)
+    energy = np.array([[mel_db[bands[b]:bands[b + 1], times[t]:times[t + 1]].mean() for t in range(9)]
+                       for b in range(17)])
+    band_diff = energy[:-1] - energy[1:]           # [16, 9]
+    bits = (band_diff[:, :-1] - band_diff[:, 1:]) > 0  # [16, 8]
+    return pack_bits(bits[:8]), pack_bits(bits[8:])
+
+def popcount(values):
+    return POPCOUNT[np.ascontiguousarray(values, dtype="<u8").view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+def chunk_values(hi, lo):
+    # [n] uint64 halves -> [n, CHUNKS] 16-bit chunk values
+    shifts = np.arange(48, -1, -CHUNK_BITS, dtype=np.uint64)
+    mask = np.uint64(0xFFFF)
+    hi = np.asarray(hi, dtype=np.uint64)[:, None]
+    lo = np.asarray(lo, dtype=np.uint64)[:, None]
+    return np.concatenate([(hi >> shifts) & mask, (lo >> shifts) & mask], axis=1).astype(np.uint32)
+
+def neighbours(value, radius):
+    # Every 16-bit value within Hamming distance radius of value
+    yield value
+    for r in range(1, radius + 1):
+        for positions in combinations(range(CHUNK_BITS), r):
+            flipped = value
+            for p in positions:
+                flipped ^= 1 << p
+            yield flipped
+
+class HashIndex:
+    # records.bin: append-only RECORD rows (hash halves + SHA-256 of the analysed file), shared by all workers.
+    # tables.npy: [2 * CHUNKS, n] uint32, per chunk the sorted chunk values then the row order, covering the
+    # first n rows; rows after that are the tail, scanned directly until the next rebuild.
+    def __init__(self, path):
+        self.path = path
+        self.records_path = os.path.join(path, "records.bin")
+        self.tables_path = os.path.join(path, "tables.npy")
+        self.lock = threading.Lock()
+        self.records = np.zeros(0, dtype=RECORD)
+        self.tables = np.zeros((2 * CHUNKS, 0), dtype=np.uint32)
+        self.tables_mtime = None
+
+    @contextmanager
+    def file_lock(self):
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock, open(os.path.join(self.path, ".lock"), "w") as f:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+    def refresh(self):
+        # Re-map the files if another worker has appended or rebuilt since we last looked
+        try:
+            rows = os.path.getsize(self.records_path) // RECORD.itemsize
+        except OSError:
+            rows = 0
+        if rows != len(self.records):
+            self.records = np.memmap(self.records_path, dtype=RECORD, mode="r", shape=(rows,)) if rows else np.zeros(0, dtype=RECORD)
+        try:
+            mtime = os.path.getmtime(self.tables_path)
+        except OSError:
+            mtime = None
+        if mtime != self.tables_mtime:
+            self.tables = np.load(self.tables_path, mmap_mode="r") if mtime else np.zeros((2 * CHUNKS, 0), dtype=np.uint32)
+            self.tables_mtime = mtime
+
+    def __len__(self):
+        self.refresh()
+        return len(self.records)
+
+    def add(self, hashes, digest):
+        rows = np.zeros(len(hashes), dtype=RECORD)
+        rows["hi"] = [h[0] for h in hashes]
+        rows["lo"] = [h[1] for h in hashes]
+        rows["digest"] = np.frombuffer(bytes.fromhex(digest), dtype=np.uint8)
+        with self.file_lock():
+            with open(self.records_path, "ab") as f:
+                # Drop a partial row left by an interrupted write so rows stay aligned
+                end = f.tell()
+                if end % RECORD.itemsize:
+                    f.truncate(end - end % RECORD.itemsize)
+                f.write(rows.tobytes())
+            self.refresh()
+            if len(self.records) - self.tables.shape[1] > NEAR_DUPLICATE_TAIL_ROWS:
+                self.rebuild()
+
+    def rebuild(self):
+        # Called with the file lock held
+        records = self.records
+        chunks = chunk_values(records["hi"], records["lo"])   # [n, CHUNKS]
+        order = np.argsort(chunks, axis=0, kind="stable")     # [n, CHUNKS]
+        values = np.take_along_axis(chunks, order, axis=0)
+        tables = np.concatenate([values.T, order.T.astype(np.uint32)])
+        tmp = self.tables_path + ".tmp.npy"
+        np.save(tmp, tables)
+        os.replace(tmp, self.tables_path)
+        self.refresh()
+
+    def candidates(self, hi, lo, radius):
+        indexed = self.tables.shape[1]
+        found = []
+        if indexed:
+            query = chunk_values([hi], [lo])[0]
+            for j in range(CHUNKS):
+                values, order = self.tables[j], self.tables[CHUNKS + j]
+                for v in neighbours(int(query[j]), radius):
+                    a = np.searchsorted(values, v, "left")
+                    b = np.searchsorted(values, v, "right")
+                    if b > a:
+                        found.append(np.asarray(order[a:b], dtype=np.int64))
+        if len(self.records) > indexed:
+            found.append(np.arange(indexed, len(self.records)))
+        return np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+
+    def search(self, hi, lo, max_distance):
+        # -> [(distance, digest hex)] within max_distance, nearest first
+        self.refresh()
+        rows = self.candidates(hi, lo, max_distance // CHUNKS)
+        if not len(rows):
+            return []
+        found = self.records[rows]
+        distance = popcount(found["hi"] ^ np.uint64(hi)) + popcount(found["lo"] ^ np.uint64(lo))
+        keep = np.nonzero(distance <= max_distance)[0]
+        return sorted((int(distance[i]), bytes(found["digest"][i]).hex()) for i in keep)
+
+class NearDuplicateIndex:
+    def __init__(self, root):
+        self.root = root
+        self.indexes = {}
+        self.lock = threading.Lock()
+
+    def index(self, modality):
+        with self.lock:
+            if modality not in self.indexes:
+                self.indexes[modality] = HashIndex(os.path.join(self.root, modality))
+            return self.indexes[modality]
+
+    def add(self, modality, hashes, digest):
+        if hashes:
+            self.index(modality).add(hashes, digest)
+
+    def matches(self, modality, hashes, similarity=NEAR_DUPLICATE_SIMILARITY):
+        # -> [(digest, similarity)] best first. With several hashes (video keyframes, audio segments) an earlier
+        # item must match at least the modality's match fraction of them; its similarity is the mean over the
+        # matched ones.
+        max_distance = int((1 - similarity) * BITS)
+        index = self.index(modality)
+        best = {}  # digest -> {query position: distance}
+        for position, (hi, lo) in enumerate(hashes):
+            for distance, digest in index.search(hi, lo, max_distance):
+                per_query = best.setdefault(digest, {})
+                per_query[position] = min(distance, per_query.get(position, BITS))
+        fraction = NEAR_DUPLICATE_AUDIO_MATCH if modality == "audio" else NEAR_DUPLICATE_VIDEO_MATCH
+        needed = max(1, int(np.ceil(fraction * len(hashes)))) if len(hashes) > 1 else 1
+        results = []
+        for digest, per_query in best.items():
+            if len(per_query) >= needed:
+                mean_distance = sum(per_query.values()) / len(per_query)
+                results.append((digest, 1 - mean_distance / BITS))
+        return sorted(results, key=lambda r: r[1], reverse=True)
+
+    def stats(self):
+        stats = {}
+        for modality in ("image", "video", "audio"):
+            path = os.path.join(self.root, modality)
+            if os.path.isdir(path):
+                stats[modality] = len(self.index(modality))
+        return stats
+
+near_duplicates = NearDuplicateIndex(NEAR_DUPLICATE_PATH)
+
+def find_near_duplicate(modality, hashes, digest, suffix="", duration=None):
+    # The cached verdict of perceptually similar media analysed earlier (with the same options suffix),
+    # flagged with "near_duplicate", or None. With a duration, the earlier result's "duration_sec" must agree.
+    if not NEAR_DUPLICATES or not hashes:
+        return None
+    with timed("near_duplicate_lookup"):
+        for match, similarity in near_duplicates.matches(modality, hashes):
+            if match == digest:
+                continue
+            # Probing candidates isn't a cache lookup of this request, so it stays out of the hit/miss stats
+            prior = result_cache.peek(cache_key(modality, match + suffix))
+            if prior is not None and duration is not None:
+                if abs(prior.get("duration_sec", float("-inf")) - duration) > NEAR_DUPLICATE_DURATION_TOLERANCE:
+                    continue
+            if prior is not None:
+                near_duplicate_lookups.inc(modality=modality, result="hit")
+                return dict(prior, near_duplicate={"digest": match, "similarity": round(similarity, 4)})
+    near_duplicate_lookups.inc(modality=modality, result="miss")
+    return None
+
+def remember_fingerprint(modality, hashes, digest):
+    if NEAR_DUPLICATES and hashes:
+        near_duplicates.add(modality, hashes, digest)
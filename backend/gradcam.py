@@ -1,70 +1,164 @@
+import os
 import torch
+import torch.nn.functional as F
 import numpy as np
 import cv2
-import os
-import uuid
-from torchvision import models
-from PIL import Image
+import threading
+from model import (ENSEMBLES, INFERENCE_SERVER_ADDRESS, SCREENS, cascade_enabled, ensemble_predict_batch, ensemble_weights,
+                   get_ensemble, get_reference_model, get_screen, remote_call, stage_names, uncertain_rows)
+from artifacts import artifact_store
+from metrics import batch_items, cascade_decisions, timed
+
+# ---------- Settings (override via environment) ----------
+# Rows per Grad-CAM forward/backward; each keeps a full autograd graph until its backward, so whole
+# video groups or inference-server batches would otherwise need several GB
+GRADCAM_BATCH_SIZE = int(os.environ.get("GRADCAM_BATCH_SIZE", "4"))
+# --------------------------------------------------
+
+def cam_target_layer(model):
+    # Last conv block: layer4 on ResNets, the last feature block on MobileNet-style screening models
+    return model.layer4 if hasattr(model, "layer4") else model.features[-1]
 
 class GradCAM:
-    def __init__(self, model, target_layer):
+    # Use as a context manager so the forward hook is always removed:
+    #     with GradCAM(model) as cam:
+    #         logits = cam.forward(x)
+    #         heatmaps = cam.generate(logits)
+    def __init__(self, model, target_layer=None):
         self.model = model
-        self.target_layer = target_layer
-        self.gradients = None
+        # Default to last conv layer of ResNet
+        self.target_layer = target_layer if target_layer is not None else cam_target_layer(model)
         self.activations = None
+        self.handle = None
+        self.thread = None
+
+    def __enter__(self):
         self.hook_layers()
+        return self
 
-    def hook_layers(self):
-        def backward_hook(module, grad_in, grad_out):
-            self.gradients = grad_out[0].detach()
+    def __exit__(self, *exc):
+        self.remove_hooks()
+        self.activations = None
 
+    def hook_layers(self):
         def forward_hook(module, inp, out):
-            self.activations = out.detach()
+            # The model is shared; ignore forwards other threads run while we are hooked
+            if threading.get_ident() == self.thread:
+                self.activations = out
 
-        self.target_layer.register_forward_hook(forward_hook)
-        self.target_layer.register_backward_hook(backward_hook)
+        self.thread = threading.get_ident()
+        if self.handle is None:
+            self.handle = self.target_layer.register_forward_hook(forward_hook)
+
+    def remove_hooks(self):
+        if self.handle is not None:
+            self.handle.remove()
+            self.handle = None
+
+    def forward(self, input_tensor):
+        # Regular forward that keeps the graph so its logits can be reused for the prediction
+        with torch.enable_grad():
+            return self.model(input_tensor)
+
+    def generate(self, logits, target_classes=None, size=(224, 224)):
+        # One backward for the whole batch -> heatmaps [N, H, W] scaled to 0..1
+        if target_classes is None:
+            target_classes = logits.argmax(dim=1)
+        target_classes = torch.as_tensor(target_classes, dtype=torch.long).view(-1, 1)
+        score = logits.gather(1, target_classes).sum()
+        # Gradients w.r.t. the activations only, so the shared model's parameters never collect .grad
+        gradients = torch.autograd.grad(score, self.activations)[0]
+        weights = gradients.mean(dim=(2, 3))
+        cam = torch.relu(torch.einsum("nk,nkhw->nhw", weights, self.activations.detach()))
+        cam = F.interpolate(cam.unsqueeze(1), size=size, mode="bilinear", align_corners=False)[:, 0]
+        cam = cam - cam.amin(dim=(1, 2), keepdim=True)
+        cam = cam / (cam.amax(dim=(1, 2), keepdim=True) + 1e-8)
+        return cam.cpu().numpy()
 
     def generate_heatmap(self, input_tensor, target_class=None):
-        self.model.eval()
-        output = self.model(input_tensor)
-        if target_class is None:
-            target_class = output.argmax(dim=1).item()
-
-        self.model.zero_grad()
-        loss = output[0][target_class]
-        loss.backward()
-
-        gradients = self.gradients[0].cpu().numpy()
-        activations = self.activations[0].cpu().numpy()
-        weights = np.mean(gradients, axis=(1, 2))
-        cam = np.zeros(activations.shape[1:], dtype=np.float32)
-
-        for i, w in enumerate(weights):
-            cam += w * activations[i]
-
-        cam = np.maximum(cam, 0)
-        cam = cv2.resize(cam, (input_tensor.shape[2], input_tensor.shape[3]))
-        cam = cam - np.min(cam)
-        cam = cam / (np.max(cam) + 1e-8)
-        return cam
-
-def save_heatmap_on_image(img_path, heatmap, output_folder):
-    os.makedirs(output_folder, exist_ok=True)
-    img = cv2.imread(img_path)
+        with self:
+            logits = self.forward(input_tensor)
+            targets = None if target_class is None else [target_class] * input_tensor.shape[0]
+            return self.generate(logits, targets, tuple(input_tensor.shape[2:]))[0]
+
+def ensemble_predict_with_heatmaps(models, batch_tensor, cam_model=None, weights=None):
+    # The first member's forward doubles as the Grad-CAM pass, the others run without gradients.
+    # A separate eager cam_model is needed when the members run on a TorchScript/int8 backend.
+    # Returns (probs [N, C], heatmaps [N, 224, 224]) for the ensemble's predicted classes.
+    cam_model = models[0] if cam_model is None else cam_model
+    weights = np.full(len(models), 1.0 / len(models)) if weights is None else np.asarray(weights)
+    shared = cam_model is models[0]
+    probs = others = None
+    if not shared:
+        probs = ensemble_predict_batch(models, batch_tensor, weights=weights)
+    elif len(models) > 1:
+        rest = weights[1:].sum()
+        others = rest * ensemble_predict_batch(models[1:], batch_tensor, weights=weights[1:] / rest)
+    chunk_probs, heatmaps = [], []
+    with GradCAM(cam_model) as cam:
+        # Chunked, so at most GRADCAM_BATCH_SIZE rows hold an autograd graph at a time
+        for start in range(0, batch_tensor.shape[0], GRADCAM_BATCH_SIZE):
+            end = start + GRADCAM_BATCH_SIZE
+            logits = cam.forward(batch_tensor[start:end])
+            if shared:
+                p = torch.softmax(logits.detach(), dim=1).cpu().numpy()
+                if others is not None:
+                    p = weights[0] * p + others[start:end]
+            else:
+                p = probs[start:end]
+            chunk_probs.append(p)
+            heatmaps.append(cam.generate(logits, p.argmax(axis=1), tuple(batch_tensor.shape[2:])))
+    return np.concatenate(chunk_probs), np.concatenate(heatmaps)
+
+def cascade_predict_with_heatmaps(modality, batch_tensor):
+    # Grad-CAM counterpart of model.cascade_predict_batch -> (probs, heatmaps, screened): rows the screening
+    # model is confident about keep its prediction and heatmap, the rest are redone by the ensemble
+    probs, screened = None, np.zeros(batch_tensor.shape[0], dtype=bool)
+    screen = get_screen(modality) if cascade_enabled(modality) else None
+    if screen is not None:
+        with timed("screen_gradcam"):
+            probs, heatmaps = ensemble_predict_with_heatmaps([screen], batch_tensor, get_reference_model(SCREENS[modality]))
+        screened = ~uncertain_rows(modality, probs)
+    if probs is None or not screened.all():
+        rest = np.nonzero(~screened)[0]
+        inputs = batch_tensor if probs is None else batch_tensor[torch.from_numpy(rest)]
+        cam_model = get_reference_model(ENSEMBLES[modality][0])
+        with timed("forward_gradcam"):
+            full = ensemble_predict_with_heatmaps(get_ensemble(modality), inputs, cam_model, ensemble_weights(modality))
+        if probs is None:
+            probs, heatmaps = full
+        else:
+            probs[rest], heatmaps[rest] = full
+    cascade_decisions.inc(int(screened.sum()), modality=modality, stage="screen")
+    cascade_decisions.inc(int((~screened).sum()), modality=modality, stage="ensemble")
+    return probs, heatmaps, screened
+
+def predict_with_heatmaps(modality, batch_tensor, stages=None):
+    # -> (probs, heatmaps); stages works as in model.predict_modality
+    batch_items.observe(batch_tensor.shape[0], modality=modality)
+    if INFERENCE_SERVER_ADDRESS:
+        with timed("forward_gradcam"):
+            probs, heatmaps, screened = remote_call("predict_heatmaps", modality, batch_tensor.numpy())
+    else:
+        probs, heatmaps, screened = cascade_predict_with_heatmaps(modality, batch_tensor)
+    if stages is not None:
+        stages.extend(stage_names(screened))
+    return probs, heatmaps
+
+def save_heatmap_overlay(img, heatmap, prefix="gradcam"):
+    # img is a BGR array of any size
     img = cv2.resize(img, (heatmap.shape[1], heatmap.shape[0]))
     heatmap_img = cv2.applyColorMap(np.uint8(255 * heatmap), cv2.COLORMAP_JET)
     overlayed_img = heatmap_img * 0.4 + img * 0.6
-    filename = f"gradcam_{uuid.uuid4()}.jpg"
-    out_path = os.path.join(output_folder, filename)
-    cv2.imwrite(out_path, overlayed_img)
-    return out_path.replace("static/", "/static/")
+    out_path = artifact_store.new_path("heatmaps", "jpg", prefix=f"{prefix}_")
+    with timed("heatmap_save"):
+        cv2.imwrite(out_path, overlayed_img)
+    return artifact_store.add(out_path, "heatmaps")
 
-def create_heatmap(model, input_tensor, img_path, output_folder, target_layer=None):
-    if target_layer is None:
-        # Default to last conv layer of ResNet
-        target_layer = model.layer4
+def save_heatmap_on_image(img_path, heatmap):
+    return save_heatmap_overlay(cv2.imread(img_path), heatmap)
 
-    gradcam = GradCAM(model, target_layer)
-    heatmap = gradcam.generate_heatmap(input_tensor)
-    heatmap_path = save_heatmap_on_image(img_path, heatmap, output_folder)
+def create_heatmap(model, input_tensor, img_path, target_layer=None):
+    heatmap = GradCAM(model, target_layer).generate_heatmap(input_tensor)
+    heatmap_path = save_heatmap_on_image(img_path, heatmap)
     return heatmap_path
@@ -0,0 +1,30 @@
+import os
+import glob
+
+# Picked up automatically by `gunicorn app:app` when started from this directory.
+# Worker count comes from WEB_CONCURRENCY (gunicorn's default); see model.configure_threads for the
+# TORCH_*_THREADS, ENSEMBLE_PARALLEL and PIN_WORKER_CPUS settings applied to each worker.
+
+# PRELOAD_APP=1 imports the app (torch, transformers, cv2 and, with WARMUP_MODELS=1, the weights) once
+# in the master; workers fork from it and share those pages copy-on-write instead of each paying the import.
+preload_app = os.environ.get("PRELOAD_APP", "0") == "1"
+if preload_app:
+    # Keep the master from starting an OpenMP pool that forked workers would inherit in a broken state;
+    # configure_threads sets each worker's real thread counts after the fork.
+    os.environ.setdefault("OMP_NUM_THREADS", "1")
+
+def post_fork(server, worker):
+    # Each worker takes its own share of the cores. Respawned workers reuse slots by age, so a
+    # replacement may share a slice with a live worker until the next restart.
+    from model import configure_threads
+    workers = server.cfg.workers
+    info = configure_threads((worker.age - 1) % workers, workers)
+    server.log.info("Worker %s threads: %s", worker.pid, info)
+
+# Workers share their metrics through this directory, so any worker's /metrics reports the whole server
+os.environ.setdefault("METRICS_DIR", os.path.join("cache", "metrics"))
+
+def on_starting(server):
+    # Counters restart with the server; files left by a previous run would be added to the new totals
+    for path in glob.glob(os.path.join(os.environ["METRICS_DIR"], "*.json")):
+        os.remove(path)
@@ -0,0 +1,254 @@
+import os
+import sys
+import time
+import queue
+import argparse
+import tempfile
+import threading
+import numpy as np
+import torch
+from multiprocessing.connection import Listener, Client
+from werkzeug.exceptions import ServiceUnavailable
+from model import (INFERENCE_SERVER_ADDRESS, cascade_predict_batch, combine_probs, configure_threads, ensemble_map,
+                   ensemble_weights, get_ensemble, warmup_models)
+from metrics import add_timing, batch_items, queue_wait_seconds
+
+# One process owns every model; Flask workers send it inputs over a local socket
+# (set INFERENCE_SERVER_ADDRESS in both) and it answers with batched forwards.
+# Connections carry pickles, so both sides must share a secret INFERENCE_SERVER_AUTHKEY
+# (e.g. `python -c "import secrets; print(secrets.token_hex(32))"`) and the socket lives in a directory
+# only its owner can write to, with mode 0600.
+
+# ---------- Settings (override via environment or CLI) ----------
+MAX_BATCH_ITEMS = int(os.environ.get("INFERENCE_MAX_BATCH", "64"))
+MAX_WAIT_MS = float(os.environ.get("INFERENCE_MAX_WAIT_MS", "10"))
+AUTHKEY = os.environ.get("INFERENCE_SERVER_AUTHKEY", "").encode()
+DEFAULT_ADDRESS = os.path.join(tempfile.gettempdir(), f"deepfake-inference-{os.getuid()}", "inference.sock")
+# Seconds a worker waits for the server's reply before giving up with a 503
+REPLY_TIMEOUT = float(os.environ.get("INFERENCE_SERVER_TIMEOUT", "120"))
+# --------------------------------------------------
+
+def require_authkey():
+    if len(AUTHKEY) < 16:
+        raise RuntimeError("INFERENCE_SERVER_AUTHKEY must be set to a secret of at least 16 characters "
+                           "for both the inference server and the Flask workers")
+    return AUTHKEY
+
+def private_socket_dir(address):
+    # Creates the socket's directory 0700; refuses one other users could write to, where they could
+    # replace the socket with their own
+    directory = os.path.dirname(os.path.abspath(address))
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.stat(directory)
+    if info.st_uid != os.getuid() or info.st_mode & 0o022:
+        raise RuntimeError(f"{directory}: the inference socket needs a directory owned by this user "
+                           f"and not writable by others")
+
+# One forward at a time, so concurrent modalities don't fight over the same cores
+compute_lock = threading.Lock()
+
+class PendingRequest:
+    def __init__(self, items, size):
+        self.items = items
+        self.size = size
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.queued = time.monotonic()
+        # Reported back to the client so its /metrics shows server-side batching
+        self.stats = {}
+
+class MicroBatcher:
+    # Collects requests for up to max_wait_ms or max_items, runs them as one batch and scatters the results
+    def __init__(self, run, join, split, max_items, max_wait_ms):
+        self.run = run
+        self.join = join
+        self.split = split
+        self.max_items = max_items
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = queue.Queue()
+        threading.Thread(target=self.loop, daemon=True).start()
+
+    def submit(self, items):
+        pending = PendingRequest(items, len(items))
+        self.queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.result, pending.stats
+
+    def collect(self):
+        batch = [self.queue.get()]
+        count = batch[0].size
+        deadline = time.monotonic() + self.max_wait
+        while count < self.max_items:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                pending = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            count += pending.size
+        return batch
+
+    def loop(self):
+        while True:
+            batch = self.collect()
+            started = time.monotonic()
+            total = sum(p.size for p in batch)
+            for pending in batch:
+                pending.stats = {"queue_wait": started - pending.queued, "batch_items": total}
+            try:
+                with compute_lock:
+                    outputs = self.run(self.join([p.items for p in batch]))
+                for pending, result in zip(batch, self.split(outputs, [p.size for p in batch])):
+                    pending.result = result
+            except Exception as e:
+                for pending in batch:
+                    pending.error = e
+            for pending in batch:
+                pending.done.set()
+
+def split_rows(outputs, sizes):
+    return np.split(outputs, np.cumsum(sizes)[:-1])
+
+def join_lists(parts):
+    return [item for part in parts for item in part]
+
+def tensor_predictor(modality):
+    # -> (probs, screened) through the modality's cascade
+    def run(batch):
+        return cascade_predict_batch(modality, torch.from_numpy(batch), MAX_BATCH_ITEMS)
+    return run
+
+def predict_text(sentences):
+    from detect_text import predict_sentences
+    members = get_ensemble("text")
+    member_probs = ensemble_map(lambda member: predict_sentences(*member, sentences), members)
+    return combine_probs(member_probs, ensemble_weights("text"))
+
+def heatmap_predictor(modality):
+    # -> (probs, heatmaps, screened)
+    def run(batch):
+        from gradcam import cascade_predict_with_heatmaps
+        return cascade_predict_with_heatmaps(modality, torch.from_numpy(batch))
+    return run
+
+def split_outputs(outputs, sizes):
+    # Tuple of row-aligned arrays -> one tuple per request
+    return zip(*(split_rows(output, sizes) for output in outputs))
+
+def build_handlers(max_items, max_wait_ms):
+    handlers = {}
+    for modality in ("image", "video", "audio"):
+        batcher = MicroBatcher(tensor_predictor(modality), np.concatenate, split_outputs, max_items, max_wait_ms)
+        handlers[("predict", modality)] = batcher.submit
+        # Grad-CAM requests get their own batcher, one backward covers every queued item
+        cam_batcher = MicroBatcher(heatmap_predictor(modality), np.concatenate, split_outputs, max_items, max_wait_ms)
+        handlers[("predict_heatmaps", modality)] = cam_batcher.submit
+    text_batcher = MicroBatcher(predict_text, join_lists, split_rows, max_items, max_wait_ms)
+    handlers[("predict", "text")] = text_batcher.submit
+    return handlers
+
+def serve_connection(conn, handlers):
+    with conn:
+        while True:
+            try:
+                op, modality, payload = conn.recv()
+            except (EOFError, OSError):
+                return
+            handler = handlers.get((op, modality))
+            try:
+                if handler is None:
+                    raise ValueError(f"Unsupported request: {op} {modality}")
+                result, stats = handler(payload)
+                conn.send(("ok", result, stats))
+            except Exception as e:
+                conn.send(("error", f"{type(e).__name__}: {e}", {}))
+
+def serve(address, max_items=MAX_BATCH_ITEMS, max_wait_ms=MAX_WAIT_MS):
+    print(f"Threads: {configure_threads()}", flush=True)
+    warmup_models()
+    authkey = require_authkey()
+    private_socket_dir(address)
+    handlers = build_handlers(max_items, max_wait_ms)
+    if os.path.exists(address):
+        os.remove(address)
+    # Bind with a umask so the socket is never connectable by others, not even before the chmod
+    umask = os.umask(0o177)
+    try:
+        listener = Listener(address, family="AF_UNIX", authkey=authkey)
+    finally:
+        os.umask(umask)
+    os.chmod(address, 0o600)
+    with listener:
+        print(f"Inference server listening on {address}", flush=True)
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                print(f"Rejected inference client: {e}", file=sys.stderr)
+                continue
+            threading.Thread(target=serve_connection, args=(conn, handlers), daemon=True).start()
+
+class InferenceTimeout(ServiceUnavailable):
+    # A 503 when it reaches Flask (app.py renders it as JSON); jobs and batch items record it as their error
+    description = "The inference server did not answer in time, retry later."
+
+class InferenceClient:
+    # One connection per calling thread; reconnects once if the server restarted
+    def __init__(self, address, timeout=REPLY_TIMEOUT):
+        self.address = address
+        self.timeout = timeout
+        self.local = threading.local()
+
+    def connection(self):
+        conn = getattr(self.local, "conn", None)
+        if conn is None:
+            conn = Client(self.address, family="AF_UNIX", authkey=require_authkey())
+            self.local.conn = conn
+        return conn
+
+    def call(self, op, modality, payload):
+        for attempt in range(2):
+            try:
+                conn = self.connection()
+                conn.send((op, modality, payload))
+                if not conn.poll(self.timeout):
+                    # The late reply would be read as the answer to this thread's next call, so the
+                    # connection goes with it; no retry, as a stuck server would only stall us twice as long
+                    self.local.conn = None
+                    conn.close()
+                    raise InferenceTimeout()
+                status, result, stats = conn.recv()
+                break
+            except (EOFError, OSError):
+                self.local.conn = None
+                if attempt:
+                    raise
+        if status != "ok":
+            raise RuntimeError(f"Inference server error: {result}")
+        queue_wait_seconds.observe(stats["queue_wait"], queue=f"inference_{op}_{modality}")
+        batch_items.observe(stats["batch_items"], modality=f"{modality}_server")
+        add_timing("queue_wait", stats["queue_wait"])
+        return result
+
+_client = None
+
+def get_client():
+    global _client
+    if _client is None:
+        _client = InferenceClient(INFERENCE_SERVER_ADDRESS)
+    return _client
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared model process for the detection API")
+    parser.add_argument("--address", default=INFERENCE_SERVER_ADDRESS or DEFAULT_ADDRESS)
+    parser.add_argument("--max-batch", type=int, default=MAX_BATCH_ITEMS)
+    parser.add_argument("--max-wait-ms", type=float, default=MAX_WAIT_MS)
+    args = parser.parse_args()
+    if len(AUTHKEY) < 16:
+        parser.error("set INFERENCE_SERVER_AUTHKEY to a shared secret of at least 16 characters")
+    serve(args.address, args.max_batch, args.max_wait_ms)
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import uuid
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, request, jsonify
+from routes import route
+from cache import result_cache, cache_key, file_digest
+from fetch import save_upload
+from artifacts import artifact_store
+from metrics import queue_wait_seconds, timed
+from fingerprint import find_near_duplicate, remember_fingerprint
+import detect_video
+import detect_audio
+
+jobs_bp = Blueprint('jobs_bp', __name__)
+
+# ---------- Settings (override via environment) ----------
+# Jobs analysed concurrently by this worker
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+# Queued + running jobs accepted before answering 429
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", "8"))
+JOB_RETRY_AFTER_SECONDS = int(os.environ.get("JOB_RETRY_AFTER_SECONDS", "30"))
+JOB_FOLDER = os.environ.get("JOB_FOLDER", "jobs")
+# --------------------------------------------------
+
+# modality -> (allowed_file, download, analyze, extension, perceptual fingerprint -> (hashes, duration))
+PIPELINES = {
+    "video": (detect_video.allowed_file, detect_video.download_video_from_url, detect_video.analyze_video, "mp4", detect_video.video_fingerprint),
+    "audio": (detect_audio.allowed_file, detect_audio.download_audio, detect_audio.analyze_audio, "wav", detect_audio.audio_fingerprint),
+}
+
+executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="job")
+active_jobs = 0
+active_lock = threading.Lock()
+
+def job_path(job_id):
+    return os.path.join(JOB_FOLDER, f"{job_id}.json")
+
+def save_job(job):
+    # Jobs live on disk so any gunicorn worker can answer GET /api/jobs/<id>
+    os.makedirs(JOB_FOLDER, exist_ok=True)
+    tmp = job_path(job["id"]) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f)
+    os.replace(tmp, job_path(job["id"]))
+
+def load_job(job_id):
+    try:
+        with open(job_path(job_id), encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def run_job(job, media_path, url):
+    global active_jobs
+    _, download, analyze, _, fingerprint = PIPELINES[job["modality"]]
+    last_saved = [0.0]
+
+    def progress(done, total):
+        job["progress"] = {"done": done, "total": total}
+        # Throttle disk writes on long inputs
+        if time.time() - last_saved[0] > 0.5:
+            last_saved[0] = time.time()
+            save_job(job)
+
+    queue_wait_seconds.observe(time.time() - job["created"], queue="jobs")
+    try:
+        job["status"] = "running"
+        save_job(job)
+        if media_path is None:
+            media_path = download(url)
+            if not media_path:
+                raise ValueError(f"Failed to download {job['modality']}.")
+        digest = file_digest(media_path)
+        key = cache_key(job["modality"], digest)
+        result = result_cache.get(key)
+        if result is None:
+            hashes, duration = fingerprint(media_path)
+            result = find_near_duplicate(job["modality"], hashes, digest, duration=duration)
+            if result is None:
+                with timed(f"job_{job['modality']}"):
+                    result = analyze(media_path, progress)
+                remember_fingerprint(job["modality"], hashes, digest)
+            elif job["modality"] == "audio":
+                detect_audio.discard_mel_spool(media_path)
+            result_cache.set(key, result)
+        job["status"] = "finished"
+        job["result"] = result
+    except Exception as e:
+        job["status"] = "failed"
+        job["error"] = str(e)
+    finally:
+        job["finished"] = time.time()
+        save_job(job)
+        # Re-indexed now, so the sweeper expires the record JOB_TTL_SECONDS after it finished
+        artifact_store.add(job_path(job["id"]), "jobs")
+        artifact_store.finish_upload(media_path)
+        with active_lock:
+            active_jobs -= 1
+
+@route(jobs_bp)
+def submit_job(modality):
+    global active_jobs
+    if modality not in PIPELINES:
+        return jsonify({"error": f"Unsupported modality: {modality}"}), 404
+    allowed_file, _, _, ext, _ = PIPELINES[modality]
+
+    # Backpressure: refuse before touching the upload so a burst cannot pile up in memory or on disk
+    with active_lock:
+        if active_jobs >= JOB_QUEUE_LIMIT:
+            response = jsonify({"error": "Too many jobs in progress, retry later."})
+            response.headers["Retry-After"] = str(JOB_RETRY_AFTER_SECONDS)
+            return response, 429
+        active_jobs += 1
+
+    try:
+        file = request.files.get('file')
+        url = request.form.get('url')
+        media_path = None
+        if file and allowed_file(file.filename):
+            media_path = artifact_store.new_path("uploads", ext)
+            save_upload(file, media_path, modality)
+        elif not url:
+            raise ValueError(f"No {modality} file or URL provided.")
+
+        job = {
+            "id": uuid.uuid4().hex,
+            "modality": modality,
+            "status": "queued",
+            "progress": {"done": 0, "total": None},
+            "result": None,
+            "error": None,
+            "created": time.time(),
+            "finished": None,
+        }
+        save_job(job)
+        # Indexed from the start, so records of jobs lost with a crashed worker expire too
+        artifact_store.add(job_path(job["id"]), "jobs")
+        # Built before submitting: once the worker has the job, it changes its status concurrently
+        body = {"job_id": job["id"], "status": job["status"], "status_url": f"/api/jobs/{job['id']}"}
+        executor.submit(run_job, job, media_path, url)
+    except Exception as e:
+        with active_lock:
+            active_jobs -= 1
+        return jsonify({"error": str(e)}), 400
+
+    return jsonify(body), 202
+
+@route(jobs_bp)
+def get_job(job_id):
+    job = load_job(job_id) if all(c in "0123456789abcdef" for c in job_id) else None
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job)
@@ -0,0 +1,264 @@
+import os
+import glob
+import json
+import time
+import atexit
+import bisect
+import threading
+from contextlib import contextmanager
+from flask import Blueprint, Response, g, has_request_context, request
+
+metrics_bp = Blueprint('metrics_bp', __name__)
+
+# Per-request stage breakdown: "header" adds X-Timing, "json" also adds a "timings" field to JSON
+# responses (or pass ?timings=1 on a single request), "off" disables both. Histograms are always kept.
+REQUEST_TIMINGS = os.environ.get("REQUEST_TIMINGS", "header")
+# Counters are per process. With METRICS_DIR set (gunicorn.conf.py sets it), every process flushes its own
+# to <METRICS_DIR>/<pid>.json every METRICS_FLUSH_SECONDS and /metrics serves the sum over all of them;
+# unset, each gunicorn worker reports only its own and has to be scraped separately.
+METRICS_DIR = os.environ.get("METRICS_DIR")
+METRICS_FLUSH_SECONDS = float(os.environ.get("METRICS_FLUSH_SECONDS", "5"))
+
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+def format_labels(labelnames, values):
+    if not labelnames:
+        return ""
+    pairs = ",".join(f'{k}="{str(v)}"' for k, v in zip(labelnames, values))
+    return "{" + pairs + "}"
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(k, "") for k in self.labelnames)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.values)
+
+    @staticmethod
+    def merge(values, other):
+        for key, value in other.items():
+            values[key] = values.get(key, 0) + value
+
+    def render(self, values):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(values.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=SECONDS_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts..., +Inf count, sum]
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(k, "") for k in self.labelnames)
+        idx = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 2)
+            series[idx] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self.lock:
+            return {key: list(series) for key, series in self.values.items()}
+
+    @staticmethod
+    def merge(values, other):
+        for key, series in other.items():
+            mine = values.get(key)
+            values[key] = list(series) if mine is None else [a + b for a, b in zip(mine, series)]
+
+    def render(self, values):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                labels = format_labels(self.labelnames + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series[-1]}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+METRICS = []
+
+def counter(name, help_text, labelnames=()):
+    metric = Counter(name, help_text, labelnames)
+    METRICS.append(metric)
+    return metric
+
+def histogram(name, help_text, labelnames=(), buckets=SECONDS_BUCKETS):
+    metric = Histogram(name, help_text, labelnames, buckets)
+    METRICS.append(metric)
+    return metric
+
+request_seconds = histogram("deepfake_request_seconds", "End-to-end request latency", ("endpoint",))
+requests_total = counter("deepfake_requests_total", "Requests served", ("endpoint", "status"))
+stage_seconds = histogram("deepfake_stage_seconds", "Time spent per pipeline stage", ("stage",))
+batch_items = histogram("deepfake_batch_size", "Inputs per model forward", ("modality",), BATCH_BUCKETS)
+queue_wait_seconds = histogram("deepfake_queue_wait_seconds", "Time queued before processing", ("queue",))
+cache_lookups = counter("deepfake_cache_lookups_total", "Result cache lookups", ("result",))
+sentence_memo_lookups = counter("deepfake_sentence_memo_total", "Sentences looked up in the text memo", ("result",))
+near_duplicate_lookups = counter("deepfake_near_duplicate_lookups_total", "Perceptual-hash lookups after a cache miss", ("modality", "result"))
+bulk_items = counter("deepfake_batch_items_total", "Items analysed by batch runs", ("modality", "status"))
+cascade_decisions = counter("deepfake_cascade_decisions_total", "Inputs decided per cascade stage", ("modality", "stage"))
+model_loads = counter("deepfake_model_loads_total", "Models loaded from disk", ("model", "backend"))
+
+_thread_timings = threading.local()
+_timings_lock = threading.Lock()
+
+def current_timings():
+    # The breakdown add_timing adds to on this thread: the request's, one handed over with timings_to, or None
+    if has_request_context() and "timings" in g:
+        return g.timings
+    return getattr(_thread_timings, "target", None)
+
+@contextmanager
+def timings_to(target):
+    # Sends this thread's stage timings to target (from current_timings() on the request thread), so
+    # stages run on pool threads still show up in the request's breakdown
+    previous = getattr(_thread_timings, "target", None)
+    _thread_timings.target = target
+    try:
+        yield
+    finally:
+        _thread_timings.target = previous
+
+def add_timing(stage, seconds):
+    # Adds to the current breakdown (no-op without one, e.g. in job threads)
+    timings = current_timings()
+    if timings is not None:
+        with _timings_lock:
+            timings[stage] = timings.get(stage, 0.0) + seconds
+
+def observe_stage(stage, seconds):
+    stage_seconds.observe(seconds, stage=stage)
+    add_timing(stage, seconds)
+
+@contextmanager
+def timed(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start)
+
+def metrics_path(pid):
+    return os.path.join(METRICS_DIR, f"{pid}.json")
+
+def flush_metrics():
+    # This process's counters -> <METRICS_DIR>/<pid>.json, replaced atomically
+    if not METRICS_DIR:
+        return
+    data = {m.name: [[list(key), value] for key, value in m.snapshot().items()] for m in METRICS}
+    tmp = metrics_path(os.getpid()) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, metrics_path(os.getpid()))
+
+def load_metrics(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return {name: {tuple(key): value for key, value in rows} for name, rows in data.items()}
+
+_flusher_pid = None
+
+def start_flusher():
+    # One flushing thread per process, started on its first request (threads don't survive a fork)
+    global _flusher_pid
+    if not METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    _flusher_pid = os.getpid()
+    os.makedirs(METRICS_DIR, exist_ok=True)
+
+    def loop():
+        while True:
+            time.sleep(METRICS_FLUSH_SECONDS)
+            try:
+                flush_metrics()
+            except Exception as e:
+                print(f"Metrics flush failed: {e}")
+
+    threading.Thread(target=loop, daemon=True, name="metrics-flush").start()
+    atexit.register(flush_metrics)
+
+def render_metrics():
+    # Live counters of this process, plus the last flush of every other one when METRICS_DIR is set.
+    # Files of exited workers are kept, so totals don't drop when gunicorn replaces a worker.
+    values = {m.name: m.snapshot() for m in METRICS}
+    if METRICS_DIR:
+        for path in glob.glob(os.path.join(METRICS_DIR, "*.json")):
+            if path == metrics_path(os.getpid()):
+                continue
+            try:
+                other = load_metrics(path)
+            except (OSError, ValueError):
+                continue
+            for m in METRICS:
+                m.merge(values[m.name], other.get(m.name, {}))
+    lines = []
+    for m in METRICS:
+        lines.extend(m.render(values[m.name]))
+    return "\n".join(lines) + "\n"
+
+@metrics_bp.before_app_request
+def start_request_timer():
+    start_flusher()
+    g.request_start = time.perf_counter()
+    g.timings = {}
+
+def observe_request(endpoint, status, seconds):
+    request_seconds.observe(seconds, endpoint=endpoint)
+    requests_total.inc(endpoint=endpoint, status=status)
+
+@metrics_bp.after_app_request
+def record_request(response):
+    if "request_start" not in g:
+        return response
+    endpoint = request.endpoint or "unknown"
+    if endpoint == "metrics_bp.metrics":
+        return response
+    start = g.request_start
+    if response.is_streamed:
+        # SSE, NDJSON and batch bodies are produced after this returns; their latency ends when the
+        # server closes the response
+        status = response.status_code
+        response.call_on_close(lambda: observe_request(endpoint, status, time.perf_counter() - start))
+        return response
+    total = time.perf_counter() - start
+    observe_request(endpoint, response.status_code, total)
+    if REQUEST_TIMINGS == "off":
+        return response
+    timings = {stage: round(seconds * 1000.0, 2) for stage, seconds in g.timings.items()}
+    timings["total"] = round(total * 1000.0, 2)
+    response.headers["X-Timing"] = ", ".join(f"{stage};dur={ms}" for stage, ms in timings.items())
+    if (REQUEST_TIMINGS == "json" or request.args.get("timings")) and response.is_json:
+        body = response.get_json(silent=True)
+        if isinstance(body, dict):
+            body["timings"] = timings
+            response.set_data(json.dumps(body))
+    return response
+
+@metrics_bp.route('/metrics', methods=['GET'])
+def metrics():
+    # Summed over all processes with METRICS_DIR, this worker's own counters otherwise
+    return Response(render_metrics(), mimetype="text/plain; version=0.0.4")
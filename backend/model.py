@@ -1,12 +1,14 @@
 import os
-import gdown
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import torch
 from torchvision import models
 from PIL import Image
 import numpy as np
-import librosa
+import cv2
 import torchvision.transforms as transforms
-from PIL import Image
+from metrics import batch_items, cascade_decisions, current_timings, model_loads, timed, timings_to
 
 # Define categories
 CATEGORIES = ["deepfake", "manual_edit", "compression", "morphing", "original"]
@@ -34,6 +36,84 @@ MODEL_PATHS = {
     "text_model_2": "models/text_model_2",
 }
 
+# Before the shared registry, image and video both loaded models/model_1.pth and model_2.pth. Deployments
+# that still have only those files keep working; rename them to the paths above to silence the notice.
+LEGACY_MODEL_PATHS = {
+    "image_model_1": "models/model_1.pth",
+    "image_model_2": "models/model_2.pth",
+    "video_model_1": "models/model_1.pth",
+    "video_model_2": "models/model_2.pth",
+}
+
+def use_legacy_path(name):
+    # Points MODEL_PATHS[name] at the pre-registry checkpoint when only that one exists
+    legacy = LEGACY_MODEL_PATHS.get(name)
+    if legacy and MODEL_PATHS[name] != legacy and not os.path.exists(MODEL_PATHS[name]) and os.path.exists(legacy):
+        print(f"{name}: {MODEL_PATHS[name]} missing, using legacy {legacy} (rename it to {MODEL_PATHS[name]})")
+        MODEL_PATHS[name] = legacy
+
+for _name in LEGACY_MODEL_PATHS:
+    use_legacy_path(_name)
+
+# ---------- Early-exit cascade (override via environment) ----------
+# A small screening model scores every input first; only inputs whose screening tampered score falls
+# inside the modality's uncertainty band go on to the full ensemble.
+# "auto" screens a modality when models/<modality>_screen.pth exists, "on" always, "off" never
+CASCADE = os.environ.get("CASCADE", "auto")
+# Architecture of the screening models (any torchvision ResNet/MobileNet, built like build_resnet_model)
+SCREEN_ARCH = os.environ.get("SCREEN_ARCH", "resnet18")
+# Per-modality band (low, high) on the screening tampered score, e.g. CASCADE_BANDS="image=0.02:0.98";
+# pick values with calibrate_cascade.py
+CASCADE_BANDS = {"image": (0.05, 0.95), "video": (0.1, 0.9), "audio": (0.1, 0.9)}
+for _item in os.environ.get("CASCADE_BANDS", "").split(","):
+    if "=" in _item:
+        _modality, _band = _item.split("=")
+        _low, _high = _band.split(":")
+        CASCADE_BANDS[_modality.strip()] = (float(_low), float(_high))
+# --------------------------------------------------
+
+SCREENS = {modality: f"{modality}_screen" for modality in CASCADE_BANDS}
+for _screen in SCREENS.values():
+    MODEL_PATHS[_screen] = f"models/{_screen}.pth"
+# Architecture per model, ResNet50 unless listed
+MODEL_ARCHS = {screen: SCREEN_ARCH for screen in SCREENS.values()}
+
+# Ensemble members used by each detection endpoint; override with e.g.
+# ENSEMBLE_IMAGE="image_model_1,image_model_2,image_model_3" (extra members load from models/<name>.pth)
+ENSEMBLES = {
+    "image": ["image_model_1", "image_model_2"],
+    "video": ["video_model_1", "video_model_2"],
+    "audio": ["audio_model_1", "audio_model_2"],
+    "text": ["text_model_1", "text_model_2"],
+}
+for _modality in ENSEMBLES:
+    _members = os.environ.get(f"ENSEMBLE_{_modality.upper()}")
+    if _members:
+        ENSEMBLES[_modality] = [m.strip() for m in _members.split(",") if m.strip()]
+        for _name in ENSEMBLES[_modality]:
+            MODEL_PATHS.setdefault(_name, f"models/{_name}" if _modality == "text" else f"models/{_name}.pth")
+
+# ---------- Ensemble execution (override via environment) ----------
+# Per-member weights, e.g. "image_model_1=2,image_model_2=1"; unlisted members weigh 1
+ENSEMBLE_WEIGHTS = {
+    name.strip(): float(weight)
+    for name, weight in (item.split("=") for item in os.environ.get("ENSEMBLE_WEIGHTS", "").split(",") if "=" in item)
+}
+# Ensemble members run concurrently on this many threads (1 = one after the other)
+ENSEMBLE_PARALLEL = int(os.environ.get("ENSEMBLE_PARALLEL", "1"))
+# Torch intra-/inter-op threads per worker; 0 = the worker's share of cores, split between parallel members
+TORCH_INTRA_THREADS = int(os.environ.get("TORCH_INTRA_THREADS", "0"))
+TORCH_INTEROP_THREADS = int(os.environ.get("TORCH_INTEROP_THREADS", "0"))
+# Pin each gunicorn worker to its own slice of the cores (see gunicorn.conf.py)
+PIN_WORKER_CPUS = os.environ.get("PIN_WORKER_CPUS", "0") == "1"
+# --------------------------------------------------
+
+# Base checkpoints the fine-tuned text models were trained from (tokenizer fallback)
+TEXT_MODEL_BASES = {
+    "text_model_1": "distilbert-base-uncased",
+    "text_model_2": "distilroberta-base",
+}
+
 def download_model(name):
     os.makedirs("models", exist_ok=True)
     path = MODEL_PATHS[name]
@@ -41,15 +121,24 @@ def download_model(name):
         # Text models are directories (HF transformers), handle differently if needed
         # Here, assumed downloaded/deployed differently
         return
-    file_id = MODEL_IDS[name]
+    use_legacy_path(name)
+    path = MODEL_PATHS[name]
+    file_id = MODEL_IDS.get(name)
     if not os.path.exists(path):
+        if file_id is None or file_id.startswith("FILE_ID"):
+            legacy = f" or {LEGACY_MODEL_PATHS[name]}" if name in LEGACY_MODEL_PATHS else ""
+            raise FileNotFoundError(f"{name}: no weights at {path}{legacy} and no download id in MODEL_IDS")
+        import gdown  # only needed the first time a checkpoint is fetched
         url = f"https://drive.google.com/uc?id={file_id}"
         gdown.download(url, path, quiet=False)
 
-# Image/Video/AUDIO model architecture loader helper (ResNet50 based)
-def build_resnet_model(num_classes=len(CATEGORIES)):
-    model = models.resnet50(pretrained=False)
-    model.fc = torch.nn.Linear(model.fc.in_features, num_classes)
+# Image/Video/AUDIO model architecture loader helper (ResNet50 based; smaller torchvision nets for screening)
+def build_resnet_model(num_classes=len(CATEGORIES), arch="resnet50"):
+    model = getattr(models, arch)(pretrained=False)
+    if hasattr(model, "fc"):
+        model.fc = torch.nn.Linear(model.fc.in_features, num_classes)
+    else:  # MobileNet/EfficientNet-style classifier head
+        model.classifier[-1] = torch.nn.Linear(model.classifier[-1].in_features, num_classes)
     return model
 
 def load_model(name):
@@ -58,12 +147,250 @@ def load_model(name):
     if name.startswith("text_model"):
         # Usually use HF transformers for text, import and load differently in text module
         raise NotImplementedError("Text model loading handled separately")
-    model = build_resnet_model()
+    model = build_resnet_model(arch=MODEL_ARCHS.get(name, "resnet50"))
     model.load_state_dict(torch.load(path, map_location="cpu"), strict=False)
     model.eval()
     return model
 
+def load_text_model(name):
+    from transformers import AutoTokenizer, AutoModelForSequenceClassification
+    path = MODEL_PATHS[name]
+    # Prefer a tokenizer saved next to the weights, fall back to the base checkpoint
+    if os.path.exists(os.path.join(path, "tokenizer_config.json")):
+        tokenizer = AutoTokenizer.from_pretrained(path)
+    else:
+        tokenizer = AutoTokenizer.from_pretrained(TEXT_MODEL_BASES[name])
+    model = AutoModelForSequenceClassification.from_pretrained(path)
+    model.eval()
+    return tokenizer, model
+
+# Content hash of each model's weights, memoized on (path, size, mtime) of its files
+_fingerprints = {}
+
+def _weight_files(path):
+    if os.path.isdir(path):
+        return sorted(os.path.join(root, f) for root, _, files in os.walk(path) for f in files)
+    return [path] if os.path.exists(path) else []
+
+def weights_fingerprint(name):
+    download_model(name)
+    files = _weight_files(MODEL_PATHS[name])
+    stamp = tuple((f, os.path.getsize(f), os.path.getmtime(f)) for f in files)
+    cached = _fingerprints.get(name)
+    if cached and cached[0] == stamp:
+        return cached[1]
+    digest = hashlib.sha256()
+    for f in files:
+        digest.update(os.path.relpath(f, MODEL_PATHS[name]).encode())
+        with open(f, "rb") as fh:
+            for chunk in iter(lambda: fh.read(1 << 20), b""):
+                digest.update(chunk)
+    _fingerprints[name] = (stamp, digest.hexdigest())
+    return digest.hexdigest()
+
+def model_version(modality):
+    # Changes whenever any ensemble member's weights change on disk, or its ENSEMBLE_WEIGHTS share
+    digest = hashlib.sha256()
+    for name, weight in zip(ENSEMBLES[modality], ensemble_weights(modality)):
+        # Quantized backends give slightly different probabilities, so they version the results too
+        digest.update(f"{name}={weights_fingerprint(name)}:{backend_for(name)}:{weight:.6g};".encode())
+    if cascade_enabled(modality):
+        # Screened inputs get the screening model's answer, so the cascade setup versions results too
+        screen = SCREENS[modality]
+        digest.update(f"{screen}={weights_fingerprint(screen)}:{backend_for(screen)}:{CASCADE_BANDS[modality]};".encode())
+    return digest.hexdigest()[:16]
+
+def warmup_model(name, model):
+    # One dummy forward so the first real request doesn't pay for lazy allocations
+    with torch.no_grad():
+        if name.startswith("text_model"):
+            tokenizer, text_model = model
+            text_model(**tokenizer("warmup", return_tensors="pt"))
+        else:
+            model(torch.zeros(1, 3, 224, 224))
+
+# ---------- Inference backends ----------
+# "eager"        fp32 PyTorch module (reference)
+# "torchscript"  traced and frozen TorchScript graph (ResNet models)
+# "dynamic_int8" int8 weights for Linear layers: the text classifiers, and the ResNet fc
+# "static_int8"  fully int8 ResNet, built by `python model.py calibrate <name> <folder>`
+BACKENDS = ("eager", "torchscript", "dynamic_int8", "static_int8")
+MODEL_BACKEND = os.environ.get("MODEL_BACKEND", "eager")
+# Per-model overrides, e.g. MODEL_BACKENDS="text_model_1=dynamic_int8,image_model_1=static_int8"
+MODEL_BACKENDS = dict(
+    item.strip().split("=", 1) for item in os.environ.get("MODEL_BACKENDS", "").split(",") if "=" in item
+)
+# Max absolute difference in any class probability versus fp32 before falling back to eager
+BACKEND_TOLERANCE = float(os.environ.get("BACKEND_TOLERANCE", "0.05"))
+VERIFY_SENTENCES = [
+    "The minister confirmed the figures at a press conference on Monday.",
+    "Scientists say the photo was digitally altered before it spread online.",
+    "Click here to read the full story.",
+    "Witnesses described hearing a loud explosion shortly after midnight.",
+]
+
+def backend_for(name):
+    return MODEL_BACKENDS.get(name, MODEL_BACKEND)
+
+def quantized_path(name):
+    return MODEL_PATHS[name] + ".int8.pt"
+
+def example_batch():
+    # Fixed input used to trace ResNets and to compare backends against fp32
+    generator = torch.Generator().manual_seed(0)
+    return torch.randn(4, 3, 224, 224, generator=generator)
+
+def build_quantizable_resnet(name):
+    from torchvision.models import quantization
+    model = getattr(quantization, MODEL_ARCHS.get(name, "resnet50"))(pretrained=False, quantize=False)
+    model.fc = torch.nn.Linear(model.fc.in_features, len(CATEGORIES))
+    model.load_state_dict(torch.load(MODEL_PATHS[name], map_location="cpu"), strict=False)
+    model.eval()
+    model.fuse_model()
+    return model
+
+def calibrate_static_int8(name, batches):
+    # Post-training static quantization; batches is an iterable of [N, 3, 224, 224] tensors
+    torch.backends.quantized.engine = "fbgemm"
+    model = build_quantizable_resnet(name)
+    model.qconfig = torch.quantization.get_default_qconfig("fbgemm")
+    torch.quantization.prepare(model, inplace=True)
+    with torch.no_grad():
+        for batch in batches:
+            model(batch)
+    torch.quantization.convert(model, inplace=True)
+    scripted = torch.jit.script(model)
+    torch.jit.save(scripted, quantized_path(name))
+    return scripted
+
+def apply_backend(name, model, backend):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend: {backend}")
+    if name.startswith("text_model"):
+        if backend != "dynamic_int8":
+            raise ValueError(f"Backend {backend} is not supported for text models")
+        tokenizer, text_model = model
+        return tokenizer, torch.quantization.quantize_dynamic(text_model, {torch.nn.Linear}, dtype=torch.qint8)
+    if backend == "torchscript":
+        with torch.no_grad():
+            traced = torch.jit.trace(model, example_batch()[:1])
+        return torch.jit.optimize_for_inference(torch.jit.freeze(traced.eval()))
+    if backend == "dynamic_int8":
+        return torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    if not os.path.exists(quantized_path(name)):
+        raise FileNotFoundError(f"{quantized_path(name)} missing, run `python model.py calibrate {name} <folder>`")
+    torch.backends.quantized.engine = "fbgemm"
+    return torch.jit.load(quantized_path(name), map_location="cpu")
+
+def backend_probs(name, model):
+    with torch.no_grad():
+        if name.startswith("text_model"):
+            tokenizer, text_model = model
+            inputs = tokenizer(VERIFY_SENTENCES, padding=True, truncation=True, return_tensors="pt")
+            return torch.softmax(text_model(**inputs).logits, dim=1).numpy()
+        return torch.softmax(model(example_batch()), dim=1).numpy()
+
+def verify_backend(name, reference, candidate):
+    # Largest per-class probability difference between the candidate backend and fp32
+    return float(np.abs(backend_probs(name, reference) - backend_probs(name, candidate)).max())
+
+# ---------- Process-wide model registry ----------
+# Each gunicorn worker loads every model at most once; all blueprints share these instances.
+_models = {}
+_reference_models = {}
+_models_lock = threading.Lock()
+
+def _load_reference(name):
+    return load_text_model(name) if name.startswith("text_model") else load_model(name)
+
+def _load_warm(name):
+    with timed("model_load"):
+        model, backend = _load_backend(name)
+    model_loads.inc(model=name, backend=backend)
+    return model
+
+def _load_backend(name):
+    # Returns (warmed model, backend actually used)
+    reference = _load_reference(name)
+    model = reference
+    backend = backend_for(name)
+    if backend != "eager":
+        try:
+            candidate = apply_backend(name, reference, backend)
+            diff = verify_backend(name, reference, candidate)
+            if diff <= BACKEND_TOLERANCE:
+                model = candidate
+            else:
+                print(f"{name}: {backend} differs from fp32 by {diff:.4f} > {BACKEND_TOLERANCE}, using eager")
+                backend = "eager"
+        except Exception as e:
+            print(f"{name}: {backend} backend unavailable ({e}), using eager")
+            backend = "eager"
+    warmup_model(name, model)
+    return model, backend
+
+def get_model(name):
+    model = _models.get(name)
+    if model is None:
+        with _models_lock:
+            model = _models.get(name)
+            if model is None:
+                model = _load_warm(name)
+                _models[name] = model
+    return model
+
+def get_reference_model(name):
+    # Eager fp32 module, e.g. for Grad-CAM which needs autograd and named layers
+    if backend_for(name) == "eager":
+        return get_model(name)
+    model = _reference_models.get(name)
+    if model is None:
+        with _models_lock:
+            model = _reference_models.get(name)
+            if model is None:
+                model = _load_reference(name)
+                _reference_models[name] = model
+    return model
+
+def get_ensemble(modality):
+    return [get_model(name) for name in ENSEMBLES[modality]]
+
+def warmup_models(modalities=None):
+    for modality in modalities or ENSEMBLES:
+        get_ensemble(modality)
+        if cascade_enabled(modality):
+            get_screen(modality)
+
+def loaded_models():
+    return sorted(_models)
+
+def reload_models(names=None):
+    # Reload from disk and swap in; requests already running keep the old instance
+    names = list(names) if names else loaded_models()
+    for name in names:
+        if name not in MODEL_PATHS:
+            raise KeyError(f"Unknown model: {name}")
+    for name in names:
+        model = _load_warm(name)
+        with _models_lock:
+            _models[name] = model
+            _reference_models.pop(name, None)
+    return names
+
 # Image/audio/video preprocessing utils
+IMAGENET_MEAN = torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1)
+IMAGENET_STD = torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1)
+
+def images_to_tensor(images):
+    # uint8 RGB batch [N, H, W, 3] -> normalized float tensor [N, 3, H, W]
+    x = torch.from_numpy(np.ascontiguousarray(images)).permute(0, 3, 1, 2).float().div_(255)
+    return (x - IMAGENET_MEAN) / IMAGENET_STD
+
+def frames_to_tensor(frames):
+    # BGR frames or crops of any size -> one normalized [N, 3, 224, 224] batch
+    batch = np.stack([cv2.resize(f, (224, 224), interpolation=cv2.INTER_AREA) for f in frames])
+    return images_to_tensor(batch[..., ::-1])
+
 def preprocess_image(path):
     img = Image.open(path).convert("RGB")
     transform = transforms.Compose([
@@ -73,26 +400,169 @@ def preprocess_image(path):
     ])
     return transform(img).unsqueeze(0)
 
-def preprocess_audio_spectrogram(path, sr=16000):
-    y, _ = librosa.load(path, sr=sr)
-    S = librosa.feature.melspectrogram(y, sr=sr, n_mels=128, fmax=8000)
-    S_dB = librosa.power_to_db(S, ref=np.max)
-    img = Image.fromarray(np.uint8(plt.cm.jet((S_dB - S_dB.min())/(S_dB.max()-S_dB.min()))*255)).convert("RGB")
-    transform = transforms.Compose([
-        transforms.Resize((224,224)),
-        transforms.ToTensor(),
-        transforms.Normalize([0.485,0.456,0.406],[0.229,0.224,0.225])
-    ])
-    return transform(img).unsqueeze(0)
+# CPU partitioning and concurrent ensemble members
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+def configure_threads(worker_index=0, workers=1):
+    # Gives this process its share of the cores (optionally pinned) and sizes torch's pools so that
+    # ENSEMBLE_PARALLEL members running at once don't oversubscribe it. Call once per process, early.
+    cpus = available_cpus()
+    share = max(1, len(cpus) // max(1, workers))
+    if PIN_WORKER_CPUS and workers > 1 and hasattr(os, "sched_setaffinity"):
+        start = (worker_index % workers) * share
+        cpus = cpus[start:start + share] or cpus
+        os.sched_setaffinity(0, cpus)
+    torch.set_num_threads(TORCH_INTRA_THREADS or max(1, share // max(1, ENSEMBLE_PARALLEL)))
+    if TORCH_INTEROP_THREADS:
+        try:
+            torch.set_num_interop_threads(TORCH_INTEROP_THREADS)
+        except RuntimeError:
+            pass  # only settable before the first inter-op parallel work in this process
+    return {
+        "cpus": cpus,
+        "intra_op_threads": torch.get_num_threads(),
+        "interop_threads": torch.get_num_interop_threads(),
+        "ensemble_parallel": ENSEMBLE_PARALLEL,
+    }
+
+_ensemble_pool = None
+_ensemble_pool_pid = None
+
+def ensemble_map(fn, members):
+    # [fn(member) for member in members], on a shared thread pool when ENSEMBLE_PARALLEL > 1
+    global _ensemble_pool, _ensemble_pool_pid
+    if ENSEMBLE_PARALLEL < 2 or len(members) < 2:
+        return [fn(member) for member in members]
+    if _ensemble_pool is None or _ensemble_pool_pid != os.getpid():
+        _ensemble_pool = ThreadPoolExecutor(ENSEMBLE_PARALLEL, thread_name_prefix="ensemble")
+        _ensemble_pool_pid = os.getpid()
+    # Pool threads have no request context; their stage timings go to the caller's breakdown
+    timings = current_timings()
+
+    def run(member):
+        with timings_to(timings):
+            return fn(member)
+    return list(_ensemble_pool.map(run, members))
+
+def ensemble_weights(modality):
+    # Normalized member weights, in ENSEMBLES order
+    weights = np.array([ENSEMBLE_WEIGHTS.get(name, 1.0) for name in ENSEMBLES[modality]], dtype=np.float32)
+    return weights / weights.sum()
+
+def combine_probs(member_probs, weights=None):
+    # Weighted (default: plain) mean of the members' [N, C] probabilities
+    if weights is None:
+        return sum(member_probs) / len(member_probs)
+    return sum(w * p for w, p in zip(weights, member_probs))
 
 # Ensemble prediction utilities per modality
-def ensemble_predict_image(models, img_tensor):
-    probs_sum = None
-    for model in models:
+def ensemble_predict_image(models, img_tensor, weights=None):
+    return ensemble_predict_batch(models, img_tensor, weights=weights)[0]
+
+def ensemble_predict_batch(models, batch_tensor, batch_size=32, weights=None):
+    # Weighted mean softmax over the ensemble for every row of batch_tensor, in fixed-size chunks -> [N, C]
+    def member_probs(model):
+        probs = np.empty((batch_tensor.shape[0], len(CATEGORIES)), dtype=np.float32)
         with torch.no_grad():
-            p = torch.softmax(model(img_tensor), dim=1).cpu().numpy()
-        probs_sum = p if probs_sum is None else probs_sum + p
-    return (probs_sum / len(models))[0]
+            for start in range(0, batch_tensor.shape[0], batch_size):
+                chunk = batch_tensor[start:start + batch_size]
+                probs[start:start + len(chunk)] = torch.softmax(model(chunk), dim=1).cpu().numpy()
+        return probs
+    return combine_probs(ensemble_map(member_probs, models), weights)
+
+# Modalities whose screening model failed to load; they run on the ensemble alone until restart
+_failed_screens = set()
+
+def cascade_enabled(modality):
+    if modality not in SCREENS or CASCADE == "off" or modality in _failed_screens:
+        return False
+    return CASCADE == "on" or os.path.exists(MODEL_PATHS[SCREENS[modality]])
+
+def get_screen(modality):
+    # The modality's screening model, or None (cascade switched off) when its checkpoint can't be loaded,
+    # e.g. weights of another architecture than SCREEN_ARCH
+    try:
+        return get_model(SCREENS[modality])
+    except Exception as e:
+        reason = str(e).strip().splitlines()[0] if str(e).strip() else type(e).__name__
+        print(f"{SCREENS[modality]}: cannot load ({reason}), {modality} falls back to the ensemble")
+        _failed_screens.add(modality)
+        return None
+
+def uncertain_rows(modality, screen_probs, band=None):
+    # Rows whose screening tampered score is inside the band (default: the modality's) -> bool [N]
+    low, high = band or CASCADE_BANDS[modality]
+    tampered = 1 - screen_probs[:, CATEGORIES.index("original")]
+    return (tampered > low) & (tampered < high)
+
+def stage_names(screened):
+    return ["screen" if s else "ensemble" for s in screened]
+
+def cascade_predict_batch(modality, batch_tensor, batch_size=32):
+    # -> (probs [N, C], screened bool [N]): the screening model's answer where it is confident,
+    # the weighted ensemble's for the rest (and for everything when the modality has no cascade)
+    probs, screened = None, np.zeros(batch_tensor.shape[0], dtype=bool)
+    screen = get_screen(modality) if cascade_enabled(modality) else None
+    if screen is not None:
+        with timed("screen"):
+            probs = ensemble_predict_batch([screen], batch_tensor, batch_size)
+        screened = ~uncertain_rows(modality, probs)
+    if probs is None or not screened.all():
+        rest = np.nonzero(~screened)[0]
+        inputs = batch_tensor if probs is None else batch_tensor[torch.from_numpy(rest)]
+        with timed("forward"):
+            full = ensemble_predict_batch(get_ensemble(modality), inputs, batch_size, ensemble_weights(modality))
+        if probs is None:
+            probs = full
+        else:
+            probs[rest] = full
+    cascade_decisions.inc(int(screened.sum()), modality=modality, stage="screen")
+    cascade_decisions.inc(int((~screened).sum()), modality=modality, stage="ensemble")
+    return probs, screened
+
+class SpanTracker:
+    # Incrementally groups consecutive suspicious samples (any non-original class > threshold) into spans
+    def __init__(self, threshold=0.5):
+        self.threshold = threshold
+        self.spans = []
+        self.open = False
+
+    def update(self, timestamp, probs, end=None):
+        # Returns the index of the span this sample opened or extended, else None.
+        # end is where the sample stops covering, for samples that stand for an interval
+        end = timestamp if end is None else end
+        if 1 - probs[CATEGORIES.index("original")] > self.threshold:
+            if self.open:
+                self.spans[-1]["end"] = end
+            else:
+                self.spans.append({"start": timestamp, "end": end})
+                self.open = True
+            return len(self.spans) - 1
+        self.open = False
+        return None
+
+# Optional shared inference process (see inference_server.py); when set, workers never load ensembles
+INFERENCE_SERVER_ADDRESS = os.environ.get("INFERENCE_SERVER_ADDRESS")
+
+def remote_call(op, modality, payload):
+    from inference_server import get_client
+    return get_client().call(op, modality, payload)
+
+def predict_modality(modality, batch_tensor, batch_size=32, stages=None):
+    # Probabilities [N, C] for one modality through the cascade, local or from the inference server.
+    # If a list is given as stages, the stage that decided each row ("screen"/"ensemble") is appended to it.
+    batch_items.observe(batch_tensor.shape[0], modality=modality)
+    if INFERENCE_SERVER_ADDRESS:
+        with timed("forward"):
+            probs, screened = remote_call("predict", modality, batch_tensor.numpy())
+    else:
+        probs, screened = cascade_predict_batch(modality, batch_tensor, batch_size)
+    if stages is not None:
+        stages.extend(stage_names(screened))
+    return probs
 
 def ensemble_predict_audio(models, audio_tensor):
     # Similar to image, assuming preprocessed
@@ -102,3 +572,43 @@ def ensemble_predict_video(models, video_tensor):
     # Similar structure
     return ensemble_predict_image(models, video_tensor)
 
+
+def calibration_batches(name, folder, limit=256, batch_size=16):
+    # Preprocessed batches from a folder of sample inputs (images, or audio files for audio models)
+    files = sorted(os.path.join(folder, f) for f in os.listdir(folder))[:limit]
+    if name.startswith("audio_"):
+        from detect_audio import SAMPLE_RATE, audio_to_spec, iter_audio_blocks, preprocess_spec
+        for f in files:
+            y = np.concatenate(list(iter_audio_blocks(f, SAMPLE_RATE)))
+            yield preprocess_spec(audio_to_spec(y, SAMPLE_RATE)[:batch_size])
+    else:
+        for start in range(0, len(files), batch_size):
+            yield torch.cat([preprocess_image(f) for f in files[start:start + batch_size]])
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Model backend utilities")
+    commands = parser.add_subparsers(dest="command", required=True)
+    calibrate = commands.add_parser("calibrate", help="Build the static_int8 backend of a ResNet model")
+    calibrate.add_argument("name", choices=[n for n in MODEL_PATHS if not n.startswith("text_model")])
+    calibrate.add_argument("folder", help="Representative inputs used to calibrate activation ranges")
+    calibrate.add_argument("--limit", type=int, default=256)
+    verify = commands.add_parser("verify", help="Compare a backend with the fp32 model")
+    verify.add_argument("name", choices=sorted(MODEL_PATHS))
+    verify.add_argument("backend", choices=BACKENDS)
+    args = parser.parse_args()
+
+    if args.command == "calibrate":
+        download_model(args.name)
+        quantized = calibrate_static_int8(args.name, calibration_batches(args.name, args.folder, args.limit))
+        reference = load_model(args.name)
+        diff = 0.0
+        with torch.no_grad():
+            for batch in calibration_batches(args.name, args.folder, args.limit):
+                diff = max(diff, float((torch.softmax(reference(batch), 1) - torch.softmax(quantized(batch), 1)).abs().max()))
+        print(f"Saved {quantized_path(args.name)}; max probability difference on calibration set: {diff:.4f}")
+    else:
+        reference = _load_reference(args.name)
+        diff = verify_backend(args.name, reference, apply_backend(args.name, reference, args.backend))
+        status = "OK" if diff <= BACKEND_TOLERANCE else "FAIL"
+        print(f"{args.name} {args.backend}: max probability difference {diff:.4f} ({status}, tolerance {BACKEND_TOLERANCE})")
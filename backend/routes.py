@@ -0,0 +1,73 @@
+from startup import LazyView
+
+# The one list of /api routes. Each blueprint registers its views from it with @route(bp), and with
+# LAZY_IMPORTS=1 app.py registers LazyViews from it under the same endpoint names, so metrics labels
+# and url_for are identical in both modes and a route can't exist in one mode only.
+
+# Blueprint module -> blueprint object name
+BLUEPRINTS = {
+    "detect_image": "detect_image_bp",
+    "detect_video": "detect_video_bp",
+    "detect_audio": "detect_audio_bp",
+    "detect_text": "detect_text_bp",
+    "jobs": "jobs_bp",
+    "batch": "batch_bp",
+    "admin": "admin_bp",
+}
+
+# (rule, "module.view", methods, upload), rules relative to the /api prefix. upload is the modality whose
+# size limit (fetch.FETCH_LIMITS) caps the request body, "<modality>" for the one in the URL, or None
+# for the app-wide MAX_CONTENT_LENGTH.
+ROUTES = [
+    ("/detect-image", "detect_image.detect_image", ["POST"], "image"),
+    ("/detect-video", "detect_video.detect_video", ["POST"], "video"),
+    ("/detect-video/stream", "detect_video.detect_video_stream", ["POST"], "video"),
+    ("/detect-audio", "detect_audio.detect_audio", ["POST"], "audio"),
+    ("/detect-audio/stream", "detect_audio.detect_audio_stream", ["POST"], "audio"),
+    ("/detect-text", "detect_text.detect_text", ["POST"], "text"),
+    ("/jobs/<modality>", "jobs.submit_job", ["POST"], "<modality>"),
+    ("/jobs/<job_id>", "jobs.get_job", ["GET"], None),
+    ("/batch", "batch.batch", ["POST"], None),
+    ("/admin/models", "admin.list_models", ["GET"], None),
+    ("/admin/reload-models", "admin.reload_weights", ["POST"], None),
+    ("/admin/cache", "admin.cache_stats", ["GET"], None),
+    ("/admin/artifacts", "admin.artifact_stats", ["GET"], None),
+    ("/admin/artifacts/sweep", "admin.sweep_artifacts", ["POST"], None),
+    ("/admin/startup", "admin.startup_info", ["GET"], None),
+]
+UPLOADS = {import_name: upload for _, import_name, _, upload in ROUTES if upload}
+
+def endpoint_for(import_name):
+    module, view = import_name.split(".")
+    return f"{BLUEPRINTS[module]}.{view}"
+
+def route(blueprint):
+    # Decorator registering a view on its blueprint with the rule(s) ROUTES lists for it
+    def register(view):
+        # Module from the blueprint's name, as view.__module__ is "__main__" when a module runs as a script
+        module = next(m for m, name in BLUEPRINTS.items() if name == blueprint.name)
+        import_name = f"{module}.{view.__name__}"
+        entries = [(rule, methods) for rule, name, methods, _ in ROUTES if name == import_name]
+        if not entries:
+            raise LookupError(f"{import_name} is not listed in routes.ROUTES")
+        for rule, methods in entries:
+            blueprint.add_url_rule(rule, view_func=view, methods=methods)
+        return view
+    return register
+
+def register_lazy_routes(app, prefix="/api"):
+    for rule, import_name, methods, _ in ROUTES:
+        app.add_url_rule(prefix + rule, endpoint=endpoint_for(import_name),
+                         view_func=LazyView(import_name), methods=methods)
+
+def missing_routes(app):
+    # ROUTES entries the app doesn't serve, e.g. a view renamed without updating the table
+    endpoints = set(app.view_functions)
+    return [import_name for _, import_name, _, _ in ROUTES if endpoint_for(import_name) not in endpoints]
+
+def upload_modality(endpoint, view_args):
+    # Modality whose upload limit applies to a request for endpoint, or None
+    for import_name, upload in UPLOADS.items():
+        if endpoint_for(import_name) == endpoint:
+            return (view_args or {}).get("modality") if upload == "<modality>" else upload
+    return None
@@ -0,0 +1,159 @@
+import os
+import math
+import cv2
+import numpy as np
+from model import CATEGORIES
+
+# Adaptive video sampling. Candidates are the old fixed grid (2 frames per second). Every stride-th
+# candidate is an anchor and is always scored. Between two scored samples, more candidates are scored
+# by bisection only where something happens: a scene cut, scores that disagree, or scores that sit
+# near the suspicious threshold. Static footage therefore costs about 1/stride of the forwards.
+
+# ---------- Settings (override via environment) ----------
+# "adaptive" refines a coarse grid, "fixed" scores every candidate
+VIDEO_SAMPLING = os.environ.get("VIDEO_SAMPLING", "adaptive")
+# Candidates between anchors
+VIDEO_COARSE_STRIDE = int(os.environ.get("VIDEO_COARSE_STRIDE", "8"))
+# Frames scored per video at most; the anchor stride widens so anchors use at most half of it
+VIDEO_MAX_FORWARDS = int(os.environ.get("VIDEO_MAX_FORWARDS", "1000"))
+# Candidates (kept at 224x224) held in memory while their group is refined
+VIDEO_SAMPLING_GROUP = int(os.environ.get("VIDEO_SAMPLING_GROUP", "256"))
+# Refine between two samples whose tampered scores differ by more than this...
+VIDEO_REFINE_SCORE_DELTA = float(os.environ.get("VIDEO_REFINE_SCORE_DELTA", "0.2"))
+# ...or when either is this close to the threshold
+VIDEO_REFINE_BAND = float(os.environ.get("VIDEO_REFINE_BAND", "0.15"))
+# Histogram/pixel change between consecutive candidates treated as a scene cut
+VIDEO_SCENE_DELTA = float(os.environ.get("VIDEO_SCENE_DELTA", "0.35"))
+# --------------------------------------------------
+
+class Candidate:
+    __slots__ = ("frame_idx", "timestamp", "frame", "delta", "faces", "crops")
+
+    def __init__(self, frame_idx, timestamp, frame, delta, faces=(), crops=()):
+        self.frame_idx = frame_idx
+        self.timestamp = timestamp  # seconds, from the decoder
+        self.frame = frame      # BGR, already resized for scoring
+        self.delta = delta      # change from the previous candidate, 0..1
+        self.faces = faces      # [(face_id, box)] when faces are tracked
+        self.crops = crops      # matching face crops, resized for scoring
+
+def thumbnail(frame):
+    # Tiny grey copy and its normalized histogram, for cheap change detection
+    gray = cv2.cvtColor(cv2.resize(frame, (64, 36), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    hist = cv2.calcHist([gray], [0], None, [32], [0, 256]).ravel()
+    return gray, hist / max(hist.sum(), 1.0)
+
+def frame_change(prev, cur):
+    # Larger of the histogram distance (cuts) and mean pixel difference (fast motion), 0..1
+    if prev is None:
+        return 0.0
+    hist_delta = 0.5 * float(np.abs(prev[1] - cur[1]).sum())
+    pixel_delta = float(np.abs(prev[0].astype(np.int16) - cur[0]).mean()) / 255.0
+    return max(hist_delta, pixel_delta)
+
+def sampling_plan(total_candidates, max_forwards=None, mode=VIDEO_SAMPLING):
+    # -> (stride, forward budget) for one video
+    if mode == "fixed":
+        return 1, math.inf
+    budget = max_forwards or VIDEO_MAX_FORWARDS
+    return max(VIDEO_COARSE_STRIDE, math.ceil(2 * total_candidates / max(budget, 1))), budget
+
+class TimeWeightedMean:
+    # Mean probabilities with each sample weighted by the time since the previous one, so densely
+    # refined stretches don't outweigh the rest of the video
+    def __init__(self, first_weight=0.5):
+        self.first_weight = first_weight
+        self.total = 0.0
+        self.sum = None
+        self.last = None
+
+    def update(self, timestamp, probs):
+        weight = self.first_weight if self.last is None else max(timestamp - self.last, 1e-6)
+        self.last = timestamp
+        self.sum = probs * weight if self.sum is None else self.sum + probs * weight
+        self.total += weight
+
+    def value(self):
+        return self.sum / self.total
+
+class AdaptiveSampler:
+    # run(group) scores part of a group of consecutive candidates and returns [(candidate, probs)] in time order.
+    # The last candidate of each group is carried over as the first anchor of the next one.
+    # Never scores more than budget candidates; with total (expected candidates, 0 if unknown) refinement
+    # leaves enough of the budget for the anchors of the groups still to come.
+    def __init__(self, score, stride, budget, threshold=0.5, total=0):
+        self.score = score  # [candidates] -> probs [N, C]
+        self.stride = max(1, stride)
+        self.budget = budget
+        self.threshold = threshold
+        self.total = total
+        self.seen = 0
+        self.forwards = 0
+        self.carry = None
+
+    @property
+    def exhausted(self):
+        return self.forwards >= self.budget
+
+    def tampered(self, probs):
+        return 1 - probs[CATEGORIES.index("original")]
+
+    def score_positions(self, items, scored, positions):
+        if not positions:
+            return
+        probs = self.score([items[p] for p in positions])
+        self.forwards += len(positions)
+        for p, pr in zip(positions, probs):
+            scored[p] = pr
+
+    def split_point(self, items, scored, a, b):
+        # Candidate to score between scored positions a and b, or None if the interval is settled
+        if b - a < 2:
+            return None
+        cut = max(range(a + 1, b), key=lambda p: items[p].delta)
+        if items[cut].delta >= VIDEO_SCENE_DELTA:
+            return cut  # first frame of the new scene
+        ta, tb = self.tampered(scored[a]), self.tampered(scored[b])
+        near = min(abs(ta - self.threshold), abs(tb - self.threshold)) < VIDEO_REFINE_BAND
+        if abs(ta - tb) > VIDEO_REFINE_SCORE_DELTA or (ta > self.threshold) != (tb > self.threshold) or near:
+            return (a + b) // 2
+        return None
+
+    def run(self, group):
+        carried = self.carry is not None
+        self.seen += len(group)
+        remaining = max(0, self.total - self.seen)
+        # Anchors every stride candidates, plus each later group's closing one
+        reserve = math.ceil(remaining / self.stride) + math.ceil(remaining / max(len(group), 1))
+        items = ([self.carry[0]] if carried else []) + list(group)
+        scored = {0: self.carry[1]} if carried else {}
+        last = len(items) - 1
+        anchors = sorted(set(range(0, last + 1, self.stride)) | {last})
+        # Anchors count against the budget too: when the length is unknown the stride can't be widened to fit
+        todo = [p for p in anchors if p not in scored]
+        if self.budget != math.inf:
+            todo = todo[:max(0, int(self.budget - self.forwards))]
+        self.score_positions(items, scored, todo)
+        anchors = [p for p in anchors if p in scored]
+        if not scored:
+            return []
+
+        # Refine level by level, so each level's picks across the whole group share one forward
+        intervals = list(zip(anchors, anchors[1:]))
+        while intervals and self.forwards + reserve < self.budget:
+            splits = []
+            for a, b in intervals:
+                m = self.split_point(items, scored, a, b)
+                if m is not None:
+                    splits.append((a, m, b))
+            if self.budget != math.inf:
+                splits = splits[:int(self.budget - self.forwards - reserve)]
+            if not splits:
+                break
+            self.score_positions(items, scored, [m for _, m, _ in splits])
+            intervals = [iv for a, m, b in splits for iv in ((a, m), (m, b))]
+
+        # Normally the group's last candidate; an earlier one only once the budget is spent
+        end = max(scored)
+        self.carry = (items[end], scored[end])
+        return [(items[p], scored[p]) for p in sorted(scored) if p > 0 or not carried]
@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+import argparse
+import importlib
+import subprocess
+import threading
+
+# Import-time bookkeeping for app.py, plus a per-package startup report:
+#
+#     python startup.py            # what `import app` costs, heaviest packages first
+#     python startup.py --lazy     # the same with LAZY_IMPORTS=1
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# App module -> seconds its first import took in this process (including what it pulled in first)
+IMPORT_SECONDS = {}
+_lock = threading.Lock()
+
+def timed_import(name):
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    elapsed = time.perf_counter() - start
+    with _lock:
+        IMPORT_SECONDS.setdefault(name, elapsed)
+    return module
+
+class LazyView:
+    # Flask's lazily-loaded view pattern: "module.function" is imported on the first request it serves
+    def __init__(self, import_name):
+        self.import_name = import_name
+        self.__name__ = import_name.rsplit(".", 1)[1]
+        self.view = None
+
+    def __call__(self, *args, **kwargs):
+        if self.view is None:
+            module, name = self.import_name.rsplit(".", 1)
+            self.view = getattr(timed_import(module), name)
+        return self.view(*args, **kwargs)
+
+def parse_importtime(stderr):
+    # `python -X importtime` lines -> {top-level package: [self seconds, cumulative seconds]}
+    packages = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        entry = packages.setdefault(package, [0.0, 0.0])
+        entry[0] += int(self_us) / 1e6
+        if name.strip() == package:
+            entry[1] = max(entry[1], int(cumulative_us) / 1e6)
+    return packages
+
+def import_report(target="app", lazy=False):
+    # Imports target in a fresh interpreter -> (wall seconds, [(package, self s, cumulative s)] heaviest first)
+    env = dict(os.environ, LAZY_IMPORTS="1" if lazy else "0")
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {target}"],
+                            cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    packages = parse_importtime(result.stderr)
+    rows = sorted(((name, s, c) for name, (s, c) in packages.items()), key=lambda r: r[1], reverse=True)
+    return wall, rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-package import cost of the API")
+    parser.add_argument("--target", default="app")
+    parser.add_argument("--lazy", action="store_true", help="Measure with LAZY_IMPORTS=1")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+    wall, rows = import_report(args.target, args.lazy)
+    print(f"import {args.target}: {wall:.2f}s wall ({'lazy' if args.lazy else 'eager'} imports)")
+    print(f"{'package':<28}{'self s':>10}{'cumulative s':>14}")
+    for name, self_s, cumulative_s in rows[:args.top]:
+        print(f"{name:<28}{self_s:>10.3f}{cumulative_s:>14.3f}")
@@ -0,0 +1,30 @@
+import json
+from flask import Response, request, stream_with_context
+
+def format_event(event, data, fmt):
+    if fmt == "ndjson":
+        return json.dumps({"event": event, **data}) + "\n"
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def stream_response(events, on_close=None):
+    # events yields (event_name, dict); sent as Server-Sent Events, or NDJSON with ?format=ndjson.
+    # on_close runs once the stream ends or the client disconnects, also when the body is never iterated.
+    fmt = request.args.get("format", "sse")
+    mimetype = "application/x-ndjson" if fmt == "ndjson" else "text/event-stream"
+
+    def generate():
+        try:
+            for event, data in events:
+                yield format_event(event, data, fmt)
+        except Exception as e:
+            yield format_event("error", {"error": str(e)}, fmt)
+
+    response = Response(stream_with_context(generate()), mimetype=mimetype)
+    if on_close:
+        # Called from the WSGI server's close(), unlike a finally in generate(), which never runs if the
+        # client leaves before the first chunk
+        response.call_on_close(on_close)
+    response.headers["Cache-Control"] = "no-cache"
+    # Stop reverse proxies from buffering the stream
+    response.headers["X-Accel-Buffering"] = "no"
+    return response
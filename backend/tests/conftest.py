@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Tests import the backend modules the way app.py does, from the backend folder, and keep the on-disk
+# caches and indexes those modules create at import time out of the working tree
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+
+_scratch = tempfile.mkdtemp(prefix="backend-tests-")
+os.environ.setdefault("RESULT_CACHE_PATH", os.path.join(_scratch, "results"))
+os.environ.setdefault("ARTIFACT_INDEX", os.path.join(_scratch, "artifacts.sqlite3"))
+os.environ.setdefault("NEAR_DUPLICATE_PATH", os.path.join(_scratch, "fingerprints"))
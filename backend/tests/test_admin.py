@@ -0,0 +1,22 @@
+import pytest
+from flask import Flask
+import admin
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", "s3cret-token")
+    app = Flask(__name__)
+    app.register_blueprint(admin.admin_bp, url_prefix="/api")
+    return app.test_client()
+
+@pytest.mark.parametrize("headers", [{}, {"X-Admin-Token": ""}, {"X-Admin-Token": "s3cret"},
+                                     {"X-Admin-Token": "s3cret-token-2"}, {"X-Admin-Token": "s3crét-token"}])
+def test_wrong_or_missing_token_is_refused(client, headers):
+    assert client.get("/api/admin/startup", headers=headers).status_code == 403
+
+def test_token_grants_access(client):
+    assert client.get("/api/admin/startup", headers={"X-Admin-Token": "s3cret-token"}).status_code == 200
+
+def test_routes_stay_disabled_without_a_token(client, monkeypatch):
+    monkeypatch.setattr(admin, "ADMIN_TOKEN", None)
+    assert client.get("/api/admin/startup", headers={"X-Admin-Token": ""}).status_code == 403
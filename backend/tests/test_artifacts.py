@@ -0,0 +1,52 @@
+import os
+import time
+import pytest
+from artifacts import ArtifactStore, to_path, to_url
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # URLs are relative to the app's working directory
+    return ArtifactStore("static", "index.sqlite3", {"uploads": 100, "results": 1000, "jobs": 1000}, 10000, 3600)
+
+def write(store, kind, size, age=0):
+    path = store.new_path(kind, "bin")
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    url = store.add(path, kind)
+    with store.lock:
+        store.conn.execute("UPDATE artifacts SET created = ? WHERE path = ?", (time.time() - age, path))
+        store.conn.commit()
+    return path, url
+
+def test_urls_round_trip(store):
+    path, url = write(store, "results", 10)
+    assert url.startswith("/static/results/")
+    assert to_path(url) == path and to_url(path) == url
+    assert store.exists(url)
+
+def test_sweep_applies_each_kind_ttl(store):
+    old_upload, _ = write(store, "uploads", 10, age=200)
+    new_upload, _ = write(store, "uploads", 10, age=50)
+    old_result, _ = write(store, "results", 10, age=200)
+    assert store.sweep() == 1
+    assert not os.path.exists(old_upload)
+    assert os.path.exists(new_upload) and os.path.exists(old_result)
+    assert store.stats() == {"uploads": {"files": 1, "bytes": 10}, "results": {"files": 1, "bytes": 10}}
+
+def test_sweep_enforces_the_quota_oldest_first(store):
+    paths = [write(store, "results", 3000, age=age)[0] for age in (50, 40, 30, 20, 10)]
+    assert store.sweep() == 2
+    assert [os.path.exists(p) for p in paths] == [False, False, True, True, True]
+
+def test_adding_again_restarts_the_ttl(store):
+    path, _ = write(store, "jobs", 10, age=2000)
+    store.add(path, "jobs")
+    assert store.sweep() == 0
+    assert os.path.exists(path)
+
+def test_discard_removes_file_and_index_entry(store):
+    path, url = write(store, "uploads", 10)
+    store.discard(path)
+    assert not store.exists(url)
+    assert store.stats() == {}
+    store.discard(path)  # already gone
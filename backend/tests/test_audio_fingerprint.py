@@ -0,0 +1,64 @@
+import os
+import numpy as np
+import pytest
+import soundfile as sf
+import detect_audio
+from artifacts import ArtifactStore
+from detect_audio import SAMPLE_RATE, audio_fingerprint, iter_audio_batches, mel_spool_path
+
+@pytest.fixture
+def clip(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = ArtifactStore("static", "index.sqlite3", {"uploads": 3600}, 1 << 30, 3600)
+    monkeypatch.setattr(detect_audio, "artifact_store", store)
+    monkeypatch.setattr(detect_audio, "NEAR_DUPLICATES", True)
+    # Deterministic stand-in for the models: probabilities from each window's mean level
+    def predict(modality, x, batch_size, stages):
+        level = x.mean(dim=(1, 2, 3)).numpy()
+        probs = np.stack([level, 1 - level, np.zeros_like(level), np.zeros_like(level), np.ones_like(level)], axis=1)
+        stages.extend(["ensemble"] * len(x))
+        return probs / probs.sum(axis=1, keepdims=True)
+    monkeypatch.setattr(detect_audio, "predict_modality", predict)
+    rng = np.random.default_rng(0)
+    t = np.arange(int(23.3 * SAMPLE_RATE)) / SAMPLE_RATE
+    y = 0.3 * np.sin(2 * np.pi * (200 + 20 * t) * t) + 0.05 * rng.standard_normal(len(t))
+    path = str(tmp_path / "clip.wav")
+    sf.write(path, y.astype(np.float32), SAMPLE_RATE)
+    return path
+
+def decode_counter(monkeypatch):
+    calls = []
+    original = detect_audio.iter_audio_blocks
+
+    def counting(path, *args, **kwargs):
+        calls.append(path)
+        return original(path, *args, **kwargs)
+    monkeypatch.setattr(detect_audio, "iter_audio_blocks", counting)
+    return calls
+
+def slots(path):
+    return [slot for batch in iter_audio_batches(path) for slot in batch]
+
+def test_fingerprint_covers_the_whole_clip(clip):
+    hashes, duration = audio_fingerprint(clip)
+    assert duration == pytest.approx(23.3, abs=1e-3)
+    assert len(hashes) == 3  # two full segments and the tail
+    assert audio_fingerprint(clip)[0] == hashes
+
+def test_analysis_replays_the_fingerprint_decode(clip, monkeypatch):
+    reference = slots(clip)
+    calls = decode_counter(monkeypatch)
+    audio_fingerprint(clip)
+    assert os.path.exists(mel_spool_path(clip))
+    replayed = slots(clip)
+    assert len(calls) == 1
+    assert not os.path.exists(mel_spool_path(clip))
+    assert [(a, b) for a, b, _ in replayed] == [(a, b) for a, b, _ in reference]
+    np.testing.assert_allclose([p for _, _, p in replayed], [p for _, _, p in reference], rtol=1e-6)
+
+def test_spool_of_a_changed_file_is_ignored(clip, monkeypatch):
+    audio_fingerprint(clip)
+    sf.write(clip, np.zeros(SAMPLE_RATE * 3, dtype=np.float32), SAMPLE_RATE)
+    calls = decode_counter(monkeypatch)
+    assert slots(clip)[-1][1] == pytest.approx(3.0)
+    assert len(calls) == 1
@@ -0,0 +1,86 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from cache import DirectoryTier, MemoryTier, ResultCache, SQLiteTier
+
+def test_memory_tier_evicts_least_recently_used():
+    tier = MemoryTier(max_items=2, ttl=60)
+    tier.set("a", 1)
+    tier.set("b", 2)
+    assert tier.get("a") == 1  # "b" is now the oldest
+    tier.set("c", 3)
+    assert tier.get("b") is None
+    assert tier.get("a") == 1
+    assert tier.get("c") == 3
+
+def test_memory_tier_expires_entries():
+    tier = MemoryTier(max_items=4, ttl=-1)
+    tier.set("a", 1)
+    assert tier.get("a") is None
+    assert "a" not in tier.items
+
+def test_sqlite_tier_round_trip(tmp_path):
+    tier = SQLiteTier(str(tmp_path / "results.sqlite3"), ttl=60, max_bytes=1 << 20)
+    tier.set("k", {"probabilities": [0.1, 0.9]})
+    assert tier.get("k") == {"probabilities": [0.1, 0.9]}
+    assert tier.get("missing") is None
+
+def test_sqlite_tier_expires_entries(tmp_path):
+    tier = SQLiteTier(str(tmp_path / "results.sqlite3"), ttl=-1, max_bytes=1 << 20)
+    tier.set("k", {"v": 1})
+    assert tier.get("k") is None
+
+def test_sqlite_tier_evicts_least_recently_used_over_quota(tmp_path):
+    value = {"v": "x" * 100}
+    tier = SQLiteTier(str(tmp_path / "results.sqlite3"), ttl=60, max_bytes=250)
+    tier.set("a", value)
+    tier.set("b", value)
+    tier.get("a")
+    tier.set("c", value)
+    assert tier.get("b") is None
+    assert tier.get("a") == value
+    assert tier.get("c") == value
+
+def test_directory_tier_round_trip_and_expiry(tmp_path):
+    tier = DirectoryTier(str(tmp_path / "results"), ttl=60, max_bytes=1 << 20)
+    tier.set("k", {"v": 1})
+    assert tier.get("k") == {"v": 1}
+    expired = DirectoryTier(str(tmp_path / "results"), ttl=-1, max_bytes=1 << 20)
+    assert expired.get("k") is None
+    assert tier.get("k") is None  # the expired file was removed
+
+def test_result_cache_promotes_disk_hits(tmp_path):
+    disk = SQLiteTier(str(tmp_path / "results.sqlite3"), ttl=60, max_bytes=1 << 20)
+    disk.set("k", {"v": 1})
+    cache = ResultCache(MemoryTier(8, 60), disk)
+    assert cache.get("k") == {"v": 1}
+    assert (cache.hits, cache.disk_hits, cache.misses) == (1, 1, 0)
+    assert cache.memory.get("k") == {"v": 1}
+    assert cache.get("k") == {"v": 1}
+    assert (cache.hits, cache.disk_hits) == (2, 1)
+
+def test_result_cache_counts_misses():
+    cache = ResultCache(MemoryTier(8, 60))
+    assert cache.get("k") is None
+    cache.set("k", {"v": 1})
+    assert cache.get("k") == {"v": 1}
+    assert cache.stats()["hit_rate"] == 0.5
+
+def test_result_cache_peek_is_not_counted():
+    cache = ResultCache(MemoryTier(8, 60))
+    cache.set("k", {"v": 1})
+    assert cache.peek("k") == {"v": 1}
+    assert cache.peek("missing") is None
+    assert (cache.hits, cache.disk_hits, cache.misses) == (0, 0, 0)
+
+def test_result_cache_drops_results_whose_artifacts_were_swept():
+    cache = ResultCache(MemoryTier(8, 60))
+    cache.set("k", {"piechart_url": "/static/results/00/swept.png"})
+    assert cache.get("k") is None
+
+def test_directory_tier_concurrent_writes_of_one_key(tmp_path):
+    tier = DirectoryTier(str(tmp_path / "results"), ttl=60, max_bytes=1 << 20)
+    values = [{"v": i, "pad": "x" * 10000} for i in range(32)]
+    with ThreadPoolExecutor(8) as pool:
+        list(pool.map(lambda value: tier.set("k", value), values))
+    assert tier.get("k") in values
+    assert os.listdir(os.path.dirname(tier.file_for("k"))) == [os.path.basename(tier.file_for("k"))]
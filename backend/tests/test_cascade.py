@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+import torch
+import model
+from model import CATEGORIES, ENSEMBLES, SCREENS, cascade_predict_batch, uncertain_rows
+
+ORIGINAL = CATEGORIES.index("original")
+
+class Logits(torch.nn.Module):
+    # Inputs are the logits themselves
+    def forward(self, x):
+        return x
+
+class Constant(torch.nn.Module):
+    def __init__(self, probs):
+        super().__init__()
+        self.logits = torch.log(torch.tensor(probs, dtype=torch.float32))
+
+    def forward(self, x):
+        return self.logits.expand(x.shape[0], -1)
+
+def probs_with_tampered(tampered):
+    # Rows whose tampered score (1 - P(original)) is each value, the rest on "deepfake"
+    probs = np.zeros((len(tampered), len(CATEGORIES)), dtype=np.float32)
+    probs[:, ORIGINAL] = 1 - np.asarray(tampered)
+    probs[:, 0] = tampered
+    return probs
+
+ENSEMBLE_PROBS = [0.2, 0.2, 0.2, 0.2, 0.2]
+
+@pytest.fixture
+def cascade(monkeypatch):
+    monkeypatch.setattr(model, "CASCADE", "on")
+    monkeypatch.setattr(model, "_failed_screens", set())
+    models = {SCREENS["image"]: Logits()}
+    models.update({name: Constant(ENSEMBLE_PROBS) for name in ENSEMBLES["image"]})
+    monkeypatch.setattr(model, "_models", models)
+    monkeypatch.setitem(model.CASCADE_BANDS, "image", (0.1, 0.9))
+    return models
+
+def test_uncertain_rows_follow_the_band(cascade):
+    probs = probs_with_tampered([0.05, 0.15, 0.5, 0.85, 0.95])
+    assert uncertain_rows("image", probs).tolist() == [False, True, True, True, False]
+    assert uncertain_rows("image", probs, (0.2, 0.8)).tolist() == [False, False, True, False, False]
+
+def test_confident_rows_keep_the_screen_answer(cascade):
+    tampered = [0.01, 0.5, 0.99, 0.3]
+    x = torch.from_numpy(np.log(probs_with_tampered(tampered) + 1e-7))
+    probs, screened = cascade_predict_batch("image", x)
+    assert screened.tolist() == [True, False, True, False]
+    np.testing.assert_allclose(probs[screened, ORIGINAL], [0.99, 0.01], atol=1e-4)
+    np.testing.assert_allclose(probs[~screened], [ENSEMBLE_PROBS] * 2, atol=1e-5)
+
+def test_cascade_off_runs_the_ensemble_only(cascade, monkeypatch):
+    monkeypatch.setattr(model, "CASCADE", "off")
+    x = torch.from_numpy(np.log(probs_with_tampered([0.01, 0.99]) + 1e-7))
+    probs, screened = cascade_predict_batch("image", x)
+    assert not screened.any()
+    np.testing.assert_allclose(probs, [ENSEMBLE_PROBS] * 2, atol=1e-5)
+
+def test_unloadable_screen_falls_back_to_the_ensemble(cascade, monkeypatch):
+    del cascade[SCREENS["image"]]
+
+    def load(name):
+        raise RuntimeError("size mismatch for fc.weight\nmore detail")
+    monkeypatch.setattr(model, "_load_warm", load)
+    x = torch.from_numpy(np.log(probs_with_tampered([0.01, 0.99]) + 1e-7))
+    probs, screened = cascade_predict_batch("image", x)
+    assert not screened.any()
+    np.testing.assert_allclose(probs, [ENSEMBLE_PROBS] * 2, atol=1e-5)
+    assert "image" in model._failed_screens
+    assert not model.cascade_enabled("image")
@@ -0,0 +1,18 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+import charts
+from artifacts import ArtifactStore
+
+def test_concurrent_renders_of_one_chart(tmp_path, monkeypatch):
+    store = ArtifactStore(str(tmp_path / "static"), str(tmp_path / "index.sqlite3"), {"results": 60}, 1 << 30, 3600)
+    monkeypatch.setattr(charts, "artifact_store", store)
+    probs = [0.1, 0.2, 0.3, 0.15, 0.25]
+    with ThreadPoolExecutor(8) as pool:
+        urls = set(pool.map(lambda _: charts.render_piechart(probs), range(16)))
+    assert len(urls) == 1
+    folder = os.path.dirname(store.path_for("results", os.path.basename(urls.pop())))
+    files = os.listdir(folder)
+    assert len(files) == 1 and files[0].endswith(".png")
+    with Image.open(os.path.join(folder, files[0])) as img:
+        assert img.size == (charts.WIDTH, charts.HEIGHT)
@@ -0,0 +1,49 @@
+from types import SimpleNamespace
+import numpy as np
+import torch
+from detect_text import predict_sentences
+from model import CATEGORIES
+
+class WordTokenizer:
+    # One token per word, padded with 0
+    def __call__(self, sentences, truncation=True):
+        return {"input_ids": [[1] * len(s.split()) for s in sentences]}
+
+    def pad(self, encoded, return_tensors="pt"):
+        ids = encoded["input_ids"]
+        width = max(len(i) for i in ids)
+        padded = torch.tensor([i + [0] * (width - len(i)) for i in ids])
+        return {"input_ids": padded, "attention_mask": (padded > 0).long()}
+
+class LengthModel:
+    # Logits depend only on each row's unpadded length; records the padded batch shapes
+    def __init__(self):
+        self.shapes = []
+
+    def __call__(self, input_ids, attention_mask):
+        self.shapes.append(tuple(input_ids.shape))
+        logits = torch.zeros(len(input_ids), len(CATEGORIES))
+        logits[:, 0] = attention_mask.sum(dim=1).float() / 4
+        return SimpleNamespace(logits=logits)
+
+def expected(lengths):
+    logits = torch.zeros(len(lengths), len(CATEGORIES))
+    logits[:, 0] = torch.tensor(lengths, dtype=torch.float32) / 4
+    return torch.softmax(logits, dim=1).numpy()
+
+def test_probabilities_come_back_in_input_order():
+    lengths = [7, 1, 12, 3, 3, 9, 2, 15, 5]
+    sentences = [" ".join(["word"] * n) for n in lengths]
+    model = LengthModel()
+    probs = predict_sentences(WordTokenizer(), model, sentences, token_budget=24)
+    np.testing.assert_allclose(probs, expected(lengths), rtol=1e-6)
+    # Several length-sorted batches, each within the padded token budget
+    assert len(model.shapes) > 1
+    assert all(rows * width <= 24 for rows, width in model.shapes)
+    assert [width for _, width in model.shapes] == sorted(width for _, width in model.shapes)
+
+def test_a_sentence_longer_than_the_budget_gets_its_own_batch():
+    model = LengthModel()
+    probs = predict_sentences(WordTokenizer(), model, ["a b c d e f", "a"], token_budget=4)
+    np.testing.assert_allclose(probs, expected([6, 1]), rtol=1e-6)
+    assert model.shapes == [(1, 1), (1, 6)]
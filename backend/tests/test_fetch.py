@@ -0,0 +1,79 @@
+import hashlib
+import io
+import pytest
+from werkzeug.datastructures import FileStorage
+import fetch
+from fetch import FetchError, fetch_to_file, save_upload, write_chunks
+
+class FakeResponse:
+    def __init__(self, body, headers=None, status_code=200):
+        self.body = body
+        self.headers = headers or {}
+        self.status_code = status_code
+        self.read = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def iter_content(self, size):
+        for start in range(0, len(self.body), size):
+            self.read += size
+            yield self.body[start:start + size]
+
+class FakeSession:
+    def __init__(self, response):
+        self.response = response
+
+    def get(self, url, stream, timeout):
+        assert stream
+        return self.response
+
+@pytest.fixture(autouse=True)
+def small_limits(monkeypatch):
+    monkeypatch.setitem(fetch.FETCH_LIMITS, "image", (1000, ("image/",)))
+    monkeypatch.setattr(fetch, "CHUNK_SIZE", 100)
+
+def test_write_chunks_within_the_limit(tmp_path):
+    path = tmp_path / "out.bin"
+    digest = write_chunks([b"a" * 600, b"", b"b" * 400], str(path), 1000)
+    assert path.read_bytes() == b"a" * 600 + b"b" * 400
+    assert digest == hashlib.sha256(path.read_bytes()).hexdigest()
+
+def test_write_chunks_over_the_limit_leaves_nothing(tmp_path):
+    path = tmp_path / "out.bin"
+    with pytest.raises(FetchError):
+        write_chunks([b"a" * 600, b"b" * 401], str(path), 1000)
+    assert list(tmp_path.iterdir()) == []
+
+def test_save_upload_enforces_the_modality_limit(tmp_path):
+    ok = FileStorage(io.BytesIO(b"x" * 1000), "ok.png")
+    assert save_upload(ok, str(tmp_path / "ok.png"), "image")
+    too_big = FileStorage(io.BytesIO(b"x" * 1001), "big.png")
+    with pytest.raises(FetchError, match="limit"):
+        save_upload(too_big, str(tmp_path / "big.png"), "image")
+    assert not (tmp_path / "big.png").exists()
+
+def test_fetch_refuses_a_declared_length_over_the_limit_unread(tmp_path):
+    response = FakeResponse(b"x" * 2000, {"Content-Type": "image/png", "Content-Length": "2000"})
+    with pytest.raises(FetchError, match="limit"):
+        fetch_to_file("http://example/a.png", str(tmp_path / "a.png"), "image", FakeSession(response))
+    assert response.read == 0
+
+def test_fetch_stops_an_undeclared_body_at_the_limit(tmp_path):
+    response = FakeResponse(b"x" * 5000, {"Content-Type": "image/png"})
+    with pytest.raises(FetchError, match="limit"):
+        fetch_to_file("http://example/a.png", str(tmp_path / "a.png"), "image", FakeSession(response))
+    assert response.read <= 1100
+    assert list(tmp_path.iterdir()) == []
+
+def test_fetch_checks_the_content_type(tmp_path):
+    response = FakeResponse(b"<html>", {"Content-Type": "text/html; charset=utf-8"})
+    with pytest.raises(FetchError, match="content type"):
+        fetch_to_file("http://example/a.png", str(tmp_path / "a.png"), "image", FakeSession(response))
+
+def test_request_limit_leaves_room_for_multipart_overhead():
+    assert fetch.request_limit("image") == 1000 + fetch.MB
+    assert fetch.max_request_bytes() == max(fetch.request_limit(m) for m in fetch.FETCH_LIMITS)
@@ -0,0 +1,65 @@
+import random
+import pytest
+import fingerprint
+from fingerprint import BITS, HashIndex
+
+def digest_for(i):
+    return f"{i:064x}"
+
+def flip(hash_pair, bits):
+    value = (hash_pair[0] << 64) | hash_pair[1]
+    for b in bits:
+        value ^= 1 << b
+    return value >> 64, value & (2 ** 64 - 1)
+
+def brute_force(entries, hi, lo, max_distance):
+    query = (hi << 64) | lo
+    found = []
+    for (h, l), digest in entries:
+        distance = bin(((h << 64) | l) ^ query).count("1")
+        if distance <= max_distance:
+            found.append((distance, digest))
+    return sorted(found)
+
+@pytest.fixture
+def index(tmp_path, monkeypatch):
+    # Small tail, so the index has both chunk tables and unindexed rows after the additions below
+    monkeypatch.setattr(fingerprint, "NEAR_DUPLICATE_TAIL_ROWS", 100)
+    rng = random.Random(0)
+    entries = [((rng.getrandbits(64), rng.getrandbits(64)), digest_for(i)) for i in range(1000)]
+    index = HashIndex(str(tmp_path / "image"))
+    for start in range(0, len(entries), 30):
+        chunk = entries[start:start + 30]
+        index.add([h for h, _ in chunk], chunk[0][1])
+    # One digest per added chunk, as each add() stores a single file's hashes
+    stored = [(h, entries[start][1]) for start in range(0, len(entries), 30) for h, _ in entries[start:start + 30]]
+    return index, stored
+
+def test_index_has_tables_and_tail(index):
+    index, stored = index
+    assert len(index) == len(stored)
+    assert 0 < index.tables.shape[1] < len(stored)
+
+@pytest.mark.parametrize("flipped", [0, 1, 5, 12])
+def test_search_finds_flipped_hashes(index, flipped):
+    index, stored = index
+    rng = random.Random(flipped)
+    for position in rng.sample(range(len(stored)), 20):
+        hash_pair, digest = stored[position]
+        hi, lo = flip(hash_pair, rng.sample(range(BITS), flipped))
+        found = index.search(hi, lo, 12)
+        assert (flipped, digest) in found
+        assert found == brute_force(stored, hi, lo, 12)
+
+def test_search_matches_brute_force_for_random_queries(index):
+    index, stored = index
+    rng = random.Random(1)
+    for _ in range(20):
+        hi, lo = rng.getrandbits(64), rng.getrandbits(64)
+        assert index.search(hi, lo, 31) == brute_force(stored, hi, lo, 31)
+
+def test_search_sees_rows_added_by_another_handle(index):
+    index, stored = index
+    other = HashIndex(index.path)
+    other.add([(1, 2)], digest_for(9999))
+    assert index.search(1, 2, 0) == [(0, digest_for(9999))]
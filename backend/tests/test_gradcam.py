@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+import torch
+import torchvision
+import gradcam
+from gradcam import ensemble_predict_with_heatmaps
+from model import CATEGORIES, ensemble_predict_batch
+
+@pytest.fixture
+def members():
+    torch.manual_seed(0)
+    return [torchvision.models.resnet18(num_classes=len(CATEGORIES)).eval() for _ in range(2)]
+
+def test_chunked_gradcam_matches_one_pass(members, monkeypatch):
+    x = torch.randn(5, 3, 64, 64)
+    weights = np.array([0.7, 0.3])
+    monkeypatch.setattr(gradcam, "GRADCAM_BATCH_SIZE", 64)
+    whole_probs, whole_maps = ensemble_predict_with_heatmaps(members, x, weights=weights)
+    monkeypatch.setattr(gradcam, "GRADCAM_BATCH_SIZE", 2)
+    probs, maps = ensemble_predict_with_heatmaps(members, x, weights=weights)
+    assert maps.shape == (5, 64, 64)
+    np.testing.assert_allclose(probs, whole_probs, atol=1e-5)
+    np.testing.assert_allclose(maps, whole_maps, atol=1e-4)
+    np.testing.assert_allclose(probs, ensemble_predict_batch(members, x, weights=weights), atol=1e-5)
+
+def test_separate_cam_model_keeps_ensemble_probabilities(members, monkeypatch):
+    monkeypatch.setattr(gradcam, "GRADCAM_BATCH_SIZE", 2)
+    x = torch.randn(3, 3, 64, 64)
+    probs, maps = ensemble_predict_with_heatmaps(members, x, cam_model=members[1])
+    np.testing.assert_allclose(probs, ensemble_predict_batch(members, x), atol=1e-5)
+    assert maps.shape == (3, 64, 64)
+    assert maps.min() >= 0 and maps.max() <= 1 + 1e-6
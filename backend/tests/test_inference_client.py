@@ -0,0 +1,58 @@
+import os
+import threading
+import time
+from multiprocessing.connection import Listener
+import pytest
+from flask import Flask
+import inference_server
+from inference_server import InferenceClient, InferenceTimeout
+
+AUTHKEY = b"test-secret-0123456789"
+
+@pytest.fixture
+def silent_server(tmp_path, monkeypatch):
+    # Accepts connections and reads requests but never answers, like a server stuck in a forward
+    monkeypatch.setattr(inference_server, "AUTHKEY", AUTHKEY)
+    address = os.path.join(str(tmp_path), "inference.sock")
+    listener = Listener(address, family="AF_UNIX", authkey=AUTHKEY)
+    received = []
+
+    def accept():
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=drain, args=(conn,), daemon=True).start()
+
+    def drain(conn):
+        while True:
+            try:
+                received.append(conn.recv())
+            except (EOFError, OSError):
+                return
+
+    threading.Thread(target=accept, daemon=True).start()
+    yield address, received
+    listener.close()
+
+def test_call_times_out_and_drops_the_connection(silent_server):
+    address, received = silent_server
+    client = InferenceClient(address, timeout=0.2)
+    start = time.monotonic()
+    with pytest.raises(InferenceTimeout):
+        client.call("predict", "text", ["a sentence"])
+    assert time.monotonic() - start < 2
+    # Not retried, and the next call starts on a fresh connection instead of reading a stale reply
+    assert len(received) == 1
+    assert client.local.conn is None
+
+def test_timeout_is_a_503():
+    app = Flask(__name__)
+
+    @app.route("/")
+    def view():
+        raise InferenceTimeout()
+
+    response = app.test_client().get("/")
+    assert response.status_code == 503
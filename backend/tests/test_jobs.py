@@ -0,0 +1,47 @@
+import pytest
+from flask import Flask
+import jobs
+from artifacts import ArtifactStore
+
+class InlineExecutor:
+    # Runs a stand-in for run_job at submit time, the worst case of the race with the response
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, job, media_path, url):
+        self.submitted.append(job)
+        job["status"] = "finished"
+        jobs.save_job(job)
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    store = ArtifactStore(str(tmp_path / "static"), str(tmp_path / "index.sqlite3"), {"jobs": 60}, 1 << 30, 3600)
+    monkeypatch.setattr(jobs, "artifact_store", store)
+    monkeypatch.setattr(jobs, "JOB_FOLDER", str(tmp_path / "jobs"))
+    monkeypatch.setattr(jobs, "JOB_QUEUE_LIMIT", 2)
+    monkeypatch.setattr(jobs, "active_jobs", 0)
+    monkeypatch.setattr(jobs, "executor", InlineExecutor())
+    app = Flask(__name__)
+    app.register_blueprint(jobs.jobs_bp, url_prefix="/api")
+    return app.test_client()
+
+def test_submit_answers_queued_even_if_the_worker_is_faster(client):
+    response = client.post("/api/jobs/video", data={"url": "http://example/a.mp4"})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body["status"] == "queued"
+    assert client.get(body["status_url"]).get_json()["status"] == "finished"
+
+def test_queue_limit_answers_429(client):
+    for _ in range(2):
+        assert client.post("/api/jobs/audio", data={"url": "http://example/a.wav"}).status_code == 202
+    response = client.post("/api/jobs/audio", data={"url": "http://example/a.wav"})
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == str(jobs.JOB_RETRY_AFTER_SECONDS)
+    assert len(jobs.executor.submitted) == 2
+
+def test_rejected_submissions_free_their_slot(client):
+    for _ in range(3):
+        assert client.post("/api/jobs/video", data={}).status_code == 400
+    assert jobs.active_jobs == 0
+    assert client.post("/api/jobs/text", data={}).status_code == 404
@@ -0,0 +1,67 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, g, jsonify
+import metrics
+from metrics import current_timings, metrics_bp, observe_stage, request_seconds, timings_to
+from streaming import stream_response
+
+def make_app():
+    app = Flask(__name__)
+    app.register_blueprint(metrics_bp)
+
+    @app.route("/stream")
+    def stream():
+        def events():
+            time.sleep(0.2)
+            yield "done", {}
+        return stream_response(events())
+
+    @app.route("/pooled")
+    def pooled():
+        target = current_timings()
+
+        def work(_):
+            with timings_to(target):
+                observe_stage("pooled_stage", 0.5)
+        with ThreadPoolExecutor(2) as pool:
+            list(pool.map(work, range(2)))
+        return jsonify(dict(g.timings))
+    return app
+
+def recorded(endpoint):
+    # -> (count, sum) of request_seconds for endpoint
+    series = request_seconds.snapshot().get((endpoint,))
+    return (0, 0.0) if series is None else (sum(series[:-1]), series[-1])
+
+def test_streamed_latency_covers_the_body():
+    client = make_app().test_client()
+    count, total = recorded("stream")
+    response = client.get("/stream")
+    response.get_data()
+    response.close()
+    assert recorded("stream")[0] == count + 1
+    assert recorded("stream")[1] - total >= 0.2
+
+def test_pool_thread_stages_reach_the_request_breakdown():
+    assert make_app().test_client().get("/pooled").get_json() == {"pooled_stage": 1.0}
+
+def test_metrics_are_summed_across_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    client = make_app().test_client()
+    client.get("/pooled")
+    mine = recorded("pooled")[0]
+    # Another worker's flush: 3 requests in the first bucket, 9 s in total
+    other = {"deepfake_request_seconds": [[["pooled"], [3] + [0] * len(metrics.SECONDS_BUCKETS) + [9.0]]]}
+    (tmp_path / "999999.json").write_text(json.dumps(other))
+    (tmp_path / "broken.json").write_text("{")
+    text = client.get("/metrics").get_data(as_text=True)
+    assert f'deepfake_request_seconds_count{{endpoint="pooled"}} {mine + 3}' in text
+
+def test_flush_round_trips(tmp_path, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_DIR", str(tmp_path))
+    make_app().test_client().get("/pooled")
+    metrics.flush_metrics()
+    flushed = metrics.load_metrics(metrics.metrics_path(os.getpid()))
+    assert flushed["deepfake_request_seconds"][("pooled",)] == request_seconds.snapshot()[("pooled",)]
@@ -0,0 +1,16 @@
+import model
+from model import ENSEMBLES, model_version
+
+def test_member_weights_version_results(monkeypatch):
+    monkeypatch.setattr(model, "weights_fingerprint", lambda name: "w")
+    monkeypatch.setattr(model, "CASCADE", "off")
+    monkeypatch.setattr(model, "ENSEMBLE_WEIGHTS", {})
+    first, second = ENSEMBLES["image"]
+    default = model_version("image")
+    monkeypatch.setitem(model.ENSEMBLE_WEIGHTS, first, 3.0)
+    reweighted = model_version("image")
+    assert reweighted != default
+    # Only the normalized shares matter
+    monkeypatch.setitem(model.ENSEMBLE_WEIGHTS, first, 6.0)
+    monkeypatch.setitem(model.ENSEMBLE_WEIGHTS, second, 2.0)
+    assert model_version("image") == reweighted
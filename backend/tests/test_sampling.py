@@ -0,0 +1,56 @@
+import math
+import numpy as np
+import pytest
+from model import CATEGORIES
+from sampling import AdaptiveSampler, Candidate, sampling_plan
+
+ORIGINAL = CATEGORIES.index("original")
+
+def alternating_scores(scored):
+    # Neighbouring candidates disagree everywhere, so refinement always wants more forwards
+    def score(candidates):
+        scored.extend(c.frame_idx for c in candidates)
+        probs = np.zeros((len(candidates), len(CATEGORIES)), dtype=np.float32)
+        for row, c in zip(probs, candidates):
+            row[ORIGINAL if c.frame_idx % 2 else 0] = 1.0
+        return probs
+    return score
+
+def run_video(sampler, total, group=256):
+    results = []
+    for start in range(0, total, group):
+        if sampler.exhausted:
+            break
+        candidates = [Candidate(i, i / 2, None, 0.0) for i in range(start, min(start + group, total))]
+        results += sampler.run(candidates)
+    return results
+
+@pytest.mark.parametrize("budget", [5, 20, 60])
+def test_budget_holds_when_length_is_unknown(budget):
+    scored = []
+    sampler = AdaptiveSampler(alternating_scores(scored), 8, budget)
+    results = run_video(sampler, 1000)
+    assert sampler.forwards == len(scored) <= budget
+    assert len(set(scored)) == len(scored)
+    assert [c.frame_idx for c, _ in results] == sorted(set(scored))
+
+@pytest.mark.parametrize("budget", [40, 100])
+def test_budget_leaves_room_for_later_anchors(budget):
+    total = 1000
+    scored = []
+    stride, budget = sampling_plan(total, budget, mode="adaptive")
+    sampler = AdaptiveSampler(alternating_scores(scored), stride, budget, total=total)
+    results = run_video(sampler, total)
+    assert sampler.forwards == len(scored) <= budget
+    # Reserving the anchors of later groups keeps coverage up to the last candidate
+    assert results[-1][0].frame_idx == total - 1
+    gaps = np.diff([c.frame_idx for c, _ in results])
+    assert gaps.max() <= stride
+
+def test_fixed_mode_scores_every_candidate():
+    scored = []
+    stride, budget = sampling_plan(300, mode="fixed")
+    sampler = AdaptiveSampler(alternating_scores(scored), stride, budget, total=300)
+    results = run_video(sampler, 300, group=64)
+    assert budget == math.inf
+    assert [c.frame_idx for c, _ in results] == list(range(300))
@@ -0,0 +1,29 @@
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+from streaming import stream_response
+
+def make_app(closed):
+    app = Flask(__name__)
+
+    @app.route("/stream")
+    def stream():
+        def events():
+            yield "item", {"n": 1}
+            yield "done", {}
+        return stream_response(events(), on_close=lambda: closed.append(True))
+    return app
+
+def test_on_close_runs_after_the_stream():
+    closed = []
+    response = make_app(closed).test_client().get("/stream?format=ndjson")
+    assert response.get_data(as_text=True).splitlines() == ['{"event": "item", "n": 1}', '{"event": "done"}']
+    response.close()
+    assert closed == [True]
+
+def test_on_close_runs_when_the_body_is_never_read():
+    # As a WSGI server does when the client is gone before the first chunk: close() without iterating
+    closed = []
+    environ = EnvironBuilder(path="/stream").get_environ()
+    body = make_app(closed)(environ, lambda status, headers: None)
+    body.close()
+    assert closed == [True]
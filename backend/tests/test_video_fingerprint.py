@@ -0,0 +1,50 @@
+import cv2
+import numpy as np
+import pytest
+import detect_video
+from detect_video import keyframe_hashes
+from fingerprint import image_hash
+from video_decode import VideoDecoder
+
+def write_video(path, fps, size, seconds=12):
+    # A bright square drifting over a gradient, changing background every 3 seconds
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"mp4v"), fps, size)
+    w, h = size
+    for i in range(int(seconds * fps)):
+        t = i / fps
+        frame = np.zeros((h, w, 3), dtype=np.uint8)
+        frame[:] = np.linspace(0, 255, w, dtype=np.uint8)[None, :, None]
+        frame[..., int(t // 3) % 3] //= 3
+        x, y = int((0.1 + 0.06 * t) * w), int((0.2 + 0.04 * t) * h)
+        cv2.rectangle(frame, (x, y), (x + w // 5, y + h // 5), (255, 255, 255), -1)
+        writer.write(frame)
+    writer.release()
+    return path
+
+def distance(a, b):
+    return bin(a[0] ^ b[0]).count("1") + bin(a[1] ^ b[1]).count("1")
+
+@pytest.fixture(autouse=True)
+def near_duplicates(monkeypatch):
+    monkeypatch.setattr(detect_video, "NEAR_DUPLICATES", True)
+
+def test_keyframes_are_decoder_candidates(tmp_path):
+    path = write_video(str(tmp_path / "a.mp4"), 10, (320, 240))
+    decoder = VideoDecoder(path, size=(224, 224), threaded=False)
+    try:
+        candidates = [image_hash(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)) for _, _, frame, _ in decoder]
+    finally:
+        decoder.close()
+    hashes = keyframe_hashes(path, count=8)
+    assert len(candidates) == 24
+    assert hashes == [candidates[int((i + 0.5) * 24 / 8)] for i in range(8)]
+
+def test_reencodes_land_on_the_same_moments(tmp_path):
+    original = keyframe_hashes(write_video(str(tmp_path / "a.mp4"), 10, (320, 240)))
+    reencoded = keyframe_hashes(write_video(str(tmp_path / "b.mp4"), 24, (640, 480)))
+    assert len(original) == len(reencoded)
+    assert all(distance(a, b) <= 12 for a, b in zip(original, reencoded))
+
+def test_short_videos_hash_every_candidate(tmp_path):
+    path = write_video(str(tmp_path / "a.mp4"), 10, (320, 240), seconds=2)
+    assert len(keyframe_hashes(path, count=8)) == 4
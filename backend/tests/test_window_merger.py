@@ -0,0 +1,22 @@
+import numpy as np
+from detect_audio import SLOT_SECONDS, SLOTS_PER_WINDOW, WindowMerger
+
+def test_slots_average_every_window_covering_them():
+    merger = WindowMerger()
+    windows = [np.full(2, float(k)) for k in range(5)]
+    released = []
+    for k, probs in enumerate(windows):
+        released += merger.add(k, probs)
+    released += merger.release()
+    assert len(released) == len(windows) + SLOTS_PER_WINDOW - 1
+    for j, (start, end, probs) in enumerate(released):
+        covering = [k for k in range(len(windows)) if k <= j < k + SLOTS_PER_WINDOW]
+        assert (start, end) == (j * SLOT_SECONDS, (j + 1) * SLOT_SECONDS)
+        np.testing.assert_allclose(probs, np.mean([windows[k] for k in covering], axis=0))
+
+def test_slots_are_released_once_no_later_window_covers_them():
+    merger = WindowMerger()
+    assert merger.add(0, np.ones(2)) == []
+    released = merger.add(1, np.ones(2))
+    assert [start for start, _, _ in released] == [0.0]
+    assert all(j >= 1 for j in merger.slots)
@@ -0,0 +1,94 @@
+import os
+import re
+import copy
+import threading
+from collections import OrderedDict
+import numpy as np
+from metrics import sentence_memo_lookups
+
+# Text preprocessing shared by /api/detect-text, jobs and batch runs: sentence segmentation with
+# precompiled patterns, per-thread tokenizer copies, and a memo of per-sentence probabilities so
+# boilerplate that recurs across articles (disclaimers, bylines, stock quotes) is scored once.
+
+# ---------- Settings (override via environment) ----------
+# Sentences remembered per worker; 0 disables the memo
+TEXT_MEMO_ITEMS = int(os.environ.get("TEXT_MEMO_ITEMS", "100000"))
+# --------------------------------------------------
+
+SENTENCE_SPLIT = re.compile(r'[.!?\n]+')
+WHITESPACE = re.compile(r'\s+')
+
+def get_sentences(text):
+    text = text.replace('\r\n', '\n')
+    # Use period/newline as splitter
+    return [s.strip() for s in SENTENCE_SPLIT.split(text) if s.strip()]
+
+def normalize_sentence(sentence):
+    return WHITESPACE.sub(" ", sentence).strip()
+
+_tokenizers = threading.local()
+
+def thread_tokenizer(tokenizer):
+    # Fast tokenizers keep truncation/padding state in the underlying Rust object and fail with
+    # "Already borrowed" when two threads encode at once, so each thread keeps its own copy, made once
+    copies = getattr(_tokenizers, "copies", None)
+    if copies is None:
+        copies = _tokenizers.copies = {}
+    entry = copies.get(id(tokenizer))
+    if entry is None or entry[0] is not tokenizer:
+        if len(copies) > 8:  # copies of tokenizers replaced by model reloads
+            copies.clear()
+        entry = copies[id(tokenizer)] = (tokenizer, copy.deepcopy(tokenizer))
+    return entry[1]
+
+class SentenceMemo:
+    # Bounded LRU of probabilities keyed on (model version, normalized sentence). A reload changes the
+    # version, so stale entries are never returned and simply age out.
+    def __init__(self, max_items):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def predict(self, sentences, predict, version):
+        # probs [N, C] for sentences; predict(list of sentences) -> probs is only called for the distinct
+        # sentences neither remembered nor repeated earlier in this call
+        if self.max_items <= 0:
+            return predict(sentences)
+        keys = [(version, normalize_sentence(s)) for s in sentences]
+        found = {}
+        with self.lock:
+            for key in keys:
+                if key not in found and key in self.items:
+                    self.items.move_to_end(key)
+                    found[key] = self.items[key]
+        missing = {}
+        for i, key in enumerate(keys):
+            if key not in found:
+                missing.setdefault(key, i)
+        if missing:
+            fresh = predict([sentences[i] for i in missing.values()])
+            with self.lock:
+                for key, probs in zip(missing, fresh):
+                    found[key] = self.items[key] = np.array(probs, dtype=np.float32)
+                while len(self.items) > self.max_items:
+                    self.items.popitem(last=False)
+        hits = len(sentences) - len(missing)
+        with self.lock:
+            self.hits += hits
+            self.misses += len(missing)
+        sentence_memo_lookups.inc(hits, result="hit")
+        sentence_memo_lookups.inc(len(missing), result="miss")
+        return np.stack([found[key] for key in keys])
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "items": len(self.items),
+        }
+
+sentence_memo = SentenceMemo(TEXT_MEMO_ITEMS)
@@ -0,0 +1,182 @@
+import os
+import math
+import time
+import queue
+import threading
+import cv2
+import numpy as np
+from sampling import frame_change, thumbnail
+
+# Video decoding for the scoring pipeline. A decoder thread grabs frames, picks candidates by presentation
+# time, converts and resizes them with OpenCV into a ring of preallocated uint8 slots, and hands slot indices
+# to the consumer through a queue. The ring bounds memory and lets decode overlap the forward pass
+# (OpenCV releases the GIL while decoding and resizing).
+
+# ---------- Settings (override via environment) ----------
+# Candidate frames per second of video
+VIDEO_CANDIDATE_FPS = float(os.environ.get("VIDEO_CANDIDATE_FPS", "2"))
+# "1" decodes on a separate thread, "0" decodes inline on the consumer thread
+VIDEO_DECODE_THREAD = os.environ.get("VIDEO_DECODE_THREAD", "1") == "1"
+# Ring slots decoded ahead of the consumer...
+VIDEO_DECODE_QUEUE = int(os.environ.get("VIDEO_DECODE_QUEUE", "32"))
+# ...and at most this many bytes of them (full-resolution slots are used when faces are tracked)
+VIDEO_DECODE_QUEUE_BYTES = int(os.environ.get("VIDEO_DECODE_QUEUE_BYTES", str(64 * 1024 * 1024)))
+# Ask the backend for hardware decoding (OpenCV >= 4.5.2 with FFmpeg; silently software otherwise)
+VIDEO_HW_DECODE = os.environ.get("VIDEO_HW_DECODE", "1") == "1"
+# Frame rate assumed when the container reports none and carries no timestamps
+FALLBACK_FPS = 25.0
+# --------------------------------------------------
+
+def open_capture(video_path):
+    if VIDEO_HW_DECODE and hasattr(cv2, "VIDEO_ACCELERATION_ANY"):
+        cap = cv2.VideoCapture(video_path, cv2.CAP_ANY, [cv2.CAP_PROP_HW_ACCELERATION, cv2.VIDEO_ACCELERATION_ANY])
+        if cap.isOpened():
+            return cap
+        cap.release()
+    return cv2.VideoCapture(video_path)
+
+def probe(cap):
+    # -> (fps, duration in seconds), each None when the container reports 0, NaN or an implausible value
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    fps = fps if math.isfinite(fps) and 1 <= fps <= 1000 else None
+    frames = frames if math.isfinite(frames) and frames > 0 else None
+    return fps, (frames / fps if fps and frames else None)
+
+class VideoDecoder:
+    # Iterating yields (frame_idx, timestamp_sec, frame, delta) for frames 1/VIDEO_CANDIDATE_FPS apart in
+    # presentation time, delta being the change from the previous candidate (0..1). With size=(w, h) frames are
+    # resized in the decoder, otherwise they are full-resolution BGR. A frame is a ring slot and only valid
+    # until the next one is requested: consumers copy what they keep.
+    def __init__(self, video_path, size=None, threaded=VIDEO_DECODE_THREAD):
+        self.cap = open_capture(video_path)
+        self.fps, self.duration = probe(self.cap)
+        self.size = size
+        self.threaded = threaded
+        self.buffers = None
+        self.decode_seconds = 0.0  # spent grabbing, converting and resizing
+        self.wait_seconds = 0.0    # the consumer spent waiting for a frame
+        self.stop = threading.Event()
+        self.thread = None
+
+    @property
+    def total_candidates(self):
+        # Estimate for sampling plans and progress; 0 when the container doesn't say how long it is
+        return math.ceil(self.duration * VIDEO_CANDIDATE_FPS) if self.duration else 0
+
+    def allocate(self, shape):
+        frame_bytes = int(np.prod(shape))
+        slots = max(2, min(VIDEO_DECODE_QUEUE, VIDEO_DECODE_QUEUE_BYTES // frame_bytes)) if self.threaded else 1
+        self.buffers = np.empty((slots,) + shape, dtype=np.uint8)
+        return slots
+
+    def read_into(self, slot, scratch):
+        # Colour-converts the grabbed frame into the slot (resizing it if needed); returns the scratch buffer
+        buffer = self.buffers[slot]
+        if self.size:
+            ok, scratch = self.cap.retrieve(scratch)
+            if ok:
+                cv2.resize(scratch, self.size, dst=buffer, interpolation=cv2.INTER_AREA)
+            return ok, scratch
+        ok, frame = self.cap.retrieve(buffer)
+        if ok and frame is not buffer:
+            if frame.shape == buffer.shape:
+                np.copyto(buffer, frame)
+            else:  # resolution changed mid-stream
+                cv2.resize(frame, (buffer.shape[1], buffer.shape[0]), dst=buffer, interpolation=cv2.INTER_AREA)
+        return ok, scratch
+
+    def decode(self, acquire, on_allocate):
+        # Yields (frame_idx, timestamp, slot, delta); acquire() -> free slot index, or None to stop
+        interval = 1.0 / VIDEO_CANDIDATE_FPS
+        next_time, last_time, origin = 0.0, 0.0, None
+        frame_idx, prev_thumb, scratch = -1, None, None
+        while not self.stop.is_set():
+            start = time.perf_counter()
+            if not self.cap.grab():
+                break
+            frame_idx += 1
+            # Presentation time when the backend reports it, counted from the first frame; otherwise the
+            # frame index over the reported (or assumed) fps. Never goes backwards.
+            msec = self.cap.get(cv2.CAP_PROP_POS_MSEC)
+            if math.isfinite(msec) and (msec > 0 or frame_idx == 0):
+                origin = msec / 1000.0 if origin is None else origin
+                timestamp = msec / 1000.0 - origin
+            else:
+                timestamp = frame_idx / (self.fps or FALLBACK_FPS)
+            timestamp = last_time = max(timestamp, last_time)
+            if timestamp + 1e-6 < next_time:
+                self.decode_seconds += time.perf_counter() - start
+                continue
+            next_time = (math.floor(timestamp / interval + 1e-6) + 1) * interval
+            if self.buffers is None:
+                ok, frame = self.cap.retrieve()
+                if not ok:
+                    break
+                on_allocate(self.allocate(self.size[::-1] + (3,) if self.size else frame.shape))
+                scratch = frame
+            self.decode_seconds += time.perf_counter() - start
+            slot = acquire()
+            if slot is None:
+                return
+            start = time.perf_counter()
+            ok, scratch = self.read_into(slot, scratch)
+            if not ok:
+                break
+            thumb = thumbnail(self.buffers[slot])
+            delta = frame_change(prev_thumb, thumb)
+            prev_thumb = thumb
+            self.decode_seconds += time.perf_counter() - start
+            yield frame_idx, timestamp, slot, delta
+
+    def __iter__(self):
+        if not self.threaded:
+            for frame_idx, timestamp, slot, delta in self.decode(lambda: 0, lambda slots: None):
+                yield frame_idx, timestamp, self.buffers[slot], delta
+            return
+
+        ready = queue.Queue()  # bounded by the ring: the decoder only runs ahead while it holds free slots
+        free = queue.Queue()
+
+        def acquire():
+            while not self.stop.is_set():
+                try:
+                    return free.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            return None
+
+        def on_allocate(slots):
+            for i in range(slots):
+                free.put(i)
+
+        def run():
+            try:
+                for item in self.decode(acquire, on_allocate):
+                    ready.put(item)
+                ready.put(None)
+            except Exception as e:
+                ready.put(e)
+
+        self.thread = threading.Thread(target=run, name="video-decode", daemon=True)
+        self.thread.start()
+        held = None
+        while True:
+            if held is not None:
+                free.put(held)  # the consumer is done with the previous frame
+                held = None
+            start = time.perf_counter()
+            item = ready.get()
+            self.wait_seconds += time.perf_counter() - start
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            frame_idx, timestamp, held, delta = item
+            yield frame_idx, timestamp, self.buffers[held], delta
+
+    def close(self):
+        self.stop.set()
+        if self.thread is not None:
+            self.thread.join()
+        self.cap.release()